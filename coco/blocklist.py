@@ -227,11 +227,15 @@ class Blocklist:
     def hosts(self) -> List[Host]:
         """Get the blocklisted hosts.
 
+        Picks up changes made to the blocklist by other worker processes.
+
         Returns
         -------
         hosts
             List of blocklisted hosts.
         """
+        if self._state.refresh():
+            self._build_hosts()
         return self._hosts
 
     def add_known_hosts(self, hosts: Iterable[Host]):
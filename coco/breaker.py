@@ -0,0 +1,190 @@
+"""Circuit breakers for hosts that stopped answering."""
+
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from .exceptions import ConfigError
+from .result import Result
+from .util import Host, str2total_seconds
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+HALF_OPEN = "half-open"
+OPEN = "open"
+STATES = (CLOSED, HALF_OPEN, OPEN)
+
+# Status of calls that weren't sent because the breaker of the host is open
+OPEN_STATUS = -1
+OPEN_REPLY = "Circuit breaker open"
+
+
+class _Breaker:
+    """State of the breaker of one host."""
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+
+
+class CircuitBreakers:
+    """
+    Circuit breakers for all hosts.
+
+    A host that failed `failures` times in a row (connection error or timeout) is cut off:
+    its breaker opens and calls to it fail right away without being sent. After `cooldown`
+    seconds the breaker is half-open and the next call is sent to probe the host. If the
+    host replies, the breaker closes again, otherwise it stays open for another cooldown.
+    Any reply, whatever the status, counts as success.
+
+    This is separate from the :class:`coco.blocklist.Blocklist`, which is only changed by
+    operators. Each worker process has its own breakers.
+
+    Parameters
+    ----------
+    failures : int
+        Number of failed calls in a row that open the breaker of a host.
+    cooldown : float
+        Seconds to wait before probing a host with an open breaker.
+    """
+
+    def __init__(self, failures: int = 5, cooldown: float = 30.0):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._breakers = {}
+
+    @classmethod
+    def from_config(cls, conf: dict):
+        """
+        Load from the `circuit_breaker` block of the coco config.
+
+        Parameters
+        ----------
+        conf : dict
+            The config block with the optional keys `failures` and `cooldown`.
+
+        Returns
+        -------
+        :class:`CircuitBreakers`
+            The circuit breakers.
+        """
+        if not isinstance(conf, dict):
+            raise ConfigError(
+                f"Value 'circuit_breaker' is of type '{type(conf).__name__}' (expected "
+                f"dict)."
+            )
+        default = cls()
+        failures = conf.get("failures", default.failures)
+        if not isinstance(failures, int) or failures < 1:
+            raise ConfigError(
+                f"Value 'circuit_breaker/failures' is '{failures}' (expected an integer "
+                f">= 1)."
+            )
+        try:
+            cooldown = str2total_seconds(conf.get("cooldown", default.cooldown))
+        except ValueError as e:
+            raise ConfigError(
+                f"Failed parsing value 'circuit_breaker/cooldown': {e}"
+            ) from e
+        return cls(failures, cooldown)
+
+    def allow(self, host: Host) -> bool:
+        """
+        Tell if a call to a host may be sent.
+
+        A half-open breaker lets one call through at a time. Report how every call that was
+        let through ended with :meth:`record`.
+
+        Parameters
+        ----------
+        host : :class:`Host`
+            The host.
+
+        Returns
+        -------
+        bool
+            `False` if the call should fail right away.
+        """
+        breaker = self._breakers.get(host)
+        if breaker is None or breaker.state == CLOSED:
+            return True
+        if breaker.state == OPEN:
+            if time.monotonic() - breaker.opened < self.cooldown:
+                return False
+            breaker.state = HALF_OPEN
+        if breaker.probing:
+            return False
+        breaker.probing = True
+        return True
+
+    def record(self, host: Host, success: Optional[bool]):
+        """
+        Report how a call to a host ended.
+
+        Parameters
+        ----------
+        host : :class:`Host`
+            The host.
+        success : bool
+            `True` if the host replied, `False` for a connection error or a timeout, `None`
+            if the call was cancelled.
+        """
+        breaker = self._breakers.setdefault(host, _Breaker())
+        if success is None:
+            breaker.probing = False
+        elif success:
+            if breaker.state != CLOSED:
+                logger.info(f"Closing the circuit breaker of {host}: it replied again.")
+            breaker.state = CLOSED
+            breaker.failures = 0
+            breaker.probing = False
+        else:
+            breaker.failures += 1
+            if breaker.state == HALF_OPEN or breaker.failures >= self.failures:
+                if breaker.state == CLOSED:
+                    logger.warning(
+                        f"Opening the circuit breaker of {host} after "
+                        f"{breaker.failures} failed calls in a row."
+                    )
+                breaker.state = OPEN
+                breaker.opened = time.monotonic()
+                breaker.probing = False
+
+    def states(self) -> Dict[Host, str]:
+        """
+        Get the states of the breakers.
+
+        Returns
+        -------
+        dict
+            The state of each host that was called, one of `STATES`.
+        """
+        return {host: breaker.state for host, breaker in self._breakers.items()}
+
+    async def process_get(self, _):
+        """
+        Process the GET request.
+
+        Every worker process keeps its own breakers, the reply only has the ones of the
+        process that handled the request and its process ID.
+        """
+        return Result(
+            "circuit-breakers",
+            result={
+                Host("coco"): (
+                    {
+                        "pid": os.getpid(),
+                        "breakers": {
+                            f"{host}": {"state": b.state, "failures": b.failures}
+                            for host, b in self._breakers.items()
+                        },
+                    },
+                    200,
+                )
+            },
+            type_="FULL",
+        )
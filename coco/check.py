@@ -2,7 +2,7 @@
 
 import logging
 from pydoc import locate
-from typing import Dict
+from typing import Dict, Iterable, List, Tuple
 
 from deepdiff import DeepDiff
 
@@ -56,6 +56,34 @@ class Check:
         """
         return self._name
 
+    def state_access(self) -> Dict[str, bool]:
+        """
+        List the parts of the state this check reads or writes.
+
+        Returns
+        -------
+        dict
+            Keys are state paths, values are `True` if the check writes there.
+        """
+        if self.save_to_state:
+            return {self.save_to_state: True}
+        return {}
+
+    def linked_endpoints(self) -> List[str]:
+        """
+        List the coco endpoints this check may call.
+
+        Returns
+        -------
+        list of str
+            Names of the `on_failure` endpoints.
+        """
+        return [
+            name
+            for name in (self.on_failure_call, self.on_failure_call_single_host)
+            if name
+        ]
+
     async def run(self, result):
         """Run the check."""
         raise NotImplementedError(
@@ -185,12 +213,50 @@ class IdenticalReplyCheck(ReplyCheck):
         return True
 
 
-class ValueReplyCheck(ReplyCheck):
-    """Check for certain values in the replies."""
+class HostReplyCheck(ReplyCheck):
+    """
+    Check on the reply of each host on its own.
 
-    def __init__(self, name, expected_values: Dict, *args, **kwargs):
-        self.expected_values = expected_values
-        super().__init__(name, *args, **kwargs)
+    The replies can be checked all at once with :meth:`run` or one by one as they arrive
+    with a :class:`ReplyStream`.
+    """
+
+    # Start of the log message listing the hosts that failed
+    _failure_message = "Check reply failed"
+
+    def begin(self) -> Dict:
+        """
+        Start checking the replies of one forward call.
+
+        Returns
+        -------
+        dict
+            Cache for anything that is the same for all replies, passed to
+            :meth:`check_host`.
+        """
+        return {}
+
+    def check_host(self, host: Host, reply, cache: Dict) -> List[Tuple[str, str]]:
+        """
+        Check the reply of one host.
+
+        Not implemented. Use a sub class of this.
+
+        Parameters
+        ----------
+        host : :class:`Host`
+            The host that sent the reply.
+        reply
+            The reply.
+        cache : dict
+            What :meth:`begin` returned.
+
+        Returns
+        -------
+        list of (str, str)
+            Failure type and name of the value for each failure, empty if the reply passed.
+        """
+        raise NotImplementedError("Use a sub class of this.")
 
     async def run(self, result: Result):
         """
@@ -206,59 +272,121 @@ class ValueReplyCheck(ReplyCheck):
         bool
             True if the check passed, otherwise False.
         """
-        failed_hosts = set()
-
         reply = {}
         for r in result.results.values():
             if r:
                 reply.update(r)
 
+        cache = self.begin()
+        failures = {}
         for host, result_ in reply.items():
-            if not result_ or not isinstance(result_, dict):
-                for name in self.expected_values.keys():
-                    logger.debug(
-                        f"/{self._name}: Missing value '{name}' in reply from {host} "
-                        f"({result_})."
-                    )
-                    failed_hosts.add(host)
-                    result.report_failure(self._name, host, "missing", name)
-                continue
-            for name, value in result_.items():
-                if name not in self.expected_values:
-                    logger.debug(
-                        f"Found additional value in reply from {host}/{self._name}: ({name}: {value})"
-                    )
-                    continue
-                if value != self.expected_values[name]:
-                    logger.debug(
-                        f"/{self._name}: Bad value '{name}' in reply from {host}."
-                    )
-                    logger.debug(
-                        f"Expected {self.expected_values[name]} but found {value}."
-                    )
-                    failed_hosts.add(host)
-                    result.report_failure(self._name, host, "value", name)
-            for name in self.expected_values.keys():
-                if name not in result_.keys():
-                    logger.debug(
-                        f"/{self._name}: Missing value '{name}' in reply from {host}."
-                    )
-                    failed_hosts.add(host)
-                    result.report_failure(self._name, host, "missing", name)
-        if failed_hosts:
+            failures_host = self.check_host(host, result_, cache)
+            if failures_host:
+                failures[host] = failures_host
+        return await self.finish(result, failures)
+
+    async def finish(
+        self,
+        result: Result,
+        failures: Dict[Host, List[Tuple[str, str]]],
+    ):
+        """
+        Report the failures of a checked reply and run the `on_failure` actions.
+
+        Parameters
+        ----------
+        result : :class:`Result`
+            The checked reply.
+        failures : dict
+            Failures (see :meth:`check_host`) of the hosts that failed.
+
+        Return
+        ------
+        bool
+            True if the check passed, otherwise False.
+        """
+        for host, failures_host in failures.items():
+            for failure_type, name in failures_host:
+                result.report_failure(self._name, host, failure_type, name)
+        if failures:
             logger.info(
-                f"/{self._name}: Check reply for values failed: {[host.url() for host in failed_hosts]}"
+                f"/{self._name}: {self._failure_message}: "
+                f"{[host.url() for host in failures]}"
             )
-            self._warn_num_hosts(len(failed_hosts))
-            result.add_result(await self.on_failure(failed_hosts))
+            self._warn_num_hosts(len(failures))
+            result.add_result(await self.on_failure(list(failures)))
             return False
+
+        reply = {}
+        for r in result.results.values():
+            if r:
+                reply.update(r)
         self._save_reply(reply)
         return True
 
 
-class TypeReplyCheck(ReplyCheck):
+class ValueReplyCheck(HostReplyCheck):
+    """Check for certain values in the replies."""
+
+    _failure_message = "Check reply for values failed"
+
+    def __init__(self, name, expected_values: Dict, *args, **kwargs):
+        self.expected_values = expected_values
+        super().__init__(name, *args, **kwargs)
+
+    def check_host(self, host: Host, reply, cache: Dict) -> List[Tuple[str, str]]:
+        """
+        Check the reply of one host for the expected values.
+
+        Parameters
+        ----------
+        host : :class:`Host`
+            The host that sent the reply.
+        reply
+            The reply.
+        cache : dict
+            Not used.
+
+        Returns
+        -------
+        list of (str, str)
+            Failure type and name of the value for each failure, empty if the reply passed.
+        """
+        failures = []
+        if not reply or not isinstance(reply, dict):
+            for name in self.expected_values.keys():
+                logger.debug(
+                    f"/{self._name}: Missing value '{name}' in reply from {host} "
+                    f"({reply})."
+                )
+                failures.append(("missing", name))
+            return failures
+        for name, value in reply.items():
+            if name not in self.expected_values:
+                logger.debug(
+                    f"Found additional value in reply from {host}/{self._name}: ({name}: {value})"
+                )
+                continue
+            if value != self.expected_values[name]:
+                logger.debug(f"/{self._name}: Bad value '{name}' in reply from {host}.")
+                logger.debug(
+                    f"Expected {self.expected_values[name]} but found {value}."
+                )
+                failures.append(("value", name))
+        for name in self.expected_values.keys():
+            if name not in reply.keys():
+                logger.debug(
+                    f"/{self._name}: Missing value '{name}' in reply from {host}."
+                )
+                failures.append(("missing", name))
+        return failures
+
+
+class TypeReplyCheck(HostReplyCheck):
     """Check for the types of fields in the replies."""
 
+    _failure_message = "Check reply for value types failed"
+
     def __init__(self, name, expected_types: Dict, *args, **kwargs):
         # Check configuration
         for valname, type_ in expected_types.items():
@@ -268,72 +396,60 @@ class TypeReplyCheck(ReplyCheck):
         self._expected_types = expected_types
         super().__init__(name, *args, **kwargs)
 
-    async def run(self, result: Result):
+    def check_host(self, host: Host, reply, cache: Dict) -> List[Tuple[str, str]]:
         """
-        Run the check on the given reply.
+        Check the types of the values in the reply of one host.
 
         Parameters
         ----------
-        result : :class:`Result`
-            The reply to check.
+        host : :class:`Host`
+            The host that sent the reply.
+        reply
+            The reply.
+        cache : dict
+            Not used.
 
-        Return
-        ------
-        bool
-            True if the check passed, otherwise False.
+        Returns
+        -------
+        list of (str, str)
+            Failure type and name of the value for each failure, empty if the reply passed.
         """
-        failed_hosts = set()
-
-        reply = {}
-        for r in result.results.values():
-            if r:
-                reply.update(r)
-
-        for host, result_ in reply.items():
-            if not result_ or not isinstance(result_, dict):
-                for name in self._expected_types.keys():
-                    logger.debug(
-                        f"/{self._name}: Missing value '{name}' in reply from {host} "
-                        f"({result_})."
-                    )
-                    failed_hosts.add(host)
-                    result.report_failure(self._name, host, "missing", name)
-                continue
-            for name, value in result_.items():
-                if name not in self._expected_types:
-                    logger.debug(
-                        f"Found additional value in reply from {host}/{self._name}: ({name}: {value})"
-                    )
-                    continue
-                if not isinstance(value, locate(self._expected_types[name])):
-                    logger.debug(
-                        f"/{self._name}: Value '{name}' in reply from {host} is of type "
-                        f"{type(value).__name__} (expected {self._expected_types[name]}"
-                        f")."
-                    )
-                    failed_hosts.add(host)
-                    result.report_failure(self._name, host, "type", name)
+        failures = []
+        if not reply or not isinstance(reply, dict):
             for name in self._expected_types.keys():
-                if name not in result_.keys():
-                    logger.debug(
-                        f"/{self._name}: Missing value '{name}' in reply from {host}."
-                    )
-                    failed_hosts.add(host)
-                    result.report_failure(self._name, host, "missing", name)
-        if failed_hosts:
-            logger.info(
-                f"/{self._name}: Check reply for value types failed: {[host.url() for host in failed_hosts]}"
-            )
-            self._warn_num_hosts(len(failed_hosts))
-            result.add_result(await self.on_failure(failed_hosts))
-            return False
-        self._save_reply(reply)
-        return True
+                logger.debug(
+                    f"/{self._name}: Missing value '{name}' in reply from {host} "
+                    f"({reply})."
+                )
+                failures.append(("missing", name))
+            return failures
+        for name, value in reply.items():
+            if name not in self._expected_types:
+                logger.debug(
+                    f"Found additional value in reply from {host}/{self._name}: ({name}: {value})"
+                )
+                continue
+            if not isinstance(value, locate(self._expected_types[name])):
+                logger.debug(
+                    f"/{self._name}: Value '{name}' in reply from {host} is of type "
+                    f"{type(value).__name__} (expected {self._expected_types[name]}"
+                    f")."
+                )
+                failures.append(("type", name))
+        for name in self._expected_types.keys():
+            if name not in reply.keys():
+                logger.debug(
+                    f"/{self._name}: Missing value '{name}' in reply from {host}."
+                )
+                failures.append(("missing", name))
+        return failures
 
 
-class StateReplyCheck(ReplyCheck):
+class StateReplyCheck(HostReplyCheck):
     """Check the reply against parts of the internal state."""
 
+    _failure_message = "Checking reply against state failed"
+
     def __init__(
         self,
         name,
@@ -379,104 +495,118 @@ class StateReplyCheck(ReplyCheck):
             name, on_failure, save_to_state, forwarder, state, *args, **kwargs
         )
 
-    async def run(self, result: Result):
+    def state_access(self) -> Dict[str, bool]:
         """
-        Run the check on the given reply.
+        List the parts of the state this check reads or writes.
 
-        Parameters
-        ----------
-        result : :class:`Result`
-            The reply to check in a result object.
+        Returns
+        -------
+        dict
+            Keys are state paths, values are `True` if the check writes there.
+        """
+        access = {}
+        if self.state_path:
+            access[self.state_path] = False
+        if self.state_paths:
+            for path in self.state_paths.values():
+                access[path] = False
+        access.update(super().state_access())
+        return access
 
-        Return
-        ------
-        bool
-            True if the check passed, otherwise False.
+    def begin(self) -> Dict:
         """
-        failed_hosts = set()
+        Start checking the replies of one forward call.
 
-        reply = {}
-        for r in result.results.values():
-            if r:
-                reply.update(r)
+        Returns
+        -------
+        dict
+            The state to compare with and a cache of the diffs of bad replies.
+        """
+        # Diffs are cached by a hash over the part of the reply that is checked. This is for
+        # performance: DeepDiff is slow.
+        cache = {"diffs": {}}
+        if self.state_path:
+            cache["state"] = self.state.read(self.state_path)
+        else:
+            cache["state"] = {
+                name: self.state.read(path) for name, path in self.state_paths.items()
+            }
+        return cache
+
+    def _diff(self, cache, state_value, value):
+        hash_ = hash_dict(value)
+        if hash_ not in cache["diffs"]:
+            cache["diffs"][hash_] = DeepDiff(state_value, value)
+        return cache["diffs"][hash_]
+
+    def check_host(self, host: Host, reply, cache: Dict) -> List[Tuple[str, str]]:
+        """
+        Compare the reply of one host with the state.
+
+        Parameters
+        ----------
+        host : :class:`Host`
+            The host that sent the reply.
+        reply
+            The reply.
+        cache : dict
+            What :meth:`begin` returned.
 
-        # Build hash map to cache diffs: the key is a hash over the part of the reply that is
-        # checked, the value is the DeepDiff result. This is for performance: DeepDiff is slow.
-        diffs = {}
+        Returns
+        -------
+        list of (str, str)
+            Failure type and name of the value for each failure, empty if the reply passed.
+        """
+        failures = []
         if self.state_paths:
-            for host, result_ in reply.items():
-                if not result_:
-                    for name in self.state_paths.keys():
-                        logger.debug(
-                            f"/{self._name}: Missing value '{name}' in reply from {host}."
-                        )
-                        failed_hosts.add(host)
-                        result.report_failure(self._name, host, "missing", name)
-                    continue
-                for name, value in result_.items():
-                    if name not in self.state_paths:
-                        logger.debug(
-                            f"Found additional value in reply from {host}/{self._name}: ({name}: {value})"
-                        )
-                        continue
-                    state_value = self.state.read(self.state_paths[name])
-                    if value != state_value:
-                        hash_ = hash_dict(value)
-                        if hash_ not in diffs:
-                            diffs[hash_] = DeepDiff(state_value, value)
-                        logger.debug(
-                            f"/{self._name}: Value '{name}' in reply from {host} doesn't match "
-                            f"value in state '{self.state_paths[name]}'. Difference: {diffs[hash_]}"
-                        )
-                        failed_hosts.add(host)
-                        result.report_failure(
-                            self._name, host, "mismatch_with_state", name
-                        )
+            if not reply or not isinstance(reply, dict):
                 for name in self.state_paths.keys():
-                    if name not in result_.keys():
-                        logger.debug(
-                            f"/{self._name}: Missing value '{name}' in reply from {host}."
-                        )
-                        failed_hosts.add(host)
-                        result.report_failure(self._name, host, "missing", name)
-
-        if self.state_path:
-            state_value = self.state.read(self.state_path)
-            for host, result_ in reply.items():
-                if not result_:
                     logger.debug(
-                        f"/{self._name}: Empty reply to /{self.name} from {host}."
+                        f"/{self._name}: Missing value '{name}' in reply from {host}."
+                    )
+                    failures.append(("missing", name))
+                return failures
+            for name, value in reply.items():
+                if name not in self.state_paths:
+                    logger.debug(
+                        f"Found additional value in reply from {host}/{self._name}: ({name}: {value})"
                     )
-                    failed_hosts.add(host)
-                    result.report_failure(self._name, host, "missing", "all")
                     continue
-                if result_ != state_value:
-                    hash_ = hash_dict(result_)
-                    if hash_ not in diffs:
-                        diffs[hash_] = DeepDiff(state_value, result_)
+                state_value = cache["state"][name]
+                if value != state_value:
                     logger.debug(
-                        f"/{self._name}: Reply from {host} doesn't match "
-                        f"value in state '{self.state_path}'. Difference: {diffs[hash_]}"
+                        f"/{self._name}: Value '{name}' in reply from {host} doesn't match "
+                        f"value in state '{self.state_paths[name]}'. Difference: "
+                        f"{self._diff(cache, state_value, value)}"
                     )
-                    failed_hosts.add(host)
-                    result.report_failure(
-                        self._name, host, "mismatch_with_state", "all"
+                    failures.append(("mismatch_with_state", name))
+            for name in self.state_paths.keys():
+                if name not in reply.keys():
+                    logger.debug(
+                        f"/{self._name}: Missing value '{name}' in reply from {host}."
                     )
-        if failed_hosts:
-            logger.info(
-                f"/{self._name}: Checking reply against state failed: "
-                f"{[host.url() for host in failed_hosts]}"
-            )
-            result.add_result(await self.on_failure(failed_hosts))
-            self._warn_num_hosts(len(failed_hosts))
-            return False
-        self._save_reply(reply)
-        return True
+                    failures.append(("missing", name))
 
+        if self.state_path:
+            state_value = cache["state"]
+            if not reply:
+                logger.debug(f"/{self._name}: Empty reply to /{self.name} from {host}.")
+                failures.append(("missing", "all"))
+            elif reply != state_value:
+                logger.debug(
+                    f"/{self._name}: Reply from {host} doesn't match "
+                    f"value in state '{self.state_path}'. Difference: "
+                    f"{self._diff(cache, state_value, reply)}"
+                )
+                failures.append(("mismatch_with_state", "all"))
+        return failures
 
-class StateHashReplyCheck(ReplyCheck):
+
+class StateHashReplyCheck(HostReplyCheck):
     """Check a hash against a hash of parts of the internal state."""
 
+    _failure_message = "Checking reply against state hash failed"
+
     def __init__(
         self,
         name,
@@ -510,66 +640,144 @@ class StateHashReplyCheck(ReplyCheck):
             name, on_failure, save_to_state, forwarder, state, *args, **kwargs
         )
 
-    async def run(self, result: Result):
+    def state_access(self) -> Dict[str, bool]:
         """
-        Run the check on the given reply.
+        List the parts of the state this check reads or writes.
+
+        Returns
+        -------
+        dict
+            Keys are state paths, values are `True` if the check writes there.
+        """
+        access = {path: False for path in self.state_paths.values()}
+        access.update(super().state_access())
+        return access
+
+    def begin(self) -> Dict:
+        """
+        Start checking the replies of one forward call.
+
+        Returns
+        -------
+        dict
+            The hashes of the state to compare with.
+        """
+        return {name: self.state.hash(path) for name, path in self.state_paths.items()}
+
+    def check_host(self, host: Host, reply, cache: Dict) -> List[Tuple[str, str]]:
+        """
+        Compare the hashes in the reply of one host with the hashes of the state.
 
         Parameters
         ----------
-        result : :class:`Result`
-            The reply to check.
+        host : :class:`Host`
+            The host that sent the reply.
+        reply
+            The reply.
+        cache : dict
+            What :meth:`begin` returned.
 
-        Return
-        ------
+        Returns
+        -------
+        list of (str, str)
+            Failure type and name of the value for each failure, empty if the reply passed.
+        """
+        failures = []
+        if not reply or not isinstance(reply, dict):
+            for name in self.state_paths.keys():
+                logger.debug(
+                    f"/{self._name}: Missing value '{name}' in reply from {host}."
+                )
+                failures.append(("missing", name))
+            return failures
+        for name, value in reply.items():
+            if name not in self.state_paths:
+                logger.debug(
+                    f"Found additional value in reply from {host}/{self._name}: ({name}: {value})"
+                )
+                continue
+            state_hash = cache[name]
+            if value != state_hash:
+                logger.debug(
+                    f"/{self._name}: Hash '{name}' in reply from {host} doesn't match "
+                    f"hash of state '{self.state_paths[name]}' ({value} != {state_hash})"
+                )
+                failures.append(("mismatch_with_state_hash", name))
+        for name in self.state_paths.keys():
+            if name not in reply.keys():
+                logger.debug(
+                    f"/{self._name}: Missing value '{name}' in reply from {host}."
+                )
+                failures.append(("missing", name))
+        return failures
+
+
+class ReplyStream:
+    """
+    Run the per host reply checks of a forward call on each reply as it arrives.
+
+    Reporting the failures and the `on_failure` actions, which are called once for all
+    failed hosts, are left to :meth:`finish`.
+
+    Parameters
+    ----------
+    checks : list of :class:`Check`
+        The checks configured for the forward. Only the :class:`HostReplyCheck`s are run on
+        the stream.
+    """
+
+    def __init__(self, checks: Iterable[Check]):
+        self._checks = [c for c in checks if isinstance(c, HostReplyCheck)]
+        self._caches = {check: check.begin() for check in self._checks}
+        self._failures = {check: {} for check in self._checks}
+
+    def handles(self, check: Check) -> bool:
+        """
+        Tell if a check is run on the stream.
+
+        Parameters
+        ----------
+        check : :class:`Check`
+            One of the checks of the forward.
+
+        Returns
+        -------
         bool
-            True if the check passed, otherwise False.
+            True if the check is finished with :meth:`finish`, otherwise it has to be run
+            on the complete result.
         """
-        failed_hosts = set()
+        return check in self._failures
 
-        reply = {}
-        for r in result.results.values():
-            if r:
-                reply.update(r)
+    async def on_reply(self, host: Host, reply: Tuple):
+        """
+        Check the reply of one host.
 
-        for host, result_ in reply.items():
-            if not result_ or not isinstance(result_, dict):
-                for name in self.state_paths.keys():
-                    logger.debug(
-                        f"/{self._name}: Missing value '{name}' in reply from {host}."
-                    )
-                    failed_hosts.add(host)
-                    result.report_failure(self._name, host, "missing", name)
-                continue
-            for name, value in result_.items():
-                if name not in self.state_paths:
-                    logger.debug(
-                        f"Found additional value in reply from {host}/{self._name}: ({name}: {value})"
-                    )
-                    continue
-                state_hash = self.state.hash(self.state_paths[name])
-                if value != state_hash:
-                    logger.debug(
-                        f"/{self._name}: Hash '{name}' in reply from {host} doesn't match "
-                        f"hash of state '{self.state_paths[name]}' ({value} != {state_hash})"
-                    )
-                    failed_hosts.add(host)
-                    result.report_failure(
-                        self._name, host, "mismatch_with_state_hash", name
-                    )
-            for name in self.state_paths.keys():
-                if name not in result_.keys():
-                    logger.debug(
-                        f"/{self._name}: Missing value '{name}' in reply from {host}."
-                    )
-                    failed_hosts.add(host)
-                    result.report_failure(self._name, host, "missing", name)
-        if failed_hosts:
-            logger.info(
-                f"/{self._name}: Checking reply against state hash failed: "
-                f"{[host.url() for host in failed_hosts]}"
-            )
-            result.add_result(await self.on_failure(failed_hosts))
-            self._warn_num_hosts(len(failed_hosts))
-            return False
-        self._save_reply(reply)
-        return True
+        Parameters
+        ----------
+        host : :class:`Host`
+            The host that sent the reply.
+        reply : (reply, status code)
+            The reply.
+        """
+        for check in self._checks:
+            failures = check.check_host(host, reply[0], self._caches[check])
+            if failures:
+                self._failures[check][host] = failures
+
+    async def finish(self, check: Check, result: Result) -> bool:
+        """
+        Finish a check once all replies are in.
+
+        Parameters
+        ----------
+        check : :class:`Check`
+            One of the checks run on the stream.
+        result : :class:`Result`
+            The complete result of the forward call.
+
+        Returns
+        -------
+        bool
+            True if the check passed, otherwise False.
+        """
+        return await check.finish(result, self._failures[check])
@@ -31,10 +31,92 @@ Example config:
     # Number of workers that will process and forward requests
     n_workers: 2
 
+    # Number of queued requests the worker runs at the same time
+    worker_concurrency: 4
+
+    # Additional worker pools. Endpoints choose a pool with their `pool` option, all others
+    # are run by the default pool.
+    worker_pools:
+        slow:
+            processes: 1
+            concurrency: 8
+
+    # How requests are passed to the workers: "list", "stream", "shm" or "embedded"
+    transport: list
+
+    # Priority classes of queued requests and their weights. Higher classes are served
+    # first, but lower classes still get a share of the worker proportional to their weight.
+    priority_classes:
+        high: 8
+        normal: 4
+        low: 1
+
+    # Maximum number of forwards to nodes each worker runs at the same time (0 for no limit).
+    forward_concurrency: 0
+
     # Time before requests sent to nodes time out. Needs to be a string representing a timedelta in
     # the form `<int>h`, `<int>m`, `<int>s` or a combination of the three.
     timeout: 10s
 
+    # Connections to nodes are kept open for reuse. Time before an idle connection is closed,
+    # maximum number of connections to each node (0 for no limit) and time before the address
+    # of a node is looked up again.
+    keepalive_timeout: 15s
+    connections_per_host: 0
+    dns_cache_ttl: 10m
+
+    # Learn a timeout for each node from how long it took to reply before, instead of always
+    # waiting for `timeout`: the smoothed reply time plus four times its deviation, times
+    # `multiplier`, but at least `floor` and at most `timeout`. Off if not set.
+    adaptive_timeout:
+        multiplier: 2
+        floor: 1s
+
+    # Stop calling a node after `failures` connection errors or timeouts in a row. Calls to it
+    # fail right away with status -1 until it is probed again after `cooldown`. The states are
+    # reported by the endpoint `/circuit-breakers`. Off if not set.
+    circuit_breaker:
+        failures: 5
+        cooldown: 30s
+
+    # Check every `interval` if the nodes are up, by opening a TCP connection or by calling
+    # `endpoint` if it is set. Calls to nodes that are down fail right away with status -1.
+    # Off if not set.
+    health_probe:
+        interval: 10s
+        concurrency: 20
+        timeout: 1s
+
+    # Maximum number of requests in flight to each node (`per_host`, overwritten for single
+    # nodes in `hosts`) and to all nodes of a group together. Shared by all forwards of a
+    # worker. Off if not set.
+    concurrency_limits:
+        per_host: 1
+        groups:
+            gpu: 64
+        hosts:
+            gpu-r1-n1:12048: 2
+
+    # Adapt the number of requests in flight to all nodes: grow it by one per round of
+    # requests that went well, cut it by `backoff` on timeouts, 5xx replies or unusually slow
+    # replies. Off if not set.
+    adaptive_concurrency:
+        initial: 16
+        min: 1
+        max: 1000
+        backoff: 0.5
+
+    # Call some nodes through relays: other coco instances that get one call for all of their
+    # nodes and return the replies. Useful to spread the calls to many nodes, e.g. with one
+    # relay per rack. The nodes have to be in `groups` here and in the config of the relay.
+    relays:
+        rack1-coco:12055:
+            - gpu-r1-n1:12048
+            - gpu-r1-n2:12048
+
+    # Accept calls from other coco instances as their relay.
+    relay: False
+
     # Time before requests sent to coco time out.
     # This value should depend on how many layers your configuration files have. If a call to a
     # coco endpoint could take longer than this value, because it triggers many layered forward
@@ -124,7 +206,12 @@ _config_skeleton = {
     "log_level": DefaultValue("INFO"),
     "endpoint_dir": RequiredValue(),
     "n_workers": DefaultValue(1),
+    "worker_concurrency": DefaultValue(1),
+    "worker_pools": DefaultValue({}),
+    "transport": DefaultValue("list"),
+    "priority_classes": DefaultValue({"high": 8, "normal": 4, "low": 1}),
     "session_limit": DefaultValue(1000),
+    "forward_concurrency": DefaultValue(0),
     "blocklist_path": DefaultValue("/var/lib/coco/blocklist.json"),
     "storage_path": DefaultValue("/var/lib/coco/state/"),
     "groups": RequiredValue(),
@@ -133,6 +220,16 @@ _config_skeleton = {
     "slack_rules": DefaultValue([]),
     "queue_length": DefaultValue(0),
     "timeout": DefaultValue("10s"),
+    "keepalive_timeout": DefaultValue("15s"),
+    "connections_per_host": DefaultValue(0),
+    "dns_cache_ttl": DefaultValue("10m"),
+    "adaptive_timeout": DefaultValue(None),
+    "circuit_breaker": DefaultValue(None),
+    "health_probe": DefaultValue(None),
+    "concurrency_limits": DefaultValue(None),
+    "adaptive_concurrency": DefaultValue(None),
+    "relays": DefaultValue({}),
+    "relay": DefaultValue(False),
     "frontend_timeout": DefaultValue("10m"),
     "exclude_from_reset": DefaultValue([]),
     "debug_connections": DefaultValue(False),
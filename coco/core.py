@@ -13,25 +13,39 @@ from pathlib import Path
 from multiprocessing import Process, set_start_method
 
 import json
-import redis
-import aioredis
 
 from sanic import Sanic, response
 
 from comet import Manager, CometError
 
+from .scheduler import Scheduler
+from .breaker import CircuitBreakers
+from .limiter import AIMDLimit, ConcurrencyLimiter
+from .plan import Plans
+from .prober import HealthProber
 from .request_forwarder import (
+    AdaptiveTimeout,
     CocoForward,
+    RELAY_ENDPOINT,
     RequestForwarder,
 )
 from .endpoint import (
     Endpoint,
     LocalEndpoint,
 )
-from . import worker, __version__, wait
+from . import worker, __version__, wait, transport
 from .state import State
+from .transport import get_transport
+from .lock import split_path
 from .exceptions import ConfigError, InternalError
-from .util import Host, str2total_seconds
+from .util import (
+    DEFAULT_POOL,
+    DEFAULT_PRIORITY,
+    Host,
+    hash_dict,
+    queue_name,
+    str2total_seconds,
+)
 from . import slack
 from . import config
 
@@ -66,7 +80,7 @@ class Core:
 
         # In case constructor crashes before this gets assigned, so that destructor
         # doesn't fail.
-        self.qworker = None
+        self.qworkers = []
         self.state = None
 
         # Load the config
@@ -90,14 +104,65 @@ class Core:
             debug_connections=self.config["debug_connections"],
         )
         self.forwarder.set_session_limit(self.config["session_limit"])
+        forward_concurrency = self.config["forward_concurrency"]
+        if not isinstance(forward_concurrency, int) or forward_concurrency < 0:
+            raise ConfigError(
+                f"Value 'forward_concurrency' is '{forward_concurrency}' (expected an "
+                f"integer >= 0)."
+            )
+        self.forwarder.set_forward_concurrency(forward_concurrency)
+        try:
+            keepalive_timeout = str2total_seconds(self.config["keepalive_timeout"])
+            dns_cache_ttl = str2total_seconds(self.config["dns_cache_ttl"])
+        except Exception as e:
+            raise ConfigError(
+                "Failed parsing value 'keepalive_timeout' "
+                f"({self.config['keepalive_timeout']}) or 'dns_cache_ttl' "
+                f"({self.config['dns_cache_ttl']})."
+            ) from e
+        self.forwarder.set_connection_pool(
+            keepalive_timeout, self.config["connections_per_host"], dns_cache_ttl
+        )
+        if self.config["adaptive_timeout"]:
+            self.forwarder.set_adaptive_timeout(
+                AdaptiveTimeout.from_config(
+                    self.config["adaptive_timeout"], "the coco config"
+                )
+            )
+        if self.config["circuit_breaker"]:
+            self.forwarder.set_circuit_breakers(
+                CircuitBreakers.from_config(self.config["circuit_breaker"])
+            )
+        if self.config["health_probe"]:
+            self.forwarder.set_health_prober(
+                HealthProber.from_config(self.config["health_probe"])
+            )
+        if self.config["concurrency_limits"]:
+            limiter = ConcurrencyLimiter.from_config(self.config["concurrency_limits"])
+            for group in limiter.groups:
+                if group not in self.groups:
+                    raise ConfigError(
+                        f"Group '{group}' in 'concurrency_limits/groups' does not exist."
+                    )
+            self.forwarder.set_concurrency_limiter(limiter)
+        if self.config["adaptive_concurrency"]:
+            self.forwarder.set_adaptive_concurrency(
+                AIMDLimit.from_config(self.config["adaptive_concurrency"])
+            )
         for group, hosts in self.groups.items():
             self.forwarder.add_group(group, hosts)
+        self._load_relays()
 
         self._config_slack_loggers()
 
+        self._load_pools()
+        self._load_priorities()
         self._load_endpoints()
         self._local_endpoints()
         self._check_endpoint_links()
+        self.plans.compile()
+        self._resolve_state_locks()
+        self._check_pools()
         self._register_config()
 
         try:
@@ -108,49 +173,35 @@ class Core:
                 f"({self.config['frontend_timeout']})."
             ) from e
 
+        self.transport = get_transport(
+            self.config["transport"], int(self.frontend_timeout) + 1
+        )
+        self._check_transport()
+
         if self.check_config:
             logger.info("Superficial config check successful. Stopping...")
             return
 
-        # Remove any leftover shutdown commands from the queue
-        self.redis_sync = redis.Redis()
-        self.redis_sync.lrem("queue", 0, "coco_shutdown")
-
-        # Load queue update script into redis cache
-        self.queue_sha = self.redis_sync.script_load(
-            """ if redis.call('llen', KEYS[1]) >= tonumber(ARGV[1]) then
-                        return true
-                    else
-                        redis.call('hmset', KEYS[2], ARGV[2], ARGV[3], ARGV[4], ARGV[5], ARGV[6], ARGV[7], ARGV[8], ARGV[9], ARGV[10], ARGV[11])
-                        redis.call('rpush', KEYS[1], KEYS[2])
-                        return false
-                    end
-            """
+        self.transport.setup(
+            [
+                queue_name(pool, priority)
+                for pool in self.pools
+                for priority in self.priorities
+            ],
+            [
+                f"{counter}_counter_{name}"
+                for name in self.endpoints
+                for counter in ("dropped", "coalesced")
+            ],
+            self.config["n_workers"],
         )
 
-        # Start the worker process
-        self.qworker = Process(
-            target=worker.main_loop,
-            args=(
-                self.endpoints,
-                self.forwarder,
-                self.config["port"],
-                self.config["metrics_port"],
-                self.config["log_level"],
-                self.frontend_timeout,
-            ),
-        )
-        self.qworker.daemon = True
-        try:
-            self.qworker.start()
-        except Exception:
-            self.qworker.join()
-
-        self._call_endpoints_on_start()
+        # Embedded workers are started with the server
+        if not self.transport.in_process:
+            self._start_workers()
+            self._call_endpoints_on_start()
         self._start_server()
 
-        self.redis_async = None
-
     def __del__(self):
         """
         Destruct :class:`Core`.
@@ -158,9 +209,11 @@ class Core:
         Join the worker process.
         """
         if not self.check_config:
-            logger.info("Joining worker process...")
+            logger.info("Joining worker processes...")
             try:
-                self.redis_sync.rpush("queue", "coco_shutdown")
+                for pool, pool_conf in getattr(self, "pools", {}).items():
+                    for _ in range(pool_conf["processes"]):
+                        self.transport.shutdown(queue_name(pool))
             except Exception as e:
                 logger.error(
                     f"Failed sending shutdown command to worker (have to kill it): {type(e)}: {e}"
@@ -169,33 +222,122 @@ class Core:
             self._kill_worker()
 
     def _kill_worker(self):
-        if hasattr(self, "qworker"):
-            if self.qworker:
-                self.qworker.kill()
+        for qworker in getattr(self, "qworkers", []):
+            qworker.kill()
+
+    def _start_workers(self):
+        """
+        Start the worker processes of all pools.
+
+        The first process of the default pool also runs the scheduler and reports the dropped
+        request counters. Each process serves its metrics on its own port.
+        """
+        metrics_port = self.config["metrics_port"]
+        primary = True
+        for pool, pool_conf in self.pools.items():
+            for i in range(pool_conf["processes"]):
+                port = pool_conf.get("metrics_port")
+                if port is None:
+                    port = metrics_port
+                    metrics_port += 1
+                else:
+                    port += i
+                qworker = Process(
+                    target=worker.main_loop,
+                    args=(
+                        self.endpoints,
+                        self.forwarder,
+                        self.state,
+                        self.config["port"],
+                        port,
+                        self.config["log_level"],
+                        self.frontend_timeout,
+                        pool_conf["concurrency"],
+                        pool,
+                        list(self.pools.keys()),
+                        self.priorities,
+                        primary,
+                        self.transport,
+                        f"{pool}-{i}",
+                    ),
+                )
+                primary = False
+                qworker.daemon = True
+                try:
+                    qworker.start()
+                except Exception:
+                    qworker.join()
+                self.qworkers.append(qworker)
+
+    async def _start_embedded_workers(self):
+        """
+        Run the worker pools and the scheduler in the event loop of the server.
+
+        Used by the embedded transport. The metrics are served on `metrics_port` for all pools.
+        """
+        self.forwarder.start_prometheus_server(
+            self.config["metrics_port"],
+            list(self.pools.keys()),
+            self.priorities,
+            True,
+            self.transport,
+        )
+        self.forwarder.init_metrics()
+        await self.forwarder.open_session()
+        self.forwarder.start_health_probes()
+        for pool, pool_conf in self.pools.items():
+            asyncio.ensure_future(
+                worker.serve(
+                    self.endpoints,
+                    self.forwarder,
+                    self.state,
+                    self.transport,
+                    pool_conf["concurrency"],
+                    pool,
+                    self.priorities,
+                )
+            )
+        scheduler = Scheduler(
+            self.endpoints,
+            "127.0.0.1",
+            self.config["port"],
+            self.frontend_timeout,
+            self.log_level,
+        )
+        asyncio.ensure_future(scheduler.start())
 
-    def _call_endpoints_on_start(self):
         for endpoint in self.endpoints.values():
-            # Initialise request counter
-            self.redis_sync.incr(f"dropped_counter_{endpoint.name}", amount=0)
             if endpoint.call_on_start:
                 logger.debug(f"Calling endpoint on start: /{endpoint.name}")
                 name = f"{os.getpid()}-{time.time()}"
-
-                self.redis_sync.hmset(
-                    name,
+                await self.transport.enqueue(
+                    queue_name(endpoint.pool, endpoint.priority),
                     {
+                        "name": name,
                         "method": endpoint.type,
                         "endpoint": endpoint.name,
                         "request": json.dumps({}),
                     },
                 )
+                _, result = await self.transport.wait(name)
+                logger.debug(f"Called /{endpoint.name} on start, result: {result}")
 
-                # Add task name to queue
-                self.redis_sync.rpush("queue", name)
+    def _call_endpoints_on_start(self):
+        for endpoint in self.endpoints.values():
+            if endpoint.call_on_start:
+                logger.debug(f"Calling endpoint on start: /{endpoint.name}")
+                name = f"{os.getpid()}-{time.time()}"
 
-                # Wait for the result
-                result = self.redis_sync.blpop(f"{name}:res")[1]
-                self.redis_sync.delete(f"{name}:res")
+                # Queue the task and wait for the result
+                _, result = self.transport.call(
+                    queue_name(endpoint.pool, endpoint.priority),
+                    {
+                        "name": name,
+                        "method": endpoint.type,
+                        "endpoint": endpoint.name,
+                        "request": json.dumps({}),
+                    },
+                )
                 # TODO: raise log level in failure case?
                 logger.debug(f"Called /{endpoint.name} on start, result: {result}")
 
@@ -205,15 +347,14 @@ class Core:
         self.sanic_app.config.REQUEST_TIMEOUT = self.frontend_timeout
         self.sanic_app.config.RESPONSE_TIMEOUT = self.frontend_timeout
 
-        # Create the Redis connection pool, use sanic to start it so that it
-        # ends up in the same event loop
-        async def init_redis_async(*_):
-            self.redis_async = aioredis.Redis(
-                host="localhost", port=6379, encoding="utf-8", decode_responses=True
-            )
-            await self.redis_async.ping()
+        # Connect the transport, use sanic to start it so that it ends up in the same event
+        # loop. Each frontend process receives all of its results on one connection.
+        async def init_transport(*_):
+            await self.transport.connect(listen=True)
+            if self.transport.in_process:
+                await self._start_embedded_workers()
 
-        self.sanic_app.register_listener(init_redis_async, "before_server_start")
+        self.sanic_app.register_listener(init_transport, "before_server_start")
 
         # Set up slack logging, needs to be done here so it gets setup in the right event loop
         def start_slack_log(_, loop):
@@ -238,6 +379,8 @@ class Core:
             debug=False,
             access_log=debug,
         )
+        # Only frees anything in the process that set up the transport
+        self.transport.cleanup()
 
     def _config_slack_loggers(self):
         # Configure the log handlers for posting to slack
@@ -335,6 +478,115 @@ class Core:
             if "logger" not in rdict or "channel" not in rdict:
                 logger.error(f"Invalid slack rule {rdict}.")
 
+    def _load_pools(self):
+        """Load the worker pool config. There always is a default pool."""
+        self.pools = {}
+        pools = self.config["worker_pools"]
+        if not isinstance(pools, dict):
+            raise ConfigError(
+                f"Value 'worker_pools' is of type '{type(pools).__name__}' (expected dict)."
+            )
+        # The default pool goes first, its first process is the primary worker
+        pools = {DEFAULT_POOL: pools.get(DEFAULT_POOL, {}), **pools}
+        for name, conf in pools.items():
+            if conf is None:
+                conf = {}
+            pool = {
+                "processes": conf.get("processes", 1),
+                "concurrency": conf.get(
+                    "concurrency", self.config["worker_concurrency"]
+                ),
+                "metrics_port": conf.get("metrics_port", None),
+            }
+            for key in ("processes", "concurrency"):
+                if not isinstance(pool[key], int) or pool[key] < 1:
+                    raise ConfigError(
+                        f"Value '{key}' of worker pool '{name}' ({pool[key]}) has to be "
+                        f"an integer of at least 1."
+                    )
+            self.pools[name] = pool
+
+    def _load_priorities(self):
+        """Load the priority classes and their weights."""
+        priorities = self.config["priority_classes"]
+        if not isinstance(priorities, dict):
+            raise ConfigError(
+                f"Value 'priority_classes' is of type '{type(priorities).__name__}' "
+                "(expected dict)."
+            )
+        if DEFAULT_PRIORITY not in priorities:
+            raise ConfigError(
+                f"Value 'priority_classes' has to contain the default class "
+                f"'{DEFAULT_PRIORITY}'."
+            )
+        for name, weight in priorities.items():
+            if not isinstance(weight, int) or weight < 1:
+                raise ConfigError(
+                    f"Weight of priority class '{name}' ({weight}) has to be an integer of "
+                    "at least 1."
+                )
+        # Highest priority first
+        self.priorities = dict(
+            sorted(priorities.items(), key=lambda item: item[1], reverse=True)
+        )
+
+    def _check_pools(self):
+        """
+        Check endpoints use known pools and priority classes and pools don't share state.
+
+        Every worker process has its own copy of the state in memory. State changes made by
+        endpoints in one process are therefore not seen by the others. Parts of the state
+        written by an endpoint may only be used by endpoints in the same pool, and only in
+        pools with a single process.
+        """
+        written = {}
+        for name, endpoint in self.endpoints.items():
+            if endpoint.pool not in self.pools:
+                raise ConfigError(
+                    f"Endpoint /{name} uses unknown worker pool '{endpoint.pool}'."
+                )
+            if endpoint.priority not in self.priorities:
+                raise ConfigError(
+                    f"Endpoint /{name} uses unknown priority class '{endpoint.priority}'."
+                )
+            for path, write in self._state_access[name].items():
+                if not write:
+                    continue
+                if self.pools[endpoint.pool]["processes"] > 1:
+                    raise ConfigError(
+                        f"Endpoint /{name} writes to the state, but its worker pool "
+                        f"'{endpoint.pool}' has more than one process."
+                    )
+                written[split_path(path)] = endpoint.pool
+
+        for name, endpoint in self.endpoints.items():
+            for path in self._state_access[name]:
+                path = split_path(path)
+                for written_path, pool in written.items():
+                    n = min(len(path), len(written_path))
+                    if pool != endpoint.pool and path[:n] == written_path[:n]:
+                        raise ConfigError(
+                            f"Endpoint /{name} in worker pool '{endpoint.pool}' uses state "
+                            f"path '{'/'.join(path)}', which is written to by endpoints "
+                            f"in worker pool '{pool}'."
+                        )
+
+    def _check_transport(self):
+        """Check the worker pools can run in the frontend process with the embedded transport."""
+        if not self.transport.in_process:
+            return
+        if self.config["n_workers"] != 1:
+            raise ConfigError(
+                f"Transport '{self.config['transport']}' needs 'n_workers' to be 1 "
+                f"(is {self.config['n_workers']})."
+            )
+        for name, pool in self.pools.items():
+            if pool["processes"] != 1:
+                raise ConfigError(
+                    f"Transport '{self.config['transport']}' runs each worker pool in the "
+                    f"frontend process, but pool '{name}' has {pool['processes']} processes."
+                )
+
     def _load_endpoints(self):
 
         self.endpoints = {}
@@ -360,21 +612,74 @@ class Core:
                     )
             self.forwarder.add_endpoint(name, self.endpoints[name])
 
+    def _load_relays(self):
+        relays = self.config["relays"]
+        if not isinstance(relays, dict):
+            raise ConfigError(
+                f"Value 'relays' is of type '{type(relays).__name__}' (expected dict)."
+            )
+        known = {host for hosts in self.groups.values() for host in hosts}
+        relay_of = {}
+        for relay, hosts in relays.items():
+            if not isinstance(hosts, list):
+                raise ConfigError(
+                    f"Hosts of relay '{relay}' are of type '{type(hosts).__name__}' "
+                    f"(expected list)."
+                )
+            hosts = [Host(h) for h in hosts]
+            for host in hosts:
+                if host not in known:
+                    raise ConfigError(
+                        f"Host '{host}' of relay '{relay}' is in no group."
+                    )
+                if host in relay_of:
+                    raise ConfigError(
+                        f"Host '{host}' has two relays: '{relay_of[host]}' and "
+                        f"'{relay}'."
+                    )
+                relay_of[host] = relay
+            self.forwarder.add_relay(Host(relay), hosts)
+
     def _local_endpoints(self):
         # Register any local endpoints
 
+        self.plans = Plans(self.endpoints, self.groups)
+
+        # Name: (method, callable, isolation, state access)
         endpoints = {
-            "blocklist": ("GET", self.forwarder.blocklist.process_get),
-            "update-blocklist": ("POST", self.forwarder.blocklist.process_post),
-            "saved-states": ("GET", self.state.get_saved_states),
-            "reset-state": ("POST", self.state.reset_state),
-            "save-state": ("POST", self.state.save_state),
-            "load-state": ("POST", self.state.load_state),
-            "wait": ("POST", wait.process_post),
+            "blocklist": ("GET", self.forwarder.blocklist.process_get, "auto", {}),
+            "update-blocklist": (
+                "POST",
+                self.forwarder.blocklist.process_post,
+                "exclusive",
+                {},
+            ),
+            "saved-states": ("GET", self.state.get_saved_states, "auto", {}),
+            "reset-state": ("POST", self.state.reset_state, "auto", {"": True}),
+            "save-state": ("POST", self.state.save_state, "auto", {"": False}),
+            "load-state": ("POST", self.state.load_state, "auto", {"": True}),
+            "wait": ("POST", wait.process_post, "auto", {}),
+            "plan": ("GET", self.plans.process_get, "auto", {}),
         }
+        if self.config["relay"]:
+            endpoints[RELAY_ENDPOINT] = (
+                "POST",
+                self.forwarder.process_relay,
+                "auto",
+                {},
+            )
+        if self.forwarder.breakers is not None:
+            endpoints["circuit-breakers"] = (
+                "GET",
+                self.forwarder.breakers.process_get,
+                "auto",
+                {},
+            )
 
-        for name, (type_, callable_) in endpoints.items():
-            self.endpoints[name] = LocalEndpoint(name, type_, callable_)
+        for name, (type_, callable_, isolation, access) in endpoints.items():
+            self.endpoints[name] = LocalEndpoint(
+                name, type_, callable_, isolation, access
+            )
             self.forwarder.add_endpoint(name, self.endpoints[name])
 
     def _check_endpoint_links(self):
@@ -403,8 +708,46 @@ class Core:
                 check(endpoint.before)
             if hasattr(endpoint, "after"):
                 check(endpoint.after)
-            if hasattr(endpoint, "forward_to_coco"):
-                check(endpoint.forward_to_coco)
+            if hasattr(endpoint, "forwards_internal"):
+                check(endpoint.forwards_internal)
+
+    def _resolve_state_locks(self):
+        """
+        Find the state locks each endpoint has to hold while it is called.
+
+        With `isolation: auto` these are all state paths touched by the endpoint itself and by
+        any coco endpoint it calls, directly or indirectly.
+        """
+
+        def collect(name, access, seen):
+            if name in seen:
+                return
+            seen.add(name)
+            endpoint = self.endpoints[name]
+            for path, write in endpoint.state_access().items():
+                access[path] = access.get(path, False) or write
+            for linked in endpoint.linked_endpoints():
+                collect(linked, access, seen)
+
+        self._state_access = {}
+        for name, endpoint in self.endpoints.items():
+            access = {}
+            collect(name, access, set())
+            self._state_access[name] = access
+
+            if endpoint.isolation == "exclusive":
+                endpoint.state_locks = {"": True}
+            elif endpoint.isolation == "shared":
+                written = [path for path, write in access.items() if write]
+                if written:
+                    raise ConfigError(
+                        f"Endpoint /{name} has 'isolation: shared', but it (or an endpoint "
+                        f"it calls) writes to the state: {written}."
+                    )
+                endpoint.state_locks = {"": False}
+            else:
+                endpoint.state_locks = access
+            logger.debug(f"State locks for /{name}: {endpoint.state_locks}")
 
     async def external_endpoint(self, request, endpoint):
         """
@@ -416,55 +759,65 @@ class Core:
         now = time.time()
         name = f"{os.getpid()}-{now}"
 
-        async with self.redis_async.client() as ra_cli:
-            # Check if queue is full. If not, add this task.
-            if self.config["queue_length"] > 0:
-                full = await ra_cli.evalsha(
-                    self.queue_sha,
-                    2,
-                    "queue",
-                    name,
-                    self.config["queue_length"],
-                    "method",
-                    request.method,
-                    "endpoint",
-                    endpoint,
-                    "request",
-                    request.body,
-                    "params",
-                    request.query_string,
-                    "received",
-                    now,
-                )
+        # Route the task to the queue of the endpoint's pool and priority class. Unknown
+        # endpoints go to the default pool, where the worker reports the error.
+        try:
+            pool = self.endpoints[endpoint].pool
+            priority = self.endpoints[endpoint].priority
+        except KeyError:
+            pool = DEFAULT_POOL
+            priority = DEFAULT_PRIORITY
+        priority = request.headers.get("X-Coco-Priority", priority)
+        if priority not in self.priorities:
+            return response.json(
+                {
+                    "reply": f"Unknown priority class '{priority}'. Use one of "
+                    f"{list(self.priorities)}.",
+                    "status": 400,
+                },
+                status=400,
+            )
 
-                if full:
-                    # Increment dropped request counter
-                    await ra_cli.incr(f"dropped_counter_{endpoint}")
-                    return response.json(
-                        {"reply": "Coco queue is full.", "status": 503}, status=503
-                    )
-            else:
-                # No limit on queue, just give the task to redis
-                await ra_cli.hmset(
-                    name,
-                    {
-                        "method": request.method,
-                        "endpoint": endpoint,
-                        "request": request.body,
-                        "params": request.query_string,
-                        "received": now,
-                    },
-                )
+        task = {
+            "name": name,
+            "method": request.method,
+            "endpoint": endpoint,
+            "request": request.body,
+            "params": request.query_string,
+            "received": now,
+        }
+        coalesce = None
+        if endpoint in self.endpoints and self.endpoints[endpoint].coalesce:
+            # Attach to an identical task if there is one. Only in the same queue, so that
+            # a call doesn't wait for one of a lower priority.
+            coalesce = "coalesce:" + hash_dict(
+                {
+                    "method": request.method,
+                    "endpoint": endpoint,
+                    "request": request.body,
+                    "params": request.query_string,
+                    "pool": pool,
+                    "priority": priority,
+                }
+            )
 
-                # Add task name to queue
-                await ra_cli.rpush("queue", name)
+        status = await self.transport.enqueue(
+            queue_name(pool, priority),
+            task,
+            self.config["queue_length"],
+            [queue_name(pool, p) for p in self.priorities],
+            coalesce,
+        )
+        if status == transport.FULL:
+            # Increment dropped request counter
+            await self.transport.count(f"dropped_counter_{endpoint}")
+            return response.json(
+                {"reply": "Coco queue is full.", "status": 503}, status=503
+            )
+        if status == transport.ATTACHED:
+            await self.transport.count(f"coalesced_counter_{endpoint}")
 
-            # Wait for the result (operations must be in this order to ensure
-            # the result is available)
-            code = int((await ra_cli.blpop(f"{name}:code"))[1])
-            result = (await ra_cli.blpop(f"{name}:res"))[1]
-            await ra_cli.delete(f"{name}:res")
-            await ra_cli.delete(f"{name}:code")
+        code, result = await self.transport.wait(name)
 
         return response.raw(
             result, status=code, headers={"Content-Type": "application/json"}
@@ -15,7 +15,12 @@ from aiohttp import (
 import sanic
 
 from .result import Result
-from .request_forwarder import ExternalForward, CocoForward
+from .request_forwarder import (
+    AdaptiveTimeout,
+    ExternalForward,
+    CocoForward,
+    RetryPolicy,
+)
 from . import metric
 from .check import (
     Check,
@@ -26,9 +31,11 @@ from .check import (
     StateReplyCheck,
 )
 from .exceptions import ConfigError, InvalidUsage
-from .util import str2total_seconds
+from .util import DEFAULT_POOL, DEFAULT_PRIORITY, str2total_seconds
 
 ON_FAILURE_ACTIONS = ["call", "call_single_host"]
+ISOLATION_MODES = ["auto", "exclusive", "shared"]
+PARALLEL_STAGES = ["before", "forward", "coco", "after"]
 
 # Module level logger, note that there is also a class level, endpoint specific logger
 logger = logging.getLogger(__name__)
@@ -61,11 +68,42 @@ class Endpoint:
         self.set_state = conf.get("set_state", None)
         self.schedule = conf.get("schedule", None)
         self.enforce_group = bool(conf.get("enforce_group", False))
+        # Set by Core once all endpoints are loaded, see `state_locks()`
+        self.state_locks = {"": True}
+        self.isolation = conf.get("isolation", "auto")
+        self.pool = conf.get("pool", DEFAULT_POOL)
+        self.priority = conf.get("priority", DEFAULT_PRIORITY)
+        self.coalesce = bool(conf.get("coalesce", False))
+        self.memoize = bool(conf.get("memoize", False))
         self.forward_checks = {}
 
         # Setup the endpoint logger
         self.logger = logging.getLogger(f"{__name__}.{self.name}")
 
+        if self.isolation not in ISOLATION_MODES:
+            raise ConfigError(
+                f"Unknown 'isolation' in '{self.name}.conf': {self.isolation}. Use one "
+                f"of {ISOLATION_MODES}."
+            )
+
+        if self.memoize and self.type != "GET":
+            raise ConfigError(
+                f"Value 'memoize' in '{self.name}.conf' is only allowed for GET endpoints "
+                f"(type is '{self.type}')."
+            )
+
+        parallel = conf.get("parallel", False)
+        if parallel is True:
+            parallel = PARALLEL_STAGES
+        elif not parallel:
+            parallel = []
+        if not isinstance(parallel, list) or not set(parallel) <= set(PARALLEL_STAGES):
+            raise ConfigError(
+                f"Value 'parallel' in '{self.name}.conf' is '{parallel}' (expected a bool "
+                f"or a list of {PARALLEL_STAGES})."
+            )
+        self.parallel = set(parallel)
+
         if self.values:
             for key, value in self.values.items():
                 self.values[key] = locate(value)
@@ -181,6 +219,62 @@ class Endpoint:
                     f"`get_state` for endpoint `{name}` is empty."
                 )
 
+    def _forwards(self):
+        """Get all forwards of this endpoint."""
+        return (
+            self.before + self.forwards_external + self.forwards_internal + self.after
+        )
+
+    def state_access(self) -> Dict[str, bool]:
+        """
+        List the parts of the state this endpoint reads or writes itself.
+
+        Parts touched by other coco endpoints it calls are not included.
+
+        Returns
+        -------
+        dict
+            Keys are state paths, values are `True` if the endpoint writes there.
+        """
+        access = {}
+
+        def add(path, write):
+            access[path] = access.get(path, False) or write
+
+        if self.get_state:
+            add(self.get_state, False)
+        if self.send_state:
+            add(self.send_state, False)
+        for path in self.save_state or []:
+            add(path, True)
+        for path in self.set_state or {}:
+            add(path, True)
+        if self.timestamp_path:
+            add(self.timestamp_path, True)
+        for forward in self._forwards():
+            for check in forward.check or []:
+                for path, write in check.state_access().items():
+                    add(path, write)
+        return access
+
+    def linked_endpoints(self) -> List[str]:
+        """
+        List the coco endpoints this endpoint may call.
+
+        Returns
+        -------
+        list of str
+            Names of endpoints called in `before`, `after`, `call/coco` and by `on_failure`
+            actions.
+        """
+        linked = []
+        for forward in self._forwards():
+            if isinstance(forward, CocoForward):
+                linked.append(forward.name)
+            for check in forward.check or []:
+                linked += check.linked_endpoints()
+        return linked
+
     def _load_internal_forward(self, dict_, list_):
         """
         Load Forward's from the config dictionary, generate objects and place in list.
@@ -269,6 +363,47 @@ class Endpoint:
                         if timeout is not None:
                             timeout = str2total_seconds(timeout)
 
+                        stream_checks = f.get("stream_checks", False)
+                        if not isinstance(stream_checks, bool):
+                            raise ConfigError(
+                                f"'stream_checks' in forward to '{name}' in "
+                                f"'{self.name}.conf' is of type "
+                                f"'{type(stream_checks).__name__}' (expected bool)."
+                            )
+
+                        quorum = f.get("quorum", None)
+                        if quorum is not None and not (
+                            (
+                                isinstance(quorum, int)
+                                and not isinstance(quorum, bool)
+                                and quorum >= 1
+                            )
+                            or (isinstance(quorum, float) and 0 < quorum <= 1)
+                        ):
+                            raise ConfigError(
+                                f"'quorum' in forward to '{name}' in '{self.name}.conf' "
+                                f"is '{quorum}' (expected a number of hosts or a "
+                                f"fraction between 0 and 1)."
+                            )
+                        finish_after_quorum = f.get("finish_after_quorum", False)
+                        if not isinstance(finish_after_quorum, bool):
+                            raise ConfigError(
+                                f"'finish_after_quorum' in forward to '{name}' in "
+                                f"'{self.name}.conf' is of type "
+                                f"'{type(finish_after_quorum).__name__}' (expected bool)."
+                            )
+                        hedge = f.get("hedge", None)
+                        if hedge is not None and not (
+                            isinstance(hedge, float) and 0 < hedge < 1
+                        ):
+                            raise ConfigError(
+                                f"'hedge' in forward to '{name}' in '{self.name}.conf' "
+                                f"is '{hedge}' (expected a quantile between 0 and 1)."
+                            )
+                        retry = self._load_retry(f.get("retry", None), name)
+                        if hedge is not None or retry is not None:
+                            self._check_idempotent(f, name)
+
                         self.forwards_external.append(
                             ExternalForward(
                                 name,
@@ -277,6 +412,14 @@ class Endpoint:
                                 None,
                                 self._load_checks(f),
                                 timeout,
+                                stream_checks,
+                                quorum,
+                                finish_after_quorum,
+                                hedge,
+                                retry,
+                                self._load_adaptive_timeout(
+                                    f.get("adaptive_timeout", None), name
+                                ),
                             )
                         )
                     self.has_external_forwards = True
@@ -285,6 +428,62 @@ class Endpoint:
             forward_to_coco = forward_dict.get("coco", None)
             self._load_internal_forward(forward_to_coco, self.forwards_internal)
 
+    def _load_adaptive_timeout(self, conf, name: str):
+        if conf is None or conf is False:
+            return conf
+        return AdaptiveTimeout.from_config(
+            conf, f"forward to '{name}' in '{self.name}.conf'"
+        )
+
+    def _check_idempotent(self, forward: Dict, name: str):
+        """Make sure a forward that may call a host twice is marked as safe to do so."""
+        idempotent = forward.get("idempotent", None)
+        if idempotent is not None and not isinstance(idempotent, bool):
+            raise ConfigError(
+                f"'idempotent' in forward to '{name}' in '{self.name}.conf' is of type "
+                f"'{type(idempotent).__name__}' (expected bool)."
+            )
+        if idempotent is None:
+            idempotent = self.type == "GET" and not (self.save_state or self.set_state)
+        if not idempotent:
+            raise ConfigError(
+                f"'hedge' and 'retry' in forward to '{name}' in '{self.name}.conf' call "
+                f"hosts more than once, but the endpoint is of type '{self.type}' or "
+                f"writes the state. Set 'idempotent: true' in the forward if that's safe."
+            )
+
+    def _load_retry(self, retry_dict: Dict, name: str) -> Optional[RetryPolicy]:
+        if not retry_dict:
+            return None
+        if not isinstance(retry_dict, dict):
+            raise ConfigError(
+                f"'retry' in forward to '{name}' in '{self.name}.conf' is of type "
+                f"'{type(retry_dict).__name__}' (expected dict)."
+            )
+        default = RetryPolicy()
+        attempts = retry_dict.get("attempts", default.attempts)
+        budget = retry_dict.get("budget", default.budget)
+        if not isinstance(attempts, int) or isinstance(attempts, bool) or attempts < 1:
+            raise ConfigError(
+                f"'retry/attempts' in forward to '{name}' in '{self.name}.conf' is "
+                f"'{attempts}' (expected a positive int)."
+            )
+        if not isinstance(budget, (int, float)) or not 0 <= budget <= 1:
+            raise ConfigError(
+                f"'retry/budget' in forward to '{name}' in '{self.name}.conf' is "
+                f"'{budget}' (expected a fraction between 0 and 1)."
+            )
+        try:
+            backoff = str2total_seconds(retry_dict.get("backoff", default.backoff))
+            max_backoff = str2total_seconds(
+                retry_dict.get("max_backoff", default.max_backoff)
+            )
+        except ValueError as e:
+            raise ConfigError(
+                f"Failed parsing 'retry' in forward to '{name}' in '{self.name}.conf': {e}"
+            ) from e
+        return RetryPolicy(attempts, backoff, max_backoff, budget)
+
     def _load_checks(self, check_dict: Dict) -> List[Check]:
         checks = []
         if not check_dict:
@@ -425,10 +624,9 @@ class Endpoint:
         result = Result(self.name)
 
         if self.before:
-            for forward in self.before:
-                result_forward = await forward.trigger(self.type, {}, hosts)
+            results = await self._trigger("before", self.before, self.type, {}, hosts)
+            for forward, result_forward in zip(self.before, results):
                 result.embed(forward.name, result_forward)
-                # TODO: run these concurrently?
 
         # Only forward values we expect
         filtered_request = copy(self.values)
@@ -466,23 +664,39 @@ class Endpoint:
 
         # Send values from state if not found in request (some type checking is done in constructor
         # and when state changed)
+        state_version = None
         if self.send_state:
             send_state = self.state.read(self.send_state)
             if filtered_request:
                 send_state.update(filtered_request)
+            else:
+                # Only the state is sent, forwards can reuse what they encoded for it
+                state_version = self.state.version
             filtered_request = send_state
 
         # Forward the request to group and then to other coco endpoints
-        # TODO: should we do that concurrently?
-        for forward in self.forwards_external:
-            result_forward = await forward.trigger(
-                self.type, filtered_request, hosts, params
+        external = self._trigger(
+            "forward",
+            self.forwards_external,
+            self.type,
+            filtered_request,
+            hosts,
+            params,
+            state_version,
+        )
+        internal = self._trigger(
+            "coco", self.forwards_internal, self.type, filtered_request, hosts, params
+        )
+        if {"forward", "coco"} <= self.parallel:
+            results_external, results_internal = await asyncio.gather(
+                external, internal
             )
+        else:
+            results_external = await external
+            results_internal = await internal
+        for result_forward in results_external:
             result.add_result(result_forward)
-        for forward in self.forwards_internal:
-            result_forward = await forward.trigger(
-                self.type, filtered_request, hosts, params
-            )
+        for forward, result_forward in zip(self.forwards_internal, results_internal):
             result.embed(forward.name, result_forward)
 
         # Look for result type parameter in request
@@ -499,10 +713,9 @@ class Endpoint:
                 result.add_message(msg)
 
         if self.after:
-            for forward in self.after:
-                result_forward = await forward.trigger(self.type, {}, hosts)
+            results = await self._trigger("after", self.after, self.type, {}, hosts)
+            for forward, result_forward in zip(self.after, results):
                 result.embed(forward.name, result_forward)
-                # TODO: run these concurrently?
 
         if self.get_state:
             result.state(self.state.extract(self.get_state))
@@ -516,6 +729,34 @@ class Endpoint:
 
         return result
 
+    async def _trigger(self, stage, forwards, *args):
+        """
+        Trigger forwards, all at the same time if the stage is parallel.
+
+        Parameters
+        ----------
+        stage : str
+            One of `PARALLEL_STAGES`.
+        forwards : list of :class:`Forward`
+            The forwards.
+        *args
+            Passed to :meth:`Forward.trigger`.
+
+        Returns
+        -------
+        list of :class:`Result`
+            Results of the forwards, in the same order.
+        """
+        if stage not in self.parallel:
+            return [await forward.trigger(*args) for forward in forwards]
+        tasks = [asyncio.ensure_future(forward.trigger(*args)) for forward in forwards]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
     def write_timestamp(self):
         """
         Write a Unix timestamp (float) to the state.
@@ -620,7 +861,10 @@ class Endpoint:
             async with ClientSession() as session:
                 try:
                     command = getattr(session, type_.lower())
-                    async with command(url, json=data) as resp:
+                    headers = {}
+                    if getattr(args, "priority", None):
+                        headers["X-Coco-Priority"] = args.priority
+                    async with command(url, json=data, headers=headers) as resp:
                         try:
                             result = await resp.json()
                         except ContentTypeError:
@@ -692,6 +936,12 @@ class LocalEndpoint:
         strings.
     callable
         A callable that will be called to execute the endpoint.
+    isolation
+        One of "auto" (default), "exclusive" or "shared". See the `isolation` endpoint
+        config option.
+    state_access
+        Parts of the state the callable reads or writes. Keys are state paths, values
+        are `True` for writing.
     """
 
     call_on_start = False
@@ -701,12 +951,30 @@ class LocalEndpoint:
         name: str,
         type_: Union[str, List[str]],
         callable: Callable[[sanic.request.Request], Optional[dict]],
+        isolation: str = "auto",
+        state_access: Optional[Dict[str, bool]] = None,
     ):
         self.name = name
         self.type = type_
         self.callable = callable
+        self.isolation = isolation
+        self.pool = DEFAULT_POOL
+        self.priority = DEFAULT_PRIORITY
+        self.coalesce = False
+        self.memoize = False
+        self._state_access = state_access or {}
+        self.state_locks = {"": True}
         self.schedule = None
 
+    def state_access(self) -> Dict[str, bool]:
+        """List the parts of the state this endpoint reads or writes."""
+        return self._state_access
+
+    @staticmethod
+    def linked_endpoints() -> List[str]:
+        """List the coco endpoints this endpoint may call (none)."""
+        return []
+
     async def call(self, request, **_):
         """Call the local endpoint."""
         return await self.callable(request)
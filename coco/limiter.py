@@ -0,0 +1,282 @@
+"""Limits of the requests sent to hosts and groups at the same time."""
+
+import asyncio
+import collections
+import contextlib
+import logging
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from .exceptions import ConfigError
+from .util import Host
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyLimiter:
+    """
+    Limit the number of requests in flight to each host and each group.
+
+    The limits are shared by all forwards of a worker process. A request waits until all
+    limits of its host allow it: the one of the host and the ones of all groups the host is
+    in.
+
+    Parameters
+    ----------
+    per_host : int
+        Maximum number of requests in flight to any host, `0` for no limit.
+    hosts : dict
+        Limits of single hosts, overwriting `per_host`.
+    groups : dict
+        Maximum number of requests in flight to all hosts of a group together.
+    """
+
+    def __init__(
+        self,
+        per_host: int = 0,
+        hosts: Dict[Host, int] = None,
+        groups: Dict[str, int] = None,
+    ):
+        self.per_host = per_host
+        self.hosts = hosts or {}
+        self.groups = groups or {}
+        self._groups_of = {}
+        self._semaphores = {}
+
+    @classmethod
+    def from_config(cls, conf: dict):
+        """
+        Load from the `concurrency_limits` block of the coco config.
+
+        Parameters
+        ----------
+        conf : dict
+            The config block with the optional keys `per_host`, `hosts` and `groups`.
+
+        Returns
+        -------
+        :class:`ConcurrencyLimiter`
+            The limiter.
+        """
+        if not isinstance(conf, dict):
+            raise ConfigError(
+                f"Value 'concurrency_limits' is of type '{type(conf).__name__}' (expected "
+                f"dict)."
+            )
+
+        def limit(value, where):
+            if not isinstance(value, int) or value < 0:
+                raise ConfigError(
+                    f"Value 'concurrency_limits/{where}' is '{value}' (expected an "
+                    f"integer >= 0)."
+                )
+            return value
+
+        def limits(key):
+            block = conf.get(key, {})
+            if not isinstance(block, dict):
+                raise ConfigError(
+                    f"Value 'concurrency_limits/{key}' is of type "
+                    f"'{type(block).__name__}' (expected dict)."
+                )
+            return {name: limit(n, f"{key}/{name}") for name, n in block.items()}
+
+        return cls(
+            limit(conf.get("per_host", 0), "per_host"),
+            {Host(host): n for host, n in limits("hosts").items()},
+            limits("groups"),
+        )
+
+    def add_group(self, name: str, hosts: Iterable[Host]):
+        """
+        Tell the limiter which hosts are in a group.
+
+        Parameters
+        ----------
+        name : str
+            Name of the group.
+        hosts : list of :class:`Host`
+            Hosts in the group.
+        """
+        if not self.groups.get(name):
+            return
+        for host in hosts:
+            self._groups_of.setdefault(host, []).append(name)
+
+    def limits(self, host: Host) -> List[Tuple[str, int]]:
+        """
+        Get the limits of a host.
+
+        Parameters
+        ----------
+        host : :class:`Host`
+            The host.
+
+        Returns
+        -------
+        list of (str, int)
+            Name and value of each limit, in the order they are waited for.
+        """
+        limits = [
+            (f"group {group}", self.groups[group])
+            for group in sorted(self._groups_of.get(host, []))
+        ]
+        per_host = self.hosts.get(host, self.per_host)
+        if per_host:
+            limits.append((f"host {host}", per_host))
+        return limits
+
+    @contextlib.asynccontextmanager
+    async def slot(self, host: Host):
+        """
+        Wait until all limits of a host allow another request and hold them while it runs.
+
+        Parameters
+        ----------
+        host : :class:`Host`
+            The host to send the request to.
+        """
+        # Always taken in the same order, so that requests waiting for the same limits
+        # can't block each other
+        async with contextlib.AsyncExitStack() as stack:
+            for name, limit in self.limits(host):
+                if name not in self._semaphores:
+                    self._semaphores[name] = asyncio.Semaphore(limit)
+                await stack.enter_async_context(self._semaphores[name])
+            yield
+
+
+class AIMDLimit:
+    """
+    Adapt the number of requests in flight to all hosts to how well they cope.
+
+    The limit grows by one for every round of requests that went well (additive increase)
+    and is cut by `backoff` when a request times out, gets a 5xx reply or takes longer
+    than usual (multiplicative decrease), at most once per round: requests that were
+    sent before the last cut don't cut it again.
+
+    Parameters
+    ----------
+    initial : int
+        Limit to start with.
+    minimum : int
+        Lowest limit.
+    maximum : int
+        Highest limit.
+    backoff : float
+        Factor the limit is multiplied with when it is cut.
+    """
+
+    def __init__(
+        self,
+        initial: int = 16,
+        minimum: int = 1,
+        maximum: int = 1000,
+        backoff: float = 0.5,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.limit = float(initial)
+        self.in_flight = 0
+        self._waiting = collections.deque()
+        self._last_cut = 0.0
+
+    @classmethod
+    def from_config(cls, conf: dict):
+        """
+        Load from the `adaptive_concurrency` block of the coco config.
+
+        Parameters
+        ----------
+        conf : dict
+            The config block with the optional keys `initial`, `min`, `max` and `backoff`.
+
+        Returns
+        -------
+        :class:`AIMDLimit`
+            The limit.
+        """
+        if conf is True:
+            conf = {}
+        if not isinstance(conf, dict):
+            raise ConfigError(
+                f"Value 'adaptive_concurrency' is of type '{type(conf).__name__}' "
+                f"(expected dict)."
+            )
+        default = cls()
+        limits = {}
+        for key, value in [
+            ("initial", default.limit),
+            ("min", default.minimum),
+            ("max", default.maximum),
+        ]:
+            limits[key] = conf.get(key, int(value))
+            if not isinstance(limits[key], int) or limits[key] < 1:
+                raise ConfigError(
+                    f"Value 'adaptive_concurrency/{key}' is '{limits[key]}' (expected an "
+                    f"integer >= 1)."
+                )
+        if not limits["min"] <= limits["initial"] <= limits["max"]:
+            raise ConfigError(
+                f"Value 'adaptive_concurrency/initial' ({limits['initial']}) has to be "
+                f"between 'min' ({limits['min']}) and 'max' ({limits['max']})."
+            )
+        backoff = conf.get("backoff", default.backoff)
+        if not isinstance(backoff, (int, float)) or not 0 < backoff < 1:
+            raise ConfigError(
+                f"Value 'adaptive_concurrency/backoff' is '{backoff}' (expected a number "
+                f"between 0 and 1)."
+            )
+        return cls(limits["initial"], limits["min"], limits["max"], backoff)
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Wait until less than `limit` requests are in flight and count this one."""
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiting.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiting:
+                    self._waiting.remove(waiter)
+                else:
+                    # Pass on the wake-up
+                    self._wake()
+                raise
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._wake()
+
+    def _wake(self):
+        """Let waiting requests check the limit again."""
+        for _ in range(max(int(self.limit) - self.in_flight, 0)):
+            if not self._waiting:
+                return
+            waiter = self._waiting.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def record(self, sent: float, congested: bool):
+        """
+        Adapt the limit to the outcome of a request.
+
+        Parameters
+        ----------
+        sent : float
+            When the request was sent (`time.time()`).
+        congested : bool
+            If the request timed out, got a 5xx reply or took longer than usual.
+        """
+        if not congested:
+            self.limit = min(self.limit + 1 / self.limit, self.maximum)
+            self._wake()
+        elif sent >= self._last_cut:
+            limit = max(self.limit * self.backoff, self.minimum)
+            logger.debug(f"Adaptive concurrency: cutting limit to {int(limit)}.")
+            self.limit = limit
+            self._last_cut = time.time()
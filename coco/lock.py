@@ -0,0 +1,146 @@
+"""
+coco lock module.
+
+Locks used by the worker to decide which endpoint calls may run at the same time.
+"""
+import asyncio
+from typing import Dict, Tuple
+
+
+def split_path(path: str) -> Tuple[str]:
+    """
+    Split a state path into its parts.
+
+    Parameters
+    ----------
+    path : str
+        `"path/to/an/entry"`. `None`, `""` and `"/"` refer to the root of the state.
+
+    Returns
+    -------
+    tuple of str
+        The non-empty parts of the path.
+    """
+    if not path:
+        return ()
+    return tuple(part for part in path.split("/") if part != "")
+
+
+def _overlap(a: Tuple[str], b: Tuple[str]) -> bool:
+    """Tell if one path is the same as or inside the other."""
+    n = min(len(a), len(b))
+    return a[:n] == b[:n]
+
+
+class _LockRequest:
+    """A request for a :class:`PathLock`. Returned by :meth:`PathLock.acquire`."""
+
+    def __init__(self, paths: Dict[Tuple[str], bool]):
+        self.paths = paths
+        self.granted = asyncio.get_event_loop().create_future()
+
+    def conflicts(self, other) -> bool:
+        """Tell if this and the other request can't hold the lock at the same time."""
+        # Exclusive access to the whole tree conflicts even with requests touching nothing
+        if self.paths.get(()) or other.paths.get(()):
+            return True
+        for path, exclusive in self.paths.items():
+            for other_path, other_exclusive in other.paths.items():
+                if (exclusive or other_exclusive) and _overlap(path, other_path):
+                    return True
+        return False
+
+    async def wait(self):
+        """Wait until the lock is granted."""
+        await self.granted
+
+
+class PathLock:
+    """
+    A fair readers/writer lock over the subtrees of a tree of paths.
+
+    Each request names the paths it touches and if it needs shared (read) or exclusive
+    (write) access to each of them. A path covers everything below it and the empty
+    path covers the whole tree. Two requests conflict if any of their paths overlap and
+    at least one of them needs exclusive access there.
+
+    Requests are granted in the order they were made: a request is only granted if it
+    conflicts neither with a request holding the lock nor with an earlier request that
+    is still waiting. A request that touches no paths is granted immediately, unless an
+    exclusive request for the empty path (the whole tree) holds the lock or waits for it.
+
+    Unlike :class:`asyncio.Lock`, acquiring is split in two steps: :meth:`acquire`
+    queues the request right away, which fixes its place in line, and the returned
+    request can be awaited later.
+    """
+
+    def __init__(self):
+        self._held = []
+        self._waiting = []
+
+    def acquire(self, paths: Dict[str, bool]) -> _LockRequest:
+        """
+        Queue a request for the lock.
+
+        Parameters
+        ----------
+        paths : dict
+            Keys are state paths, values are `True` for exclusive and `False` for shared
+            access.
+
+        Returns
+        -------
+        request
+            Call `await request.wait()` to wait until the lock is granted. Pass it to
+            :meth:`release` when done.
+        """
+        split = {}
+        for path, exclusive in paths.items():
+            path = split_path(path)
+            split[path] = split.get(path, False) or bool(exclusive)
+        request = _LockRequest(split)
+        self._waiting.append(request)
+        self._wake()
+        return request
+
+    def release(self, request: _LockRequest):
+        """
+        Release the lock or give up waiting for it.
+
+        Parameters
+        ----------
+        request
+            The request returned by :meth:`acquire`.
+        """
+        if request in self._held:
+            self._held.remove(request)
+        elif request in self._waiting:
+            self._waiting.remove(request)
+            request.granted.cancel()
+        self._wake()
+
+    @property
+    def locked(self) -> bool:
+        """
+        Tell if the lock is held by anyone.
+
+        Returns
+        -------
+        bool
+            True if any request holds the lock.
+        """
+        return bool(self._held)
+
+    def _wake(self):
+        """Grant the lock to all waiting requests that can have it now."""
+        still_waiting = []
+        for request in self._waiting:
+            if any(request.conflicts(other) for other in self._held) or any(
+                request.conflicts(other) for other in still_waiting
+            ):
+                still_waiting.append(request)
+                continue
+            self._held.append(request)
+            if not request.granted.done():
+                request.granted.set_result(None)
+        self._waiting = still_waiting
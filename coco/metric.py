@@ -4,10 +4,14 @@ coco metric module.
 Helper functions for prometheus metric exporting.
 """
 
+from bisect import bisect_left
 import logging
+import math
 import threading
+from typing import Optional
 
 import aiohttp
+from prometheus_client import Histogram
 from prometheus_client.exposition import (
     MetricsHandler,
     choose_encoder,
@@ -48,6 +52,100 @@ class CallbackMetricsHandler(MetricsHandler):
         self.wfile.write(output)
 
 
+class ResponseTimes:
+    """
+    Distribution of response times, to estimate their quantiles.
+
+    Counts the observations in the buckets of a prometheus histogram, so the estimates are
+    what `histogram_quantile` gives for that histogram.
+
+    Parameters
+    ----------
+    buckets : list of float
+        Upper bounds of the buckets. Default: the buckets of prometheus histograms.
+    """
+
+    def __init__(self, buckets=Histogram.DEFAULT_BUCKETS):
+        self._bounds = [float(b) for b in buckets]
+        if not math.isinf(self._bounds[-1]):
+            self._bounds.append(math.inf)
+        self._counts = [0] * len(self._bounds)
+        self.count = 0
+
+    def observe(self, value: float):
+        """Add a response time."""
+        self._counts[bisect_left(self._bounds, value)] += 1
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate a quantile of the response times.
+
+        Parameters
+        ----------
+        q : float
+            The quantile, between 0 and 1.
+
+        Returns
+        -------
+        float
+            Response time in seconds or `None` if nothing was observed yet.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, n in zip(self._bounds, self._counts):
+            if n and seen + n >= rank:
+                if math.isinf(bound):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / n
+            seen += n
+            lower = bound
+        return lower
+
+
+class LatencyEstimate:
+    """
+    Smoothed latency and its mean deviation, estimated like TCP round trip times (RFC 6298).
+
+    Attributes
+    ----------
+    mean : float
+        Smoothed latency in seconds, `None` before the first observation.
+    deviation : float
+        Smoothed mean deviation from it in seconds.
+    """
+
+    def __init__(self):
+        self.mean = None
+        self.deviation = None
+
+    def observe(self, value: float):
+        """Add a latency."""
+        if self.mean is None:
+            self.mean = value
+            self.deviation = value / 2
+        else:
+            self.deviation = 0.75 * self.deviation + 0.25 * abs(self.mean - value)
+            self.mean = 0.875 * self.mean + 0.125 * value
+
+    @property
+    def value(self) -> Optional[float]:
+        """
+        Get the latency that is rarely exceeded: the mean plus four times the deviation.
+
+        Returns
+        -------
+        float
+            Latency in seconds or `None` if nothing was observed yet.
+        """
+        if self.mean is None:
+            return None
+        return self.mean + 4 * self.deviation
+
+
 def start_metrics_server(port, callbacks=None, addr=""):
     """Based on `prometheus_client.exposition.start_http_server` using custom handler."""
     handler = CallbackMetricsHandler.factory(REGISTRY)
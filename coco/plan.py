@@ -0,0 +1,207 @@
+"""Execution plans of the endpoints."""
+
+import logging
+from collections import Counter
+from typing import Dict, List
+
+from .exceptions import ConfigError, InvalidUsage
+from .request_forwarder import CocoForward
+from .result import Result
+from .util import Host
+
+logger = logging.getLogger(__name__)
+
+
+class Plan:
+    """
+    Execution plan of an endpoint.
+
+    Attributes
+    ----------
+    name : str
+        Name of the endpoint.
+    stages : list of dict
+        The stages that run one after the other: their name, if their forwards run at the
+        same time and the forwards.
+    rounds : int
+        Number of fan-outs to hosts that run one after the other on the critical path.
+    critical_path : list of str
+        The forwards on the longest chain of fan-outs, including the ones of the coco
+        endpoints called on the way.
+    fan_out : int
+        Number of calls to hosts per call of the endpoint, if all groups are called.
+    calls : :class:`collections.Counter`
+        How often each coco endpoint is called, directly or indirectly, per call.
+    on_failure : list of str
+        Coco endpoints that may be called by `on_failure` actions of checks.
+    """
+
+    def __init__(self, name, stages, rounds, critical_path, fan_out, calls, on_failure):
+        self.name = name
+        self.stages = stages
+        self.rounds = rounds
+        self.critical_path = critical_path
+        self.fan_out = fan_out
+        self.calls = calls
+        self.on_failure = on_failure
+
+    @property
+    def shared(self) -> Dict[str, int]:
+        """Get the coco endpoints called more than once per call and how often."""
+        return {name: n for name, n in self.calls.items() if n > 1}
+
+    def report(self) -> dict:
+        """Describe the plan in a JSON serialisable dict."""
+        return {
+            "stages": self.stages,
+            "rounds": self.rounds,
+            "critical_path": self.critical_path,
+            "fan_out": self.fan_out,
+            "shared": self.shared,
+            "on_failure": self.on_failure,
+        }
+
+
+class Plans:
+    """
+    Compile the execution plans of all endpoints.
+
+    Parameters
+    ----------
+    endpoints : dict
+        All endpoints by name. Endpoints added later are included by :meth:`compile`.
+    groups : dict
+        The hosts of each group.
+    """
+
+    def __init__(self, endpoints: Dict, groups: Dict[str, List[Host]]):
+        self._endpoints = endpoints
+        self._groups = groups
+        self._plans = {}
+
+    def compile(self):
+        """
+        Compile the plans once all endpoints are loaded.
+
+        Follows the `before`, `call` and `after` forwards and the `on_failure` actions of all
+        endpoints to make sure they don't call each other in a cycle.
+
+        Raises
+        ------
+        :class:`ConfigError`
+            If an endpoint calls an endpoint that doesn't exist or endpoints call each other
+            in a cycle.
+        """
+        self._check_cycles()
+        self._plans = {}
+        for name in self._endpoints:
+            self._compile(name)
+
+    def __getitem__(self, name: str) -> Plan:
+        return self._plans[name]
+
+    def _check_cycles(self):
+        """Raise a :class:`ConfigError` if endpoints call each other in a cycle."""
+        done = set()
+
+        def visit(name, path):
+            if name in path:
+                cycle = path[path.index(name) :] + [name]
+                raise ConfigError(
+                    f"Endpoints call each other in a cycle: "
+                    f"{' -> '.join(f'/{n}' for n in cycle)}."
+                )
+            if name in done:
+                return
+            if name not in self._endpoints:
+                raise ConfigError(
+                    f"coco.endpoint: endpoint `{name}` called by `{path[-1]}` does not "
+                    f"exist."
+                )
+            for linked in self._endpoints[name].linked_endpoints():
+                visit(linked, path + [name])
+            done.add(name)
+
+        for name in self._endpoints:
+            visit(name, [])
+
+    def _compile(self, name: str) -> Plan:
+        if name in self._plans:
+            return self._plans[name]
+        endpoint = self._endpoints[name]
+        parallel = getattr(endpoint, "parallel", set())
+        external = getattr(endpoint, "forwards_external", [])
+        internal = getattr(endpoint, "forwards_internal", [])
+
+        # Groups of forwards that run one after the other
+        steps = [("before", getattr(endpoint, "before", []), "before" in parallel)]
+        if {"forward", "coco"} <= parallel:
+            steps.append(("call", external + internal, True))
+        else:
+            steps.append(("forward", external, "forward" in parallel))
+            steps.append(("coco", internal, "coco" in parallel))
+        steps.append(("after", getattr(endpoint, "after", []), "after" in parallel))
+
+        stages = []
+        rounds = 0
+        critical_path = []
+        fan_out = 0
+        calls = Counter()
+        on_failure = set()
+        for stage, forwards, stage_parallel in steps:
+            if not forwards:
+                continue
+            stages.append(
+                {
+                    "stage": stage,
+                    "parallel": stage_parallel,
+                    "forwards": [self._label(f) for f in forwards],
+                }
+            )
+            costs = []
+            for forward in forwards:
+                for check in forward.check or []:
+                    on_failure.update(check.linked_endpoints())
+                if isinstance(forward, CocoForward):
+                    sub = self._compile(forward.name)
+                    costs.append(
+                        (sub.rounds, [self._label(forward)] + sub.critical_path)
+                    )
+                    fan_out += sub.fan_out
+                    calls[forward.name] += 1
+                    calls.update(sub.calls)
+                else:
+                    costs.append((1, [self._label(forward)]))
+                    fan_out += len(self._groups.get(forward.group, []))
+            if stage_parallel:
+                stage_rounds, stage_path = max(costs, key=lambda cost: cost[0])
+            else:
+                stage_rounds = sum(cost[0] for cost in costs)
+                stage_path = [label for cost in costs for label in cost[1]]
+            rounds += stage_rounds
+            critical_path += stage_path
+
+        plan = Plan(
+            name, stages, rounds, critical_path, fan_out, calls, sorted(on_failure)
+        )
+        if plan.shared:
+            logger.debug(f"/{name} calls some endpoints more than once: {plan.shared}")
+        self._plans[name] = plan
+        return plan
+
+    @staticmethod
+    def _label(forward) -> str:
+        if isinstance(forward, CocoForward):
+            return f"/{forward.name}"
+        return f"{forward.name} ({forward.group})"
+
+    async def process_get(self, request):
+        """Process the GET request."""
+        name = (request or {}).get("endpoint")
+        if name is None:
+            plans = {name: plan.report() for name, plan in self._plans.items()}
+        elif name in self._plans:
+            plans = {name: self._plans[name].report()}
+        else:
+            raise InvalidUsage(f"Endpoint /{name} not found.")
+        return Result("plan", result={Host("coco"): (plans, 200)}, type_="FULL")
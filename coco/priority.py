@@ -0,0 +1,69 @@
+"""
+coco priority module.
+
+Decides which priority class of the request queue the worker serves next.
+"""
+from typing import Dict, List
+
+
+class WeightedRoundRobin:
+    """
+    Smooth weighted round robin over priority classes.
+
+    Every time a class is served, all classes with waiting requests earn their weight in
+    credit and the served class pays the sum of their weights. The class with the most
+    credit is served next, so over time each class that always has requests waiting is
+    served in proportion to its weight, and the heavier classes are served first. Classes
+    without waiting requests can't save up credit while they are empty, so they can't take
+    over the worker once requests arrive.
+
+    Parameters
+    ----------
+    weights : dict
+        Names of the priority classes and their weights.
+    """
+
+    def __init__(self, weights: Dict[str, int]):
+        self._weights = dict(weights)
+        self._credit = {name: 0 for name in self._weights}
+
+    def order(self) -> List[str]:
+        """
+        Get the order in which to check the classes for waiting requests.
+
+        Returns
+        -------
+        list of str
+            Names of all classes. The class that is due comes first, followed by the
+            classes to serve instead if it has no waiting requests.
+        """
+        return sorted(
+            self._weights,
+            key=lambda name: (
+                self._credit[name] + self._weights[name],
+                self._weights[name],
+            ),
+            reverse=True,
+        )
+
+    def served(self, name: str):
+        """
+        Update the credit after a request of a class was served.
+
+        Parameters
+        ----------
+        name : str
+            Name of the class that was served.
+        """
+        order = self.order()
+        # The classes that were due before the served one are empty. They neither earn
+        # credit nor take part in the round.
+        empty = order[: order.index(name)]
+        for other in empty:
+            self._credit[other] = min(self._credit[other], 0)
+
+        total = 0
+        for other in order[len(empty) :]:
+            self._credit[other] += self._weights[other]
+            total += self._weights[other]
+        self._credit[name] -= total
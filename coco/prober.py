@@ -0,0 +1,165 @@
+"""Health probes of the hosts."""
+
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional
+
+import aiohttp
+
+from .exceptions import ConfigError
+from .task_pool import TaskPool
+from .util import Host, str2total_seconds
+
+logger = logging.getLogger(__name__)
+
+DOWN_REPLY = "Host down (health probe failed)"
+
+
+class HealthProber:
+    """
+    Probe hosts in the background to find the ones that are down.
+
+    A probe opens a TCP connection to the host or, if `endpoint` is set, calls that endpoint.
+    Any HTTP reply counts as up. Hosts that weren't probed yet count as up.
+
+    Parameters
+    ----------
+    interval : float
+        Seconds between the rounds of probes.
+    concurrency : int
+        Maximum number of hosts probed at the same time.
+    timeout : float
+        Seconds a host has to answer a probe.
+    endpoint : str
+        Endpoint to call with a GET request. Default: only open a TCP connection.
+    """
+
+    def __init__(
+        self,
+        interval: float = 10.0,
+        concurrency: int = 20,
+        timeout: float = 1.0,
+        endpoint: Optional[str] = None,
+    ):
+        self.interval = interval
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.endpoint = endpoint
+        self._up = {}
+
+    @classmethod
+    def from_config(cls, conf: dict):
+        """
+        Load from the `health_probe` block of the coco config.
+
+        Parameters
+        ----------
+        conf : dict
+            The config block with the optional keys `interval`, `concurrency`, `timeout` and
+            `endpoint`.
+
+        Returns
+        -------
+        :class:`HealthProber`
+            The prober.
+        """
+        if not isinstance(conf, dict):
+            raise ConfigError(
+                f"Value 'health_probe' is of type '{type(conf).__name__}' (expected dict)."
+            )
+        default = cls()
+        concurrency = conf.get("concurrency", default.concurrency)
+        if not isinstance(concurrency, int) or concurrency < 1:
+            raise ConfigError(
+                f"Value 'health_probe/concurrency' is '{concurrency}' (expected an "
+                f"integer >= 1)."
+            )
+        endpoint = conf.get("endpoint", default.endpoint)
+        if endpoint is not None and not isinstance(endpoint, str):
+            raise ConfigError(
+                f"Value 'health_probe/endpoint' is of type '{type(endpoint).__name__}' "
+                f"(expected str)."
+            )
+        try:
+            interval = str2total_seconds(conf.get("interval", default.interval))
+            timeout = str2total_seconds(conf.get("timeout", default.timeout))
+        except ValueError as e:
+            raise ConfigError(
+                f"Failed parsing value 'health_probe/interval' or 'health_probe/timeout': "
+                f"{e}"
+            ) from e
+        return cls(interval, concurrency, timeout, endpoint)
+
+    def is_down(self, host: Host) -> bool:
+        """Tell if the last probe of a host failed."""
+        return self._up.get(host) is False
+
+    def states(self) -> Dict[Host, bool]:
+        """
+        Get the results of the last probes.
+
+        Returns
+        -------
+        dict
+            `True` for each host that is up.
+        """
+        return dict(self._up)
+
+    async def _probe(self, host: Host, session: aiohttp.ClientSession) -> bool:
+        """Probe a host."""
+        try:
+            if self.endpoint is None:
+                _, writer = await asyncio.wait_for(
+                    asyncio.open_connection(host.hostname, host.port), self.timeout
+                )
+                writer.close()
+            else:
+                async with session.get(
+                    host.join_endpoint(self.endpoint),
+                    timeout=aiohttp.ClientTimeout(self.timeout),
+                ) as response:
+                    await response.read()
+        except (OSError, asyncio.TimeoutError, aiohttp.ClientError) as e:
+            logger.debug(f"Health probe of {host} failed: {e!r}")
+            return False
+        return True
+
+    async def probe(
+        self, hosts: Iterable[Host], session: aiohttp.ClientSession
+    ) -> List[Host]:
+        """
+        Probe hosts once.
+
+        Parameters
+        ----------
+        hosts : list of :class:`Host`
+            Hosts to probe.
+        session : :class:`aiohttp.ClientSession`
+            Session to call the probe endpoint with.
+
+        Returns
+        -------
+        list of :class:`Host`
+            Hosts that were down and are up again.
+        """
+
+        async def probe(host):
+            return host, await self._probe(host, session)
+
+        tasks = TaskPool(self.concurrency)
+        try:
+            for host in hosts:
+                await tasks.put(probe(host))
+            results = await tasks.join()
+        except asyncio.CancelledError:
+            tasks.cancel()
+            raise
+        came_back = []
+        for host, up in results:
+            if up and self._up.get(host) is False:
+                logger.info(f"Health probe: {host} is up again.")
+                came_back.append(host)
+            elif not up and self._up.get(host) is not False:
+                logger.warning(f"Health probe: {host} is down.")
+            self._up[host] = up
+        return came_back
@@ -1,25 +1,132 @@
 """Forward requests to a set of hosts."""
+import asyncio
 from asyncio import TimeoutError as AsyncioTimeoutError
+import contextlib
+import contextvars
 import copy
 import os
 import json
 import logging
+import math
+import random
+import socket
 import time
-from typing import Iterable
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import aiohttp
-import redis
+from aiohttp.abc import AbstractResolver
+from aiohttp.resolver import DefaultResolver
 from prometheus_client import Counter, Gauge, Histogram
 
 from .task_pool import TaskPool
-from .metric import start_metrics_server
-from .util import Host
+from .metric import LatencyEstimate, ResponseTimes, start_metrics_server
+from . import prober
+from .util import (
+    DEFAULT_POOL,
+    DEFAULT_PRIORITY,
+    Host,
+    queue_name,
+    str2total_seconds,
+)
 from .blocklist import Blocklist
+from . import breaker
+from .check import ReplyStream
+from .limiter import AIMDLimit, ConcurrencyLimiter
+from .exceptions import ConfigError, InvalidUsage
 from .result import Result
 
 
 logger = logging.getLogger(__name__)
 
+# Replies of an endpoint to observe before its response times are used for hedging
+HEDGE_MIN_REPLIES = 20
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Name of the local endpoint of relays
+RELAY_ENDPOINT = "relay"
+# Seconds a relay gets on top of the time its hosts may take, for its queue and overhead
+RELAY_TIMEOUT_MARGIN = 2.0
+
+
+def encode_request(request) -> Optional[bytes]:
+    """
+    Encode request data as the JSON body of a forwarded call.
+
+    Parameters
+    ----------
+    request : dict or None
+        Request data.
+
+    Returns
+    -------
+    bytes or None
+        The body, `None` if there is no request data to send.
+    """
+    if request is None:
+        return None
+    return json.dumps(request).encode()
+
+
+# Results of memoized coco endpoints in the endpoint call currently processed, see
+# `memo_scope`
+_memo = contextvars.ContextVar("memo", default=None)
+
+
+@contextlib.contextmanager
+def memo_scope():
+    """
+    Share the results of memoized coco endpoints within one endpoint call.
+
+    Identical calls (same endpoint, hosts and request) to endpoints with `memoize` inside
+    this block only call the endpoint once and all get its result.
+    """
+    memo = {}
+    token = _memo.set(memo)
+    try:
+        yield
+    finally:
+        _memo.reset(token)
+        for call in memo.values():
+            call.cancel()
+
+
+def _pack_replies(replies: Dict[Host, Tuple]) -> dict:
+    """
+    Pack the replies of hosts, storing identical replies only once.
+
+    Parameters
+    ----------
+    replies : dict
+        Reply and status code of each host.
+
+    Returns
+    -------
+    dict
+        `replies` holds the distinct replies. `hosts` holds the index of the reply and the
+        status code of each host.
+    """
+    distinct = []
+    index = {}
+    hosts = {}
+    for host, (reply, status) in replies.items():
+        key = json.dumps(reply, sort_keys=True)
+        if key not in index:
+            index[key] = len(distinct)
+            distinct.append(reply)
+        hosts[str(host)] = [index[key], status]
+    return {"replies": distinct, "hosts": hosts}
+
+
+def _unpack_replies(packed: dict, hosts: Iterable[Host]) -> Dict[Host, Tuple]:
+    """Unpack the replies packed by :func:`_pack_replies` for the given hosts."""
+    by_name = {str(host): host for host in hosts}
+    return {
+        by_name[name]: (packed["replies"][i], status)
+        for name, (i, status) in packed["hosts"].items()
+        if name in by_name
+    }
+
 
 async def _dump_trace(session, context, params):  # pylint: disable=W0613
     """Tracing call back that dumps the current info."""
@@ -80,6 +187,178 @@ def _trace_config(trace_all=False):
     return _trace_config.obj
 
 
+class CachingResolver(AbstractResolver):
+    """
+    DNS resolver keeping the addresses of hosts for a while.
+
+    Parameters
+    ----------
+    ttl : float
+        Seconds to keep an address.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._resolver = DefaultResolver()
+        self._cache = {}
+
+    async def resolve(self, host, port=0, family=socket.AF_INET) -> List[dict]:
+        """Get the addresses of a host, from the cache if they are recent enough."""
+        key = (host, port, family)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        addresses = await self._resolver.resolve(host, port, family)
+        self._cache[key] = (time.monotonic() + self.ttl, addresses)
+        return addresses
+
+    async def close(self):
+        """Close the underlying resolver."""
+        await self._resolver.close()
+
+
+class RetryPolicy:
+    """
+    Retry calls to hosts that failed with a connection error, a timeout or were unavailable.
+
+    Parameters
+    ----------
+    attempts : int
+        Maximum number of calls to a host, including the first one.
+    backoff : float
+        Seconds to wait at most before the first retry. Doubles for every further retry.
+        The actual wait is random between 0 and this (full jitter).
+    max_backoff : float
+        Upper limit for the backoff in seconds.
+    budget : float
+        Fraction of the hosts of a call that may be retried, to avoid retry storms when
+        many hosts fail at once.
+    """
+
+    # Status codes of replies that are worth another try (0: connection error or timeout)
+    STATUS = {0, 502, 503, 504}
+
+    def __init__(self, attempts=3, backoff=0.1, max_backoff=2.0, budget=0.1):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+
+    def delay(self, attempt: int) -> float:
+        """
+        Get the seconds to wait before the retry after an attempt.
+
+        Parameters
+        ----------
+        attempt : int
+            Number of the attempt that failed, starting at 1.
+
+        Returns
+        -------
+        float
+            Seconds to wait.
+        """
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        )
+
+    def retries(self, n_hosts: int) -> int:
+        """
+        Get the number of retries for a call to some hosts.
+
+        Parameters
+        ----------
+        n_hosts : int
+            Number of hosts called.
+
+        Returns
+        -------
+        int
+            Number of retries allowed for all hosts together.
+        """
+        return math.ceil(self.budget * n_hosts)
+
+
+class AdaptiveTimeout:
+    """
+    Timeouts for each host learned from how long it took to reply before.
+
+    The timeout is the latency estimate of the host (see
+    :class:`coco.metric.LatencyEstimate`) times `multiplier`, but at least `floor` and at
+    most the configured timeout. Hosts that didn't reply before get the configured timeout.
+    A timed out request counts as a reply that took as long as the timeout, so the timeout
+    of a host that became slower grows back.
+
+    Parameters
+    ----------
+    multiplier : float
+        Factor for the latency estimate.
+    floor : float
+        Minimum timeout in seconds.
+    """
+
+    def __init__(self, multiplier=2.0, floor=1.0):
+        self.multiplier = multiplier
+        self.floor = floor
+
+    @classmethod
+    def from_config(cls, conf: dict, where: str):
+        """
+        Load from a config block.
+
+        Parameters
+        ----------
+        conf : dict
+            The config block with the optional keys `multiplier` and `floor`.
+        where : str
+            Where the block is, for error messages.
+
+        Returns
+        -------
+        :class:`AdaptiveTimeout`
+            The adaptive timeout.
+        """
+        if not isinstance(conf, dict):
+            raise ConfigError(
+                f"'adaptive_timeout' in {where} is of type '{type(conf).__name__}' "
+                f"(expected dict)."
+            )
+        default = cls()
+        multiplier = conf.get("multiplier", default.multiplier)
+        if not isinstance(multiplier, (int, float)) or multiplier <= 0:
+            raise ConfigError(
+                f"'adaptive_timeout/multiplier' in {where} is '{multiplier}' (expected a "
+                f"positive number)."
+            )
+        try:
+            floor = str2total_seconds(conf.get("floor", default.floor))
+        except ValueError as e:
+            raise ConfigError(
+                f"Failed parsing 'adaptive_timeout/floor' in {where}: {e}"
+            ) from e
+        return cls(multiplier, floor)
+
+    def timeout(self, latency: LatencyEstimate, ceiling: float) -> float:
+        """
+        Get the timeout for a host.
+
+        Parameters
+        ----------
+        latency : :class:`coco.metric.LatencyEstimate`
+            Latency estimate of the host, `None` if it never replied.
+        ceiling : float
+            The configured timeout in seconds.
+
+        Returns
+        -------
+        float
+            Timeout in seconds.
+        """
+        if latency is None or latency.value is None:
+            return ceiling
+        return min(ceiling, max(self.floor, self.multiplier * latency.value))
+
+
 class Forward:
     """
     Keep data about a forward to another endpoint.
@@ -92,8 +371,12 @@ class Forward:
     check
     timeout : int
         Timeout in seconds. If not set, coco will apply the globally configured timeout.
+    stream_checks : bool
+        Check the reply of each host as it arrives instead of waiting for all replies.
     """
 
+    stream_checks = False
+
     def __init__(self, name, group=None, request=None, check=None, timeout=None):
         self.name = name
         self.request = request
@@ -103,7 +386,9 @@ class Forward:
         if not self.request:
             self.request = {}
 
-    async def trigger(self, method, request=None, hosts=None, params=None):
+    async def trigger(
+        self, method, request=None, hosts=None, params=None, state_version=None
+    ):
         """
         Trigger the forwarding.
 
@@ -118,6 +403,9 @@ class Forward:
             (optional) The group or host(s) to forward to. If not supplied, the value set in the constructor is used.
         params : list of (key, value) pairs
             URL query parameters to forward to target endpoint.
+        state_version : int
+            (optional) Version of the state if `request` is an unchanged block of the state.
+            Lets the forward reuse the body it encoded for the same version before.
 
         Returns
         -------
@@ -133,6 +421,9 @@ class Forward:
             request.update(self.request)
         if not hosts:
             hosts = self.group
+        stream = None
+        if self.stream_checks and self.check:
+            stream = ReplyStream(self.check)
         forward_result = await self.forward_function(
             self.name,
             request,
@@ -140,15 +431,29 @@ class Forward:
             method=method,
             params=params,
             timeout=self.timeout,
+            state_version=state_version,
+            on_reply=stream.on_reply if stream else None,
         )
         if self.check:
             for check in self.check:
-                forward_result.success &= await check.run(forward_result)
+                if stream and stream.handles(check):
+                    success = await stream.finish(check, forward_result)
+                else:
+                    success = await check.run(forward_result)
+                forward_result.success &= success
 
         return forward_result
 
     def forward_function(
-        self, name, request, hosts=None, method=None, params=None, timeout=None
+        self,
+        name,
+        request,
+        hosts=None,
+        method=None,
+        params=None,
+        timeout=None,
+        state_version=None,
+        on_reply=None,
     ):
         """Pure virtual method, only use overwriting methods from sub classes."""
         raise NotImplementedError(
@@ -173,16 +478,91 @@ class CocoForward(Forward):
 
 
 class ExternalForward(Forward):
-    """Keep data about a forward to an external endpoint."""
+    """
+    Keep data about a forward to an external endpoint.
+
+    Attributes
+    ----------
+    quorum : int or float
+        Number or fraction of the hosts that have to reply with status 200 before the
+        forward is complete. If not set, all hosts are waited for.
+    finish_after_quorum : bool
+        Let the calls to the other hosts finish in the background once the quorum is
+        reached, instead of cancelling them.
+    hedge : float
+        Quantile of the response times of the endpoint after which a host that didn't reply
+        yet is called a second time. If not set, hosts are only called once.
+    retry : :class:`RetryPolicy`
+        How to retry failed calls to hosts. If not set, they are not retried.
+    adaptive_timeout : :class:`AdaptiveTimeout` or bool
+        Timeouts for each host for this forward. `False` to always use the configured
+        timeout. If not set, the default of the forwarder is used.
+    """
 
     # overwritten in __init__
     forward_function = None
 
-    def __init__(self, name, forwarder, group, request=None, check=None, timeout=None):
+    def __init__(
+        self,
+        name,
+        forwarder,
+        group,
+        request=None,
+        check=None,
+        timeout=None,
+        stream_checks=False,
+        quorum=None,
+        finish_after_quorum=False,
+        hedge=None,
+        retry=None,
+        adaptive_timeout=None,
+    ):
+        self.stream_checks = stream_checks
+        self.adaptive_timeout = adaptive_timeout
+        self.quorum = quorum
+        self.finish_after_quorum = finish_after_quorum
+        self.hedge = hedge
+        self.retry = retry
+        self._forwarder = forwarder
+        # State version and body of the last forwarded state block
+        self._state_body = (None, None)
         if forwarder:
-            self.forward_function = forwarder.external
+            self.forward_function = self._forward
         super().__init__(name, group, request, check, timeout)
 
+    async def _forward(
+        self,
+        name,
+        request,
+        hosts=None,
+        method=None,
+        params=None,
+        timeout=None,
+        state_version=None,
+        on_reply=None,
+    ):
+        if state_version is None:
+            body = encode_request(request)
+        else:
+            version, body = self._state_body
+            if version != state_version:
+                body = encode_request(request)
+                self._state_body = (state_version, body)
+        return await self._forwarder.external(
+            name,
+            body,
+            hosts,
+            method,
+            params,
+            timeout,
+            on_reply=on_reply,
+            quorum=self.quorum,
+            finish_after_quorum=self.finish_after_quorum,
+            hedge=self.hedge,
+            retry=self.retry,
+            adaptive_timeout=self.adaptive_timeout,
+        )
+
 
 class RequestForwarder:
     """Take requests and forward to a given set of hosts.
@@ -199,14 +579,46 @@ class RequestForwarder:
         self._endpoints = {}
         self._groups = {}
         self.session_limit = 1
+        self.forward_concurrency = 0
+        self._fan_out_slots = None
+        self.keepalive_timeout = 15
+        self.connections_per_host = 0
+        self.dns_cache_ttl = 600
+        self._session = None
+        self._connector = None
+        # Calls left to finish after their forward reached its quorum
+        self._background = set()
+        self._response_times = {}
+        self.adaptive_timeout = None
+        self._latency = {}
+        self.breakers = None
+        self.prober = None
+        self._probing = None
+        self.limiter = None
+        self.aimd = None
+        # Relays and the hosts they call
+        self._relays = {}
+        self._relay_of = {}
         self.blocklist = Blocklist([], blocklist_path)
         self.timeout = timeout
-        self.redis_conn = None
+        self._transport = None
         self.dropped_counter = None
+        self.coalesced_counter = None
+        self.memoized_counter = None
+        self.connection_pool_counter = None
+        self.open_connections = None
         self.call_counter = None
         self.queue_len = None
         self.queue_wait_time = None
         self.response_time = None
+        self.retry_counter = None
+        self.hedge_counter = None
+        self.hedge_won_counter = None
+        self.breaker_state = None
+        self.breaker_rejected_counter = None
+        self.host_up = None
+        self.limiter_wait_time = None
+        self.aimd_limit = None
         self._debug_connections = debug_connections
 
     def set_session_limit(self, session_limit):
@@ -223,6 +635,203 @@ class RequestForwarder:
         """
         self.session_limit = session_limit
 
+    def set_forward_concurrency(self, forward_concurrency: int):
+        """
+        Set the maximum number of forwards to hosts running at the same time.
+
+        Forwards over the limit wait for a running one to finish. Only the forwards to
+        hosts count, not the coco endpoints calling them, so nested calls can't block each
+        other.
+
+        Parameters
+        ----------
+        forward_concurrency : int
+            Maximum number of forwards running at the same time, `0` for no limit.
+        """
+        self.forward_concurrency = forward_concurrency
+
+    def set_adaptive_timeout(self, adaptive_timeout: AdaptiveTimeout):
+        """
+        Set the default timeouts for each host.
+
+        Parameters
+        ----------
+        adaptive_timeout : :class:`AdaptiveTimeout`
+            Timeouts learned for each host, `None` to use the configured timeout for all.
+        """
+        self.adaptive_timeout = adaptive_timeout
+
+    def set_circuit_breakers(self, breakers: breaker.CircuitBreakers):
+        """
+        Cut off hosts that keep failing.
+
+        Parameters
+        ----------
+        breakers : :class:`coco.breaker.CircuitBreakers`
+            The circuit breakers, `None` to always call all hosts.
+        """
+        self.breakers = breakers
+
+    def set_health_prober(self, prober_: prober.HealthProber):
+        """
+        Probe the hosts in the background and don't call the ones that are down.
+
+        The probes start with :meth:`start_health_probes`.
+
+        Parameters
+        ----------
+        prober_ : :class:`coco.prober.HealthProber`
+            The prober, `None` to not probe the hosts.
+        """
+        self.prober = prober_
+
+    def set_concurrency_limiter(self, limiter: ConcurrencyLimiter):
+        """
+        Limit the number of requests in flight to each host and group.
+
+        Groups added with :meth:`add_group` are passed on to the limiter.
+
+        Parameters
+        ----------
+        limiter : :class:`coco.limiter.ConcurrencyLimiter`
+            The limiter, `None` for no limits.
+        """
+        self.limiter = limiter
+        if limiter is not None:
+            for name, hosts in self._groups.items():
+                limiter.add_group(name, hosts)
+
+    def set_adaptive_concurrency(self, aimd: AIMDLimit):
+        """
+        Adapt the number of requests in flight to all hosts to how well they cope.
+
+        Parameters
+        ----------
+        aimd : :class:`coco.limiter.AIMDLimit`
+            The adaptive limit, `None` to only limit by `session_limit`.
+        """
+        self.aimd = aimd
+
+    def set_connection_pool(
+        self, keepalive_timeout: float, connections_per_host: int, dns_cache_ttl: float
+    ):
+        """
+        Configure the pool of connections to the hosts.
+
+        The pool is kept for the lifetime of the process, so connections are reused across
+        endpoint calls.
+
+        Parameters
+        ----------
+        keepalive_timeout : float
+            Seconds before an idle connection is closed.
+        connections_per_host : int
+            Maximum number of connections to each host. 0 for no limit.
+        dns_cache_ttl : float
+            Seconds to keep the address of a host.
+        """
+        self.keepalive_timeout = keepalive_timeout
+        self.connections_per_host = connections_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+
+    async def open_session(self):
+        """
+        Open the connection pool and look up the addresses of all hosts in the groups.
+
+        Call in the event loop that forwards the requests. Otherwise the pool is opened on the
+        first forwarded request.
+        """
+        if self._session is not None:
+            return
+        resolver = CachingResolver(self.dns_cache_ttl)
+        self._connector = aiohttp.TCPConnector(
+            limit=0,
+            limit_per_host=self.connections_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            resolver=resolver,
+            use_dns_cache=False,
+        )
+        trace_configs = [self._pool_trace_config()]
+        if self._debug_connections:
+            trace_configs.append(_trace_config())
+        self._session = aiohttp.ClientSession(
+            connector=self._connector, trace_configs=trace_configs
+        )
+
+        hosts = {(h.hostname, h.port) for hosts in self._groups.values() for h in hosts}
+        for hostname, port in hosts:
+            try:
+                await resolver.resolve(hostname, port, self._connector.family)
+            except OSError as err:
+                logger.warning(f"Failed resolving host {hostname}: {err}")
+
+    def start_health_probes(self):
+        """Probe all hosts in the groups until the session is closed, if a prober is set."""
+        if self.prober is not None and self._probing is None:
+            self._probing = asyncio.ensure_future(self._probe_hosts())
+
+    async def _probe_hosts(self):
+        await self.open_session()
+        while True:
+            blocklist = self.blocklist.hosts
+            # Relayed hosts are probed by their relay
+            hosts = {
+                h
+                for hosts in self._groups.values()
+                for h in hosts
+                if h not in blocklist and h not in self._relay_of
+            }
+            came_back = await self.prober.probe(hosts, self._session)
+            # Calling the probe endpoint already left a connection in the pool
+            if self.prober.endpoint is None:
+                for host in came_back:
+                    await self._warm(host)
+            await asyncio.sleep(self.prober.interval)
+
+    async def _warm(self, host):
+        """Open a connection to a host and keep it in the pool."""
+        try:
+            async with self._session.head(
+                host.url(), timeout=aiohttp.ClientTimeout(self.prober.timeout)
+            ) as response:
+                await response.read()
+        except Exception as e:
+            logger.debug(f"Failed opening a connection to {host}: {e!r}")
+
+    async def close_session(self):
+        """Stop the health probes and close all connections to the hosts."""
+        if self._probing is not None:
+            self._probing.cancel()
+            self._probing = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            self._connector = None
+
+    def _pool_trace_config(self):
+        """Get a trace config counting new and reused connections."""
+
+        async def reused(*_):
+            if self.connection_pool_counter is not None:
+                self.connection_pool_counter.labels(result="hit").inc()
+
+        async def created(*_):
+            if self.connection_pool_counter is not None:
+                self.connection_pool_counter.labels(result="miss").inc()
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_reuseconn.append(reused)
+        trace_config.on_connection_create_end.append(created)
+        return trace_config
+
+    def _count_connections(self) -> int:
+        """Get the number of open connections in the pool, idle or in use."""
+        connector = self._connector
+        if connector is None:
+            return 0
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        return idle + len(getattr(connector, "_acquired", ()))
+
     def add_group(self, name: str, hosts: Iterable[Host]):
         """
         Add a group of hosts.
@@ -236,6 +845,26 @@ class RequestForwarder:
         """
         self._groups[name] = hosts
         self.blocklist.add_known_hosts(self._groups[name])
+        if self.limiter is not None:
+            self.limiter.add_group(name, hosts)
+
+    def add_relay(self, relay: Host, hosts: Iterable[Host]):
+        """
+        Call some hosts through a relay.
+
+        A relay is a coco instance with `relay` enabled. It gets one call for all of its
+        hosts, calls them and returns their replies.
+
+        Parameters
+        ----------
+        relay : :class:`Host`
+            The relay.
+        hosts : list of :class:`Host`
+            Hosts the relay calls.
+        """
+        self._relays[relay] = list(hosts)
+        for host in hosts:
+            self._relay_of[host] = relay
 
     def add_endpoint(self, name, endpoint):
         """
@@ -250,7 +879,14 @@ class RequestForwarder:
         """
         self._endpoints[name] = endpoint
 
-    def start_prometheus_server(self, port):
+    def start_prometheus_server(
+        self,
+        port,
+        pools=(DEFAULT_POOL,),
+        priorities=(DEFAULT_PRIORITY,),
+        primary=True,
+        transport=None,
+    ):
         """
         Start prometheus server.
 
@@ -258,20 +894,69 @@ class RequestForwarder:
         ----------
         port : int
             Server port.
+        pools : list of str
+            Names of the worker pools to report the queue lengths for.
+        priorities : list of str
+            Names of the priority classes to report the queue lengths for.
+        primary : bool
+            Only the primary worker process reports dropped requests and queue lengths.
+        transport : :class:`Transport`
+            The transport holding the queues and request counters.
         """
-        # Connect to redis
-        self.redis_conn = redis.Redis(host="127.0.0.1", port=6379, db=0)
+        self._transport = transport
+
+        def fetch_open_connections():
+            self.open_connections.set(self._count_connections())
+
+        def fetch_breaker_states():
+            if self.breakers is None:
+                return
+            for host, state in self.breakers.states().items():
+                for s in breaker.STATES:
+                    self.breaker_state.labels(
+                        host=host.hostname, port=host.port, state=s
+                    ).set(int(s == state))
+
+        def fetch_host_up():
+            if self.prober is None:
+                return
+            for host, up in self.prober.states().items():
+                self.host_up.labels(host=host.hostname, port=host.port).set(int(up))
+
+        def fetch_aimd_limit():
+            if self.aimd is None:
+                return
+            self.aimd_limit.set(int(self.aimd.limit))
+
+        callbacks = [
+            fetch_open_connections,
+            fetch_breaker_states,
+            fetch_host_up,
+            fetch_aimd_limit,
+        ]
+        if not primary or transport is None:
+            start_metrics_server(port, callbacks=callbacks)
+            return
 
         def fetch_request_count():
             for edpt in self._endpoints:
                 # Get current count and reset to 0
-                incr = int(self.redis_conn.getset(f"dropped_counter_{edpt}", "0"))
+                incr = transport.take_count(f"dropped_counter_{edpt}")
                 self.dropped_counter.labels(endpoint=edpt).inc(incr)
+                incr = transport.take_count(f"coalesced_counter_{edpt}")
+                self.coalesced_counter.labels(endpoint=edpt).inc(incr)
 
         def fetch_queue_len():
-            self.queue_len.set(int(self.redis_conn.llen("queue")))
+            for pool in pools:
+                for priority in priorities:
+                    self.queue_len.labels(pool=pool, priority=priority).set(
+                        transport.length(queue_name(pool, priority))
+                    )
 
-        start_metrics_server(port, callbacks=[fetch_request_count, fetch_queue_len])
+        start_metrics_server(
+            port,
+            callbacks=[fetch_request_count, fetch_queue_len, *callbacks],
+        )
 
     def init_metrics(self):
         """Initialise counters for every prometheus endpoint."""
@@ -281,6 +966,29 @@ class RequestForwarder:
             ["endpoint"],
             unit="total",
         )
+        self.coalesced_counter = Counter(
+            "coco_coalesced_request",
+            "Count of requests answered with the result of an identical request.",
+            ["endpoint"],
+            unit="total",
+        )
+        self.memoized_counter = Counter(
+            "coco_memoized_call",
+            "Count of calls to coco endpoints answered with the result of an identical "
+            "call within the same request.",
+            ["endpoint"],
+            unit="total",
+        )
+        self.connection_pool_counter = Counter(
+            "coco_connection_pool_request",
+            "Requests to hosts sent on a reused (hit) or a new (miss) connection.",
+            ["result"],
+            unit="total",
+        )
+        self.open_connections = Gauge(
+            "coco_open_connections",
+            "Connections to hosts kept open by this process, idle or in use.",
+        )
         self.call_counter = Counter(
             "coco_calls",
             "Calls forwarded by coco to hosts.",
@@ -288,12 +996,15 @@ class RequestForwarder:
             unit="total",
         )
         self.queue_len = Gauge(
-            "coco_queue_length", "Length of queue storing coco requests.", unit="total"
+            "coco_queue_length",
+            "Length of queue storing coco requests.",
+            ["pool", "priority"],
+            unit="total",
         )
         self.queue_wait_time = Histogram(
             "coco_queue_wait_time",
             "Length of time the request is in the queue before being processed",
-            ["endpoint"],
+            ["endpoint", "pool", "priority"],
             unit="seconds",
         )
         self.response_time = Histogram(
@@ -302,14 +1013,64 @@ class RequestForwarder:
             ["endpoint", "host", "port"],
             unit="seconds",
         )
+        self.retry_counter = Counter(
+            "coco_retried_request",
+            "Calls to hosts that failed and are sent again.",
+            ["endpoint"],
+            unit="total",
+        )
+        self.hedge_counter = Counter(
+            "coco_hedged_request",
+            "Second requests sent to hosts that were slow to reply.",
+            ["endpoint"],
+            unit="total",
+        )
+        self.hedge_won_counter = Counter(
+            "coco_hedged_request_won",
+            "Second requests sent to slow hosts that got the reply first.",
+            ["endpoint"],
+            unit="total",
+        )
+        self.breaker_state = Gauge(
+            "coco_circuit_breaker_state",
+            "State of the circuit breaker of each host, 1 for the current state.",
+            ["host", "port", "state"],
+        )
+        self.breaker_rejected_counter = Counter(
+            "coco_circuit_breaker_rejected",
+            "Calls to hosts that failed right away because their circuit breaker is open.",
+            ["endpoint", "host", "port"],
+            unit="total",
+        )
+        self.host_up = Gauge(
+            "coco_host_up",
+            "Result of the last health probe of each host, 1 for up.",
+            ["host", "port"],
+        )
+        self.limiter_wait_time = Histogram(
+            "coco_limiter_wait_time",
+            "Length of time requests to hosts wait for their concurrency limits",
+            ["endpoint"],
+            unit="seconds",
+        )
+        self.aimd_limit = Gauge(
+            "coco_adaptive_concurrency_limit",
+            "Current limit of requests in flight to all hosts, if adaptive.",
+        )
         for edpt in self._endpoints:
             self.dropped_counter.labels(endpoint=edpt).inc(0)
-            self.redis_conn.set(f"dropped_counter_{edpt}", "0")
+            self.coalesced_counter.labels(endpoint=edpt).inc(0)
+            if self._transport is not None:
+                self._transport.take_count(f"dropped_counter_{edpt}")
+                self._transport.take_count(f"coalesced_counter_{edpt}")
 
     async def internal(self, name, request=None, hosts=None, **_):
         """
         Call an endpoint.
 
+        Within a :func:`memo_scope`, identical calls to an endpoint with `memoize` only call
+        it once and share its result.
+
         Parameters
         ----------
         name : str
@@ -329,9 +1090,32 @@ class RequestForwarder:
         else:
             # the request data gets popped in endpoint.call(), so we give them a copy only
             request = copy.copy(request)
-        return await self._endpoints[name].call(request=request, hosts=hosts)
+        endpoint = self._endpoints[name]
+        memo = _memo.get()
+        if memo is None or not getattr(endpoint, "memoize", False):
+            return await endpoint.call(request=request, hosts=hosts)
 
-    async def _request(self, session, method, host, endpoint, request, params, timeout):
+        try:
+            key = (
+                name,
+                hosts if hosts is None or isinstance(hosts, str) else tuple(hosts),
+                json.dumps(request, sort_keys=True),
+            )
+        except TypeError:
+            return await endpoint.call(request=request, hosts=hosts)
+        if key in memo:
+            if self.memoized_counter is not None:
+                self.memoized_counter.labels(endpoint=name).inc()
+        else:
+            memo[key] = asyncio.ensure_future(
+                endpoint.call(request=request, hosts=hosts)
+            )
+        # Every caller runs its own checks on the result
+        return copy.deepcopy(await asyncio.shield(memo[key]))
+
+    async def _request(
+        self, session, method, host, endpoint, body, params, timeout, hedge=False
+    ):
         """
         Send request.
 
@@ -341,10 +1125,15 @@ class RequestForwarder:
         method
         host : Host
         endpoint
-        request
+        body : bytes
+            Encoded request data, shared by the calls to all hosts.
         params
         timeout : int
             Timeout in seconds.
+        hedge : bool
+            (optional) If this is the second request to a slow host. It doesn't wait for the
+            concurrency limits of the host or ask its circuit breaker, the first one already
+            did.
 
         Returns
         -------
@@ -353,39 +1142,203 @@ class RequestForwarder:
         """
         url = host.join_endpoint(endpoint)
         hostname, port = host.hostname, host.port
-        start_time = time.time()
-        status = "0"
+        if self.prober is not None and self.prober.is_down(host):
+            return host, (prober.DOWN_REPLY, breaker.OPEN_STATUS)
+        # The second request to a slow host was let through with the first one
+        gated = self.breakers is not None and not hedge
+        if gated and not self.breakers.allow(host):
+            self.breaker_rejected_counter.labels(
+                endpoint=endpoint, host=hostname, port=port
+            ).inc()
+            return host, (breaker.OPEN_REPLY, breaker.OPEN_STATUS)
+        sent = False
         try:
-            async with session.request(
-                method,
-                url,
-                json=request,
-                raise_for_status=False,
-                timeout=aiohttp.ClientTimeout(timeout),
-                params=params,
-            ) as response:
+            async with self._slot(host, endpoint, hedge):
+                sent = True
+                start_time = time.time()
+                status = "0"
+                timed_out = False
                 try:
-                    status = str(response.status)
-                    return (
-                        host,
-                        (await response.json(content_type=None), response.status),
-                    )
-                except json.decoder.JSONDecodeError:
-                    return host, (await response.text(), response.status)
-        except AsyncioTimeoutError:
-            return host, ("Timeout", 0)
-        except Exception as e:
-            return host, (str(e), 0)
+                    async with session.request(
+                        method,
+                        url,
+                        data=body,
+                        headers=_JSON_HEADERS if body is not None else None,
+                        raise_for_status=False,
+                        timeout=aiohttp.ClientTimeout(timeout),
+                        params=params,
+                    ) as response:
+                        try:
+                            status = str(response.status)
+                            return (
+                                host,
+                                (
+                                    await response.json(content_type=None),
+                                    response.status,
+                                ),
+                            )
+                        except json.decoder.JSONDecodeError:
+                            return host, (await response.text(), response.status)
+                except AsyncioTimeoutError:
+                    timed_out = True
+                    return host, ("Timeout", 0)
+                except asyncio.CancelledError:
+                    # Not a reply, e.g. the slower of two hedged requests
+                    status = None
+                    raise
+                except Exception as e:
+                    return host, (str(e), 0)
+                finally:
+                    # A cancelled hedge must not end the probe of the first request
+                    if self.breakers is not None and not (hedge and status is None):
+                        self.breakers.record(
+                            host, None if status is None else status != "0"
+                        )
+                    if status is not None:
+                        response_time = time.time() - start_time
+                        self.response_time.labels(
+                            endpoint=endpoint, host=hostname, port=port
+                        ).observe(response_time)
+                        self._response_times.setdefault(
+                            endpoint, ResponseTimes()
+                        ).observe(response_time)
+                        latency = self._latency.setdefault(
+                            (endpoint, host), LatencyEstimate()
+                        )
+                        if self.aimd is not None:
+                            usual = latency.value
+                            self.aimd.record(
+                                start_time,
+                                timed_out
+                                or int(status) >= 500
+                                or (usual is not None and response_time > usual),
+                            )
+                        latency.observe(response_time)
+                        self.call_counter.labels(
+                            endpoint=endpoint, host=hostname, port=port, status=status
+                        ).inc()
         finally:
-            response_time = time.time() - start_time
-            self.response_time.labels(
-                endpoint=endpoint, host=hostname, port=port
-            ).observe(response_time)
-            self.call_counter.labels(
-                endpoint=endpoint, host=hostname, port=port, status=status
-            ).inc()
+            # Cancelled while waiting for the concurrency limits, e.g. when a quorum was
+            # reached: let the next call probe the host
+            if gated and not sent:
+                self.breakers.record(host, None)
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, host, endpoint, hedge=False):
+        """Wait until the concurrency limits allow another request to the host."""
+        limited = not hedge and self.limiter is not None and self.limiter.limits(host)
+        if not limited and self.aimd is None:
+            yield
+            return
+        start_time = time.time()
+        async with contextlib.AsyncExitStack() as stack:
+            # The limits of the host first, so that requests waiting for a busy host
+            # don't take up the adaptive limit
+            if limited:
+                await stack.enter_async_context(self.limiter.slot(host))
+            if self.aimd is not None:
+                await stack.enter_async_context(self.aimd.slot())
+            self.limiter_wait_time.labels(endpoint=endpoint).observe(
+                time.time() - start_time
+            )
+            yield
+
+    async def _hedged(self, name, make_request, timeout, delay):
+        """
+        Send a request and send it again if there is no reply after `delay` seconds.
+
+        Parameters
+        ----------
+        name : str
+            Name of the endpoint.
+        make_request : function
+            Returns the coroutine sending the request, takes the timeout in seconds and if
+            it is the second request.
+        timeout : float
+            Timeout in seconds for both requests together.
+        delay : float
+            Seconds to wait for the first reply.
+
+        Returns
+        -------
+        Tuple[Host, Tuple[str, str]]
+            The reply that arrived first.
+        """
+        first = asyncio.ensure_future(make_request(timeout))
+        second = None
+        try:
+            done, _ = await asyncio.wait([first], timeout=delay)
+            if done or delay >= timeout:
+                return await first
+            self.hedge_counter.labels(endpoint=name).inc()
+            second = asyncio.ensure_future(make_request(timeout - delay, True))
+            done, _ = await asyncio.wait(
+                [first, second], return_when=asyncio.FIRST_COMPLETED
+            )
+            if first in done:
+                return first.result()
+            self.hedge_won_counter.labels(endpoint=name).inc()
+            return second.result()
+        finally:
+            for request in (first, second):
+                if request is not None and not request.done():
+                    request.cancel()
+
+    async def _retried(self, name, host, make_attempt, retry, take_retry):
+        """
+        Call a host until it replies or it can't be retried any more.
 
-    async def external(self, name, request, hosts, method, params=None, timeout=None):
+        Parameters
+        ----------
+        name : str
+            Name of the endpoint.
+        host : :class:`Host`
+            The host.
+        make_attempt : function
+            Returns the coroutine calling the host, takes the host.
+        retry : :class:`RetryPolicy`
+            The retry policy.
+        take_retry : function
+            Gets the number of the attempt and the status code. Tells if the call may be
+            retried, which uses up one retry of the budget.
+
+        Returns
+        -------
+        Tuple[Host, Tuple[str, str]]
+            The last reply.
+        """
+        attempt = 1
+        while True:
+            reply = await make_attempt(host)
+            _, (_, status) = reply
+            if not take_retry(attempt, status):
+                return reply
+            self.retry_counter.labels(endpoint=name).inc()
+            await asyncio.sleep(retry.delay(attempt))
+            attempt += 1
+
+    @staticmethod
+    async def _report(call, on_reply):
+        """Pass the reply of a call on as soon as it is there."""
+        host, reply = await call
+        await on_reply(host, reply)
+        return host, reply
+
+    async def external(
+        self,
+        name,
+        request,
+        hosts,
+        method,
+        params=None,
+        timeout=None,
+        on_reply=None,
+        quorum=None,
+        finish_after_quorum=False,
+        hedge=None,
+        retry=None,
+        adaptive_timeout=None,
+    ):
         """
         Forward an endpoint call.
 
@@ -393,8 +1346,9 @@ class RequestForwarder:
         ----------
         name : str
             Name of the endpoint.
-        request : dict
-            Request data to forward.
+        request : dict or bytes
+            Request data to forward, or the body already encoded with
+            :func:`encode_request`.
         hosts : str or list(Host)
             Hosts to forward to or group name.
         method : str
@@ -404,6 +1358,24 @@ class RequestForwarder:
         timeout : int
             Timeout in seconds. If none is supplied, the timeout from the top level of
             coco's config is used.
+        on_reply : coroutine function
+            (optional) Gets called with the host and the reply whenever a host replied.
+        quorum : int or float
+            (optional) Number or fraction of the hosts that have to reply with status 200.
+            The call is complete as soon as they did. If the quorum isn't reached, the
+            result is not successful.
+        finish_after_quorum : bool
+            (optional) Let the calls to the remaining hosts finish in the background once
+            the quorum is reached and log their replies, instead of cancelling them.
+        hedge : float
+            (optional) Quantile of the response times of the endpoint. Hosts that take
+            longer get a second request, the first reply is used. Only for idempotent
+            endpoints.
+        retry : :class:`RetryPolicy`
+            (optional) Retry failed calls to hosts. Only for idempotent endpoints.
+        adaptive_timeout : :class:`AdaptiveTimeout` or bool
+            (optional) Use a timeout for each host learned from its earlier replies instead
+            of `timeout`. `False` to turn off the forwarder's default.
 
         Returns
         -------
@@ -419,16 +1391,329 @@ class RequestForwarder:
         if timeout is None:
             timeout = self.timeout
 
-        connector = aiohttp.TCPConnector(limit=0)
-        async with aiohttp.ClientSession(
-            connector=connector,
-            trace_configs=([_trace_config()] if self._debug_connections else None),
-        ) as session, TaskPool(self.session_limit) as tasks:
-            for host in hosts:
-                if host not in self.blocklist.hosts:
-                    await tasks.put(
-                        self._request(
-                            session, method, host, name, request, params, timeout
-                        )
-                    )
-            return Result(name, dict(await tasks.join()))
+        if adaptive_timeout is None:
+            adaptive_timeout = self.adaptive_timeout
+
+        # Encode once, all hosts get the same body
+        if isinstance(request, bytes):
+            body = request
+        else:
+            body = encode_request(request)
+
+        await self.open_session()
+        hosts = [host for host in hosts if host not in self.blocklist.hosts]
+
+        hedge_delay = None
+        if hedge is not None:
+            response_times = self._response_times.get(name)
+            if response_times and response_times.count >= HEDGE_MIN_REPLIES:
+                hedge_delay = response_times.quantile(hedge)
+
+        direct, relayed = self._split_relayed(hosts)
+        retries = retry.retries(len(direct)) if retry else 0
+
+        def take_retry(attempt, status):
+            nonlocal retries
+            if attempt < retry.attempts and status in retry.STATUS and retries > 0:
+                retries -= 1
+                return True
+            return False
+
+        def make_attempt(host):
+            host_timeout = timeout
+            if adaptive_timeout:
+                host_timeout = adaptive_timeout.timeout(
+                    self._latency.get((name, host)), timeout
+                )
+            if hedge_delay is None:
+                return self._request(
+                    self._session, method, host, name, body, params, host_timeout
+                )
+            return self._hedged(
+                name,
+                lambda timeout_, hedge_=False: self._request(
+                    self._session, method, host, name, body, params, timeout_, hedge_
+                ),
+                host_timeout,
+                hedge_delay,
+            )
+
+        def make_call(host):
+            if retry is None:
+                call = make_attempt(host)
+            else:
+                call = self._retried(name, host, make_attempt, retry, take_retry)
+            if on_reply is not None:
+                call = self._report(call, on_reply)
+            return call
+
+        def make_calls():
+            # Each call returns a list of hosts and their replies
+            for host in direct:
+                yield self._as_list(make_call(host))
+            for relay, relay_hosts in relayed.items():
+                yield self._relay(
+                    relay,
+                    relay_hosts,
+                    name,
+                    body,
+                    method,
+                    params,
+                    timeout,
+                    hedge,
+                    retry,
+                    on_reply,
+                )
+
+        async with self._fan_out_slot():
+            if quorum is not None:
+                if isinstance(quorum, float):
+                    quorum = math.ceil(quorum * len(hosts))
+                return await self._until_quorum(
+                    name, hosts, make_calls(), quorum, finish_after_quorum
+                )
+
+            async with TaskPool(self.session_limit) as tasks:
+                for call in make_calls():
+                    await tasks.put(call)
+                replies = await tasks.join()
+                return Result(name, dict(reply for call in replies for reply in call))
+
+    @contextlib.asynccontextmanager
+    async def _fan_out_slot(self):
+        """Wait until less than `forward_concurrency` forwards are running."""
+        if not self.forward_concurrency:
+            yield
+            return
+        if self._fan_out_slots is None:
+            self._fan_out_slots = asyncio.Semaphore(self.forward_concurrency)
+        async with self._fan_out_slots:
+            yield
+
+    @staticmethod
+    async def _as_list(call):
+        return [await call]
+
+    def _split_relayed(self, hosts):
+        """Split hosts into the ones to call directly and the ones to call through each relay."""
+        direct = []
+        relayed = {}
+        for host in hosts:
+            relay = self._relay_of.get(host)
+            if relay is None:
+                direct.append(host)
+            else:
+                relayed.setdefault(relay, []).append(host)
+        return direct, relayed
+
+    async def _relay(
+        self,
+        relay,
+        hosts,
+        name,
+        body,
+        method,
+        params,
+        timeout,
+        hedge=None,
+        retry=None,
+        on_reply=None,
+    ):
+        """
+        Call hosts through a relay.
+
+        Parameters
+        ----------
+        relay : :class:`Host`
+            The relay.
+        hosts : list of :class:`Host`
+            Hosts for the relay to call.
+        name, body, method, params, timeout, hedge, retry, on_reply
+            See :meth:`external`.
+
+        Returns
+        -------
+        list of Tuple[Host, Tuple[str, str]]
+            The hosts and their replies. If the relay failed, all hosts get its reply.
+        """
+        relay_timeout = timeout
+        retry_conf = None
+        if retry is not None:
+            relay_timeout = (
+                retry.attempts * timeout + (retry.attempts - 1) * retry.max_backoff
+            )
+            retry_conf = vars(retry)
+        request = {
+            "endpoint": name,
+            "method": method,
+            "body": None if body is None else body.decode(),
+            "params": params,
+            "hosts": [str(host) for host in hosts],
+            "timeout": timeout,
+            "hedge": hedge,
+            "retry": retry_conf,
+        }
+        _, (reply, status) = await self._request(
+            self._session,
+            "POST",
+            relay,
+            RELAY_ENDPOINT,
+            encode_request(request),
+            [],
+            relay_timeout + RELAY_TIMEOUT_MARGIN,
+        )
+        try:
+            replies = _unpack_replies(
+                reply[RELAY_ENDPOINT][Host("coco").url()]["reply"], hosts
+            )
+        except (KeyError, IndexError, TypeError, ValueError):
+            if status == 200:
+                status = 0
+            logger.warning(f"Relay {relay} failed calling /{name}: {reply}")
+            reply = f"Relay {relay} failed: {reply}"
+            replies = {host: (reply, status) for host in hosts}
+
+        if on_reply is not None:
+            for host, host_reply in replies.items():
+                await on_reply(host, host_reply)
+        return list(replies.items())
+
+    async def process_relay(self, request: dict) -> Result:
+        """
+        Call hosts for another coco instance, as its relay.
+
+        Parameters
+        ----------
+        request : dict
+            The forwarded call: `endpoint`, `method`, `body`, `params`, `hosts` and the
+            options `timeout`, `hedge` and `retry`. The hosts have to be in the groups of
+            this instance.
+
+        Returns
+        -------
+        :class:`Result`
+            Replies of the hosts packed by :func:`_pack_replies`.
+        """
+        try:
+            name = request["endpoint"]
+            method = request["method"]
+            hosts = [Host(host) for host in request["hosts"]]
+        except (KeyError, TypeError) as e:
+            raise InvalidUsage(f"Bad request to /{RELAY_ENDPOINT}: {e!r}") from e
+        known = {host for group in self._groups.values() for host in group}
+        unknown = [host for host in hosts if host not in known]
+        if unknown:
+            raise InvalidUsage(
+                f"Can't relay calls to hosts that are in no group: "
+                f"{Host.print_list(unknown)}."
+            )
+        body = request.get("body")
+        retry = request.get("retry")
+        result = await self.external(
+            name,
+            None if body is None else body.encode(),
+            hosts,
+            method,
+            [tuple(param) for param in request.get("params") or []],
+            request.get("timeout"),
+            hedge=request.get("hedge"),
+            retry=None if retry is None else RetryPolicy(**retry),
+        )
+        replies = {
+            host: (reply, result.status[name][host])
+            for host, reply in (result.results[name] or {}).items()
+        }
+        return Result(
+            RELAY_ENDPOINT,
+            result={Host("coco"): (_pack_replies(replies), 200)},
+            type_="FULL",
+        )
+
+    async def _until_quorum(self, name, hosts, host_calls, quorum, finish):
+        """
+        Call the hosts until enough of them replied with status 200.
+
+        Parameters
+        ----------
+        name : str
+            Name of the endpoint.
+        hosts : list(Host)
+            Hosts to call.
+        host_calls : iterable
+            The coroutines calling the hosts, each returns a list of hosts and their
+            replies.
+        quorum : int
+            Number of hosts that have to reply with status 200.
+        finish : bool
+            Let the other calls finish in the background once the quorum is reached.
+
+        Returns
+        -------
+        :class:`Result`
+            Result with the replies that arrived until the quorum was reached.
+        """
+        replies = {}
+        n_ok = 0
+        reached = asyncio.Event()
+        if quorum <= 0:
+            reached.set()
+
+        async def call(call_):
+            nonlocal n_ok
+            for host, reply in await call_:
+                replies[host] = reply
+                if reply[1] == 200:
+                    n_ok += 1
+            if n_ok >= quorum:
+                reached.set()
+
+        async def call_all():
+            tasks = TaskPool(self.session_limit)
+            try:
+                for call_ in host_calls:
+                    await tasks.put(call(call_))
+                await tasks.join()
+            except asyncio.CancelledError:
+                tasks.cancel()
+                raise
+
+        calls = asyncio.ensure_future(call_all())
+        wait_reached = asyncio.ensure_future(reached.wait())
+        try:
+            await asyncio.wait(
+                [calls, wait_reached], return_when=asyncio.FIRST_COMPLETED
+            )
+        except asyncio.CancelledError:
+            calls.cancel()
+            raise
+        finally:
+            wait_reached.cancel()
+
+        result = Result(name, dict(replies))
+        if not reached.is_set():
+            result.success = False
+            result.add_message(
+                f"Only {n_ok} hosts replied to /{name} with status 200 (quorum: "
+                f"{quorum})."
+            )
+        late = [host for host in hosts if host not in replies]
+        if late:
+            if finish:
+                self._background.add(calls)
+                calls.add_done_callback(
+                    lambda _: self._log_late_replies(name, late, replies, calls)
+                )
+            else:
+                calls.cancel()
+            result.add_message(
+                f"/{name} reached its quorum of {quorum} hosts before "
+                f"{Host.print_list(late)} replied (calls "
+                f"{'left to finish' if finish else 'cancelled'})."
+            )
+        return result
+
+    def _log_late_replies(self, name, hosts, replies, calls):
+        """Log the replies that arrived after the quorum was reached."""
+        self._background.discard(calls)
+        codes = {host.url(): replies[host][1] for host in hosts if host in replies}
+        logger.info(f"/{name}: Replies after the quorum was reached: {codes}")
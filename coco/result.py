@@ -35,7 +35,9 @@ class Result:
         23: "200"
         }`
 
-    A status code of 0 signals an internal or connection error.
+    A status code of 0 signals an internal or connection error, -1 a call that wasn't sent
+    because the host is known to be down (its circuit breaker is open or its health probe
+    failed).
     """
 
     def __init__(self, name, result=None, error=None, type_="CODES_OVERVIEW"):
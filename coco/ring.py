@@ -0,0 +1,116 @@
+"""
+coco ring buffer module.
+
+A buffer of messages in shared memory, for passing data between processes forked from the
+one that created it.
+"""
+import struct
+from typing import Optional
+
+from .exceptions import ConfigError
+
+# Read position, write position and number of messages
+_HEADER = struct.Struct("QQQ")
+# Length of a message
+_LENGTH = struct.Struct("I")
+
+
+def shared_memory():
+    """
+    Get the shared memory class.
+
+    :mod:`multiprocessing.shared_memory` only exists from Python 3.8, so it is only imported
+    when a buffer is used.
+
+    Returns
+    -------
+    type
+        :class:`multiprocessing.shared_memory.SharedMemory`
+    """
+    try:
+        from multiprocessing.shared_memory import SharedMemory
+    except ImportError as e:
+        raise ConfigError("The shared memory transport needs Python >= 3.8.") from e
+    return SharedMemory
+
+
+class RingBuffer:
+    """
+    Ring buffer of byte strings in shared memory.
+
+    Messages are stored with their length in front of them and wrap around the end of the
+    buffer. The buffer does no locking, callers have to make sure only one process accesses
+    it at a time.
+
+    Parameters
+    ----------
+    size : int
+        Capacity of the buffer in bytes, including 4 bytes per message.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._shm = shared_memory()(create=True, size=_HEADER.size + size)
+        self._buf = self._shm.buf
+        _HEADER.pack_into(self._buf, 0, 0, 0, 0)
+
+    def __len__(self):
+        return _HEADER.unpack_from(self._buf, 0)[2]
+
+    def put(self, data: bytes) -> bool:
+        """
+        Add a message.
+
+        Returns
+        -------
+        bool
+            `False` if there is not enough space left for the message.
+        """
+        read, write, count = _HEADER.unpack_from(self._buf, 0)
+        if write - read + _LENGTH.size + len(data) > self.size:
+            return False
+        self._write(write, _LENGTH.pack(len(data)))
+        self._write(write + _LENGTH.size, data)
+        _HEADER.pack_into(
+            self._buf, 0, read, write + _LENGTH.size + len(data), count + 1
+        )
+        return True
+
+    def get(self) -> Optional[bytes]:
+        """
+        Take the oldest message.
+
+        Returns
+        -------
+        bytes
+            The message or `None` if the buffer is empty.
+        """
+        read, write, count = _HEADER.unpack_from(self._buf, 0)
+        if not count:
+            return None
+        (length,) = _LENGTH.unpack(self._read(read, _LENGTH.size))
+        data = self._read(read + _LENGTH.size, length)
+        _HEADER.pack_into(self._buf, 0, read + _LENGTH.size + length, write, count - 1)
+        return data
+
+    def unlink(self):
+        """Free the shared memory. Call once, in the process that created the buffer."""
+        self._buf = None
+        self._shm.close()
+        self._shm.unlink()
+
+    def _write(self, position: int, data: bytes):
+        # Split the data where it wraps around the end of the buffer
+        head = _HEADER.size
+        start = head + position % self.size
+        first = min(len(data), head + self.size - start)
+        self._buf[start : start + first] = data[:first]
+        self._buf[head : head + len(data) - first] = data[first:]
+
+    def _read(self, position: int, length: int) -> bytes:
+        head = _HEADER.size
+        start = head + position % self.size
+        first = min(length, head + self.size - start)
+        return bytes(self._buf[start : start + first]) + bytes(
+            self._buf[head : head + length - first]
+        )
@@ -6,6 +6,7 @@ from pathlib import Path
 from typing import List, Dict
 import yaml
 
+from .lock import PathLock
 from .result import Result
 from .util import Host, PersistentState, hash_dict
 from .exceptions import InternalError, InvalidUsage
@@ -24,7 +25,15 @@ yaml.SafeLoader.construct_mapping = my_construct_mapping
 
 
 class State:
-    """Representation of the complete state of all hosts (configs) coco controls."""
+    """
+    Representation of the complete state of all hosts (configs) coco controls.
+
+    Attributes
+    ----------
+    lock : :class:`PathLock`
+        Readers/writer lock over subtrees of the state. Endpoint calls that run
+        concurrently hold it for the state paths they read or write.
+    """
 
     def __init__(
         self,
@@ -51,6 +60,7 @@ class State:
         self.exclude_from_reset = exclude_from_reset
         self._storage_path = storage_path
         self._name_active_state = "active"
+        self.lock = PathLock()
 
         # List saved states on disk
         p = Path(self._storage_path).glob("**/*")
@@ -75,6 +85,21 @@ class State:
 
         logger.setLevel(log_level)
 
+    @property
+    def version(self) -> int:
+        """
+        Get the version of the state.
+
+        It changes whenever the state is changed, so it can be used to tell if anything
+        derived from the state is still up to date.
+
+        Returns
+        -------
+        int
+            The version.
+        """
+        return self._storage.version
+
     def write(self, path, value, name=None):
         """
         Write (or overwrite) a value in the state.
@@ -43,6 +43,12 @@ class TaskPool:
         self._tasks = set()
         return results
 
+    def cancel(self):
+        """Cancel all tasks."""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = set()
+
     async def __aenter__(self):
         """Context manager for entering `async with`."""
         return self
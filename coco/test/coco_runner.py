@@ -49,11 +49,15 @@ class Runner:
 
     def __init__(self, config, endpoints, reset_on_start=False, reset_on_shutdown=True):
         self.reset_on_shutdown = reset_on_shutdown
+        self._pid = os.getpid()
         self.start_coco(config, endpoints, reset_on_start)
         time.sleep(1)
 
     def __del__(self):
         """Destructor."""
+        if os.getpid() != self._pid:
+            # Garbage collected in a forked process (e.g. an endpoint farm)
+            return
         if self.reset_on_shutdown:
             self.client("reset-state", silent=True)
         self.stop_coco()
@@ -89,11 +93,12 @@ class Runner:
 
     def start_coco(self, config, endpoint_configs, reset):
         """Start coco with a given config."""
-        CONFIG.update(config)
+        # Merge into a copy, so the defaults are the same for every runner
+        self.config = dict(CONFIG, **config)
 
         # Write endpoint configs to file
         self.endpointdir = tempfile.TemporaryDirectory()  # pylint: disable=R1732
-        CONFIG["endpoint_dir"] = self.endpointdir.name
+        self.config["endpoint_dir"] = self.endpointdir.name
         for name, endpoint_conf in endpoint_configs.items():
             with open(
                 os.path.join(self.endpointdir.name, name + ".conf"),
@@ -104,7 +109,7 @@ class Runner:
 
         # Write config to file
         self.configfile = tempfile.NamedTemporaryFile("w")  # pylint: disable=R1732
-        json.dump(CONFIG, self.configfile)
+        json.dump(self.config, self.configfile)
         self.configfile.flush()
 
         args = []
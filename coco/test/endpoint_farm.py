@@ -10,6 +10,7 @@ from multiprocessing import Manager, Process
 
 from flask import Flask, request, jsonify
 from werkzeug.exceptions import BadRequest
+from werkzeug.serving import WSGIRequestHandler
 
 
 app = Flask(__name__)
@@ -53,6 +54,8 @@ def flask_start(port, counter, callbacks):
     """Run a flask web server."""
     app.counter = counter
     app.callbacks = callbacks
+    # Keep connections open like the real hosts do
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
     app.run(port=port, debug=True, use_reloader=False)
 
 
@@ -75,6 +78,7 @@ class Farm:
         self._manager = Manager()
         self._counters = {}
         self._processes = []
+        self._pid = os.getpid()
 
         self.ports = []
 
@@ -100,6 +104,9 @@ class Farm:
 
         Stop the farm.
         """
+        if os.getpid() != self._pid:
+            # Garbage collected in a forked process (e.g. another farm)
+            return
         for p in self._processes:
             p.terminate()
         self._manager.shutdown()
@@ -0,0 +1,85 @@
+"""
+Benchmark the transports.
+
+Sends tasks through each transport to a worker that replies right away, so only the cost
+of the transport itself is measured. Needs a redis server on localhost.
+
+Each redis transport is measured with a frontend that has one reply listener for all
+clients and with one that blocks a connection per waiting client.
+
+Run with `python -m coco.test.transport_benchmark [N_TASKS] [N_CLIENTS]`.
+"""
+import asyncio
+import json
+import sys
+import time
+
+from coco.transport import TRANSPORTS
+
+QUEUE = "benchmark"
+
+
+async def _worker(transport, n_tasks):
+    for _ in range(n_tasks):
+        queue, task = await transport.receive([QUEUE], 10)
+        await transport.reply(queue, task, 200, json.dumps({"reply": task["request"]}))
+
+
+async def _client(transport, names):
+    for name in names:
+        await transport.enqueue(
+            QUEUE,
+            {
+                "name": name,
+                "method": "GET",
+                "endpoint": "benchmark",
+                "request": "{}",
+                "params": "",
+                "received": time.time(),
+            },
+        )
+        await transport.wait(name)
+
+
+async def _run(name, n_tasks, n_clients, listen):
+    frontend = TRANSPORTS[name](10)
+    frontend.setup([QUEUE])
+    await frontend.connect(listen)
+    if not frontend.uses_redis:
+        # Frontend and worker share the buffers set up in this process
+        worker = frontend
+    else:
+        worker = TRANSPORTS[name](10)
+        worker.setup([QUEUE])
+        await worker.connect()
+
+    names = [f"benchmark-{name}-{i}-{time.time()}" for i in range(n_tasks)]
+    start = time.perf_counter()
+    await asyncio.gather(
+        _worker(worker, n_tasks),
+        *[_client(frontend, names[i::n_clients]) for i in range(n_clients)],
+    )
+    duration = time.perf_counter() - start
+
+    await frontend.close()
+    if worker is not frontend:
+        await worker.close()
+    frontend.cleanup()
+    return duration
+
+
+def main(n_tasks=2000, n_clients=20):
+    """Run the benchmark for all transports and print the results."""
+    for name, transport in TRANSPORTS.items():
+        for listen in (True, False) if transport.uses_redis else (True,):
+            duration = asyncio.run(_run(name, n_tasks, n_clients, listen))
+            mode = "listener" if listen else "blocking"
+            print(
+                f"{name:>8} ({mode}): {n_tasks} tasks in {duration:.2f}s, "
+                f"{n_tasks / duration:.0f} tasks/s, "
+                f"{duration / n_tasks * 1e6:.0f}us/task"
+            )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
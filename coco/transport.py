@@ -0,0 +1,1138 @@
+"""
+coco transport module.
+
+Transports carry endpoint calls from the frontend to the worker processes and the results
+back. The frontend queues a task with :meth:`Transport.enqueue` and waits for its result
+with :meth:`Transport.wait`. Workers take tasks with :meth:`Transport.receive` and answer
+them with :meth:`Transport.reply`.
+
+A task is a dict with the string values `name`, `method`, `endpoint`, `request`, `params`
+and `received`. `reply_to` names the key the result is sent to and `coalesce` is set for
+tasks identical requests can attach to.
+
+The redis transports connect the frontend to forked worker processes. The shared memory
+transport does the same on a single host without redis and the embedded transport runs the
+workers in the event loop of the frontend instead.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import pickle
+import select
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import aioredis
+import redis
+
+from .exceptions import ConfigError
+from .ring import RingBuffer, shared_memory
+
+logger = logging.getLogger(__name__)
+
+# Name of the task that tells a worker to exit
+SHUTDOWN = "coco_shutdown"
+
+# Results of :meth:`Transport.enqueue`
+QUEUED = 0
+FULL = 1
+ATTACHED = 2
+
+REDIS_URL = "redis://127.0.0.1:6379"
+
+# Queue a task or attach it to an identical one that is already queued or running.
+# KEYS[1] is the queue, KEYS[2] the coalesce key (or ""), KEYS[3:] are all queues sharing
+# the queue length limit. ARGV[1] is the limit (0 for none), ARGV[2] the TTL of the
+# coalesce key, ARGV[3] the task name, ARGV[4] its reply key and ARGV[5:] the fields of
+# the task.
+# `QUEUE_LENGTH` and `ADD_TASK` are filled in by the transports.
+_ENQUEUE_SCRIPT = """
+    local function queue_length(queue)
+        QUEUE_LENGTH
+    end
+    if KEYS[2] ~= '' then
+        local leader = redis.call('get', KEYS[2])
+        if leader then
+            redis.call('rpush', leader .. ':followers', ARGV[4] .. '\\n' .. ARGV[3])
+            redis.call('expire', leader .. ':followers', ARGV[2])
+            return 2
+        end
+    end
+    local limit = tonumber(ARGV[1])
+    if limit > 0 then
+        local len = 0
+        for i = 3, #KEYS do
+            len = len + queue_length(KEYS[i])
+        end
+        if len >= limit then
+            return 1
+        end
+    end
+    ADD_TASK
+    if KEYS[2] ~= '' then
+        redis.call('set', KEYS[2], ARGV[3], 'EX', ARGV[2])
+    end
+    return 0
+"""
+
+# Stop identical requests from attaching to a task and get the ones that did.
+_FOLLOWERS_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        redis.call('del', KEYS[1])
+    end
+    local followers = redis.call('lrange', KEYS[2], 0, -1)
+    redis.call('del', KEYS[2])
+    return followers
+"""
+
+
+def reply_key(name: str) -> str:
+    """Get the redis key the result of a task is sent to if nobody listens for it."""
+    return f"{name}:reply"
+
+
+def pack_reply(name: str, code: int, result: str) -> str:
+    """
+    Pack name, status code and result of a task into one string.
+
+    Parameters
+    ----------
+    name : str
+        Name of the task.
+    code : int
+        HTTP status code.
+    result : str
+        Serialised result.
+
+    Returns
+    -------
+    str
+        The packed reply.
+    """
+    return f"{name}\n{code}\n{result}"
+
+
+def unpack_reply(reply: str) -> Tuple[str, int, str]:
+    """
+    Unpack a reply packed by :func:`pack_reply`.
+
+    Returns
+    -------
+    str
+        Name of the task.
+    int
+        HTTP status code.
+    str
+        Serialised result.
+    """
+    name, code, result = reply.split("\n", 2)
+    return name, int(code), result
+
+
+class Transport:
+    """
+    Base class for transports.
+
+    Parameters
+    ----------
+    result_ttl : int
+        Seconds before unclaimed results and coalesce keys expire.
+    """
+
+    # If the workers run in the event loop of the frontend instead of their own processes
+    in_process = False
+    # If the transport needs a redis server
+    uses_redis = True
+
+    def __init__(self, result_ttl: int):
+        self.result_ttl = result_ttl
+        self._redis_sync = None
+        self._redis = None
+        self._enqueue_sha = None
+        self._reply_to = None
+        self._listener = None
+        self._waiting = {}
+
+    # Core process
+
+    def setup(self, queues: List[str], counters: List[str] = (), frontends: int = 1):
+        """
+        Prepare the queues before the workers are started.
+
+        Parameters
+        ----------
+        queues : list of str
+            Names of all queues.
+        counters : list of str
+            Names of the counters passed to :meth:`count`.
+        frontends : int
+            Number of frontend processes.
+        """
+        self._redis_sync = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+        self._enqueue_sha = self._redis_sync.script_load(self._enqueue_script())
+
+    def shutdown(self, queue: str):
+        """Tell a worker serving the queue to exit."""
+        raise NotImplementedError
+
+    def cleanup(self):
+        """Free what :meth:`setup` allocated, once all workers exited."""
+
+    def call(self, queue: str, task: Dict[str, str]) -> Tuple[int, str]:
+        """
+        Queue a task and wait for the result, blocking.
+
+        Returns
+        -------
+        int
+            HTTP status code.
+        str
+            Serialised result.
+        """
+        raise NotImplementedError
+
+    def length(self, queue: str) -> int:
+        """Get the number of tasks waiting in a queue."""
+        raise NotImplementedError
+
+    # Frontend and worker processes
+
+    async def connect(self, listen: bool = False):
+        """
+        Open the connections of this process. Call in the event loop using them.
+
+        Parameters
+        ----------
+        listen : bool
+            Receive the results of all tasks queued by this process on one connection
+            and hand them to :meth:`wait`. Otherwise each call to :meth:`wait` blocks a
+            connection of its own.
+        """
+        self._redis = aioredis.from_url(
+            REDIS_URL, encoding="utf-8", decode_responses=True
+        )
+        await self._redis.ping()
+        if listen:
+            self._reply_to = f"replies:{os.getpid()}-{uuid.uuid4().hex}"
+            self._listener = asyncio.ensure_future(self._listen())
+
+    async def close(self):
+        """Close the connections of this process."""
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+    async def count(self, counter: str):
+        """Increment a counter read by the metrics server."""
+        await self._redis.incr(counter)
+
+    def take_count(self, counter: str) -> int:
+        """Get the increments of a counter since the last call and reset it."""
+        return int(self._redis_sync.getset(counter, 0) or 0)
+
+    # Frontend
+
+    async def enqueue(
+        self,
+        queue: str,
+        task: Dict[str, str],
+        limit: int = 0,
+        queues: Optional[List[str]] = None,
+        coalesce: Optional[str] = None,
+    ) -> int:
+        """
+        Queue a task.
+
+        Parameters
+        ----------
+        queue : str
+            Queue to add the task to.
+        task : dict
+            The task.
+        limit : int
+            Don't queue the task if there are this many tasks waiting in `queues`. 0 for no
+            limit.
+        queues : list of str
+            Queues sharing the limit. Default: only `queue`.
+        coalesce : str
+            Key identifying identical tasks. If one is queued or running, attach to it
+            instead of queueing this task.
+
+        Returns
+        -------
+        int
+            :data:`QUEUED`, :data:`FULL` or :data:`ATTACHED`.
+        """
+        if queues is None:
+            queues = [queue]
+        name = task["name"]
+        task = dict(task, reply_to=self._reply_to or reply_key(name))
+        if coalesce:
+            task["coalesce"] = coalesce
+        fields = []
+        for key, value in task.items():
+            fields += [key, value]
+
+        if self._listener is not None:
+            # Be ready for the result before it can arrive
+            self._waiting[name] = asyncio.get_event_loop().create_future()
+        try:
+            status = int(
+                await self._redis.evalsha(
+                    self._enqueue_sha,
+                    2 + len(queues),
+                    self._key(queue),
+                    coalesce or "",
+                    *[self._key(q) for q in queues],
+                    limit,
+                    self.result_ttl,
+                    name,
+                    task["reply_to"],
+                    *fields,
+                )
+            )
+        except BaseException:
+            self._waiting.pop(name, None)
+            raise
+        if status == FULL:
+            self._waiting.pop(name, None)
+        return status
+
+    async def wait(self, name: str) -> Tuple[int, str]:
+        """
+        Wait for the result of a task.
+
+        Returns
+        -------
+        int
+            HTTP status code.
+        str
+            Serialised result.
+        """
+        if name in self._waiting:
+            try:
+                return await self._waiting[name]
+            finally:
+                self._waiting.pop(name, None)
+        _, code, result = unpack_reply(
+            await self._pop_reply(self._redis, reply_key(name), 0)
+        )
+        return code, result
+
+    async def _listen(self):
+        """Receive the results for this process and hand them to the waiting requests."""
+        conn = self._redis.client()
+        try:
+            while True:
+                try:
+                    replies = await self._pop_replies(conn, self._reply_to, 10)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as err:
+                    logger.error(
+                        f"Failed receiving results: {type(err).__name__}: {err}"
+                    )
+                    await asyncio.sleep(1)
+                    continue
+                for reply in replies:
+                    name, code, result = unpack_reply(reply)
+                    future = self._waiting.get(name)
+                    if future is not None and not future.done():
+                        future.set_result((code, result))
+        finally:
+            await conn.close()
+
+    async def _pop_reply(self, conn, key: str, timeout: int) -> str:
+        """Wait for a single reply sent to a key."""
+        replies = await self._pop_replies(conn, key, timeout, count=1)
+        return replies[0]
+
+    async def _pop_replies(
+        self, conn, key: str, timeout: int, count: int = 100
+    ) -> List[str]:
+        """Wait for replies sent to a key and take them."""
+        raise NotImplementedError
+
+    # Worker
+
+    async def receive(
+        self, queues: List[str], timeout: int
+    ) -> Optional[Tuple[str, Dict[str, str]]]:
+        """
+        Take the next task.
+
+        Parameters
+        ----------
+        queues : list of str
+            Queues to take the task from. The first one that isn't empty is used.
+        timeout : int
+            Seconds to wait for a task.
+
+        Returns
+        -------
+        str
+            The queue the task was taken from.
+        dict
+            The task.
+
+        `None` if there was no task before the timeout.
+        """
+        raise NotImplementedError
+
+    async def reply(self, queue: str, task: Dict[str, str], code: int, result: str):
+        """
+        Send the result of a task to the frontend.
+
+        Also answers requests that were attached to the task. Safe to call again if it
+        failed on a lost connection.
+
+        Parameters
+        ----------
+        queue : str
+            The queue the task was taken from.
+        task : dict
+            The task.
+        code : int
+            HTTP status code.
+        result : str
+            Serialised result.
+        """
+        raise NotImplementedError
+
+    async def _recipients(self, task: Dict[str, str]) -> List[Tuple[str, str]]:
+        """Get names and reply keys of the task and of all requests attached to it."""
+        if "_recipients" not in task:
+            name = task["name"]
+            recipients = [(name, task.get("reply_to") or reply_key(name))]
+            if task.get("coalesce"):
+                followers = await self._redis.eval(
+                    _FOLLOWERS_SCRIPT, 2, task["coalesce"], f"{name}:followers", name
+                )
+                for follower in followers:
+                    reply_to, follower = follower.split("\n", 1)
+                    recipients.append((follower, reply_to))
+            task["_recipients"] = recipients
+        return task["_recipients"]
+
+    def _key(self, queue: str) -> str:
+        """Get the redis key of a queue."""
+        return queue
+
+    def _enqueue_script(self) -> str:
+        raise NotImplementedError
+
+
+class ListTransport(Transport):
+    """
+    Transport using redis lists.
+
+    Each task is stored in a hash and its name is pushed to the list of the queue. Status
+    code and result are packed into one entry of a reply list that expires on its own.
+    Each frontend process has a reply list for all of its tasks.
+    """
+
+    def setup(self, queues, counters=(), frontends=1):
+        """Prepare the queues and remove left over shutdown commands."""
+        super().setup(queues, counters, frontends)
+        for queue in queues:
+            self._redis_sync.lrem(queue, 0, SHUTDOWN)
+
+    def shutdown(self, queue):
+        """Tell a worker serving the queue to exit."""
+        self._redis_sync.rpush(queue, SHUTDOWN)
+
+    def call(self, queue, task):
+        """Queue a task and wait for the result, blocking."""
+        name = task["name"]
+        self._redis_sync.hset(name, mapping=dict(task, reply_to=reply_key(name)))
+        self._redis_sync.rpush(queue, name)
+        _, code, result = unpack_reply(self._redis_sync.blpop(reply_key(name))[1])
+        return code, result
+
+    def length(self, queue):
+        """Get the number of tasks waiting in a queue."""
+        return int(self._redis_sync.llen(queue))
+
+    async def _pop_replies(self, conn, key, timeout, count=100):
+        # Popping the last entry deletes the list
+        reply = await conn.blpop(key, timeout)
+        if reply is None:
+            return []
+        return [reply[1]]
+
+    async def receive(self, queues, timeout):
+        """Take the next task."""
+        reply = await self._redis.blpop(queues, timeout)
+        if reply is None:
+            return None
+        queue, name = reply
+        if name == SHUTDOWN:
+            return queue, {"name": SHUTDOWN}
+
+        # Use the name to get all info on the call and delete from redis
+        async with self._redis.pipeline(transaction=True) as pipe:
+            task, _ = await pipe.hgetall(name).delete(name).execute()
+        task["name"] = name
+        return queue, task
+
+    async def reply(self, queue, task, code, result):
+        """Send the result of a task to the frontend."""
+        async with self._redis.pipeline(transaction=True) as pipe:
+            for name, reply_to in await self._recipients(task):
+                pipe.rpush(reply_to, pack_reply(name, code, result)).expire(
+                    reply_to, self.result_ttl
+                )
+            await pipe.execute()
+
+    def _enqueue_script(self):
+        return _ENQUEUE_SCRIPT.replace(
+            "QUEUE_LENGTH", "return redis.call('llen', queue)"
+        ).replace(
+            "ADD_TASK",
+            "redis.call('hmset', ARGV[3], unpack(ARGV, 5))\n"
+            "    redis.call('rpush', KEYS[1], ARGV[3])",
+        )
+
+
+class StreamTransport(Transport):
+    """
+    Transport using redis streams.
+
+    Each task is a single entry in the stream of its queue, read by the workers through a
+    consumer group. The result is a single entry in a reply stream that expires on its own.
+    Each frontend process has a reply stream for all of its tasks.
+    An entry is only acknowledged once its result was sent, so tasks a worker took but
+    didn't finish before it died are run again when the worker is started again. Tasks
+    another worker took and didn't finish within `result_ttl` are claimed, so that they
+    don't stay pending if that worker never comes back. Recovered tasks that were queued
+    more than `result_ttl` ago are dropped: their frontend stopped waiting for them. The
+    others are marked with `_recovered`, the worker decides if they can be run again.
+
+    Parameters
+    ----------
+    result_ttl : int
+        Seconds before unclaimed results and coalesce keys expire.
+    consumer : str
+        Name of this worker in the consumer group. Needs to be the same after a restart for
+        unfinished tasks to be recovered.
+    """
+
+    GROUP = "coco-workers"
+    # Pending entries looked at per stream and claim
+    CLAIM_COUNT = 100
+
+    def __init__(self, result_ttl: int, consumer: str = "worker"):
+        super().__init__(result_ttl)
+        self.consumer = consumer
+        self._buffer = {}
+        self._recovered = False
+        self._next_claim = 0.0
+
+    def setup(self, queues, counters=(), frontends=1):
+        """Create the streams and consumer groups and remove left over shutdown commands."""
+        super().setup(queues, counters, frontends)
+        for queue in queues:
+            stream = self._key(queue)
+            try:
+                self._redis_sync.xgroup_create(
+                    stream, self.GROUP, id="0", mkstream=True
+                )
+            except redis.exceptions.ResponseError as err:
+                if "BUSYGROUP" not in str(err):
+                    raise
+            for entry_id, fields in self._redis_sync.xrange(stream):
+                if fields.get("name") == SHUTDOWN:
+                    self._redis_sync.xack(stream, self.GROUP, entry_id)
+                    self._redis_sync.xdel(stream, entry_id)
+
+    def shutdown(self, queue):
+        """Tell a worker serving the queue to exit."""
+        self._redis_sync.xadd(self._key(queue), {"name": SHUTDOWN})
+
+    def call(self, queue, task):
+        """Queue a task and wait for the result, blocking."""
+        name = task["name"]
+        self._redis_sync.xadd(self._key(queue), dict(task, reply_to=reply_key(name)))
+        [[_, [(_, reply)]]] = self._redis_sync.xread({reply_key(name): 0}, block=0)
+        _, code, result = unpack_reply(reply["reply"])
+        return code, result
+
+    def length(self, queue):
+        """Get the number of tasks waiting in a queue."""
+        stream = self._key(queue)
+        pending = self._redis_sync.xpending(stream, self.GROUP)["pending"]
+        return int(self._redis_sync.xlen(stream)) - pending
+
+    async def _pop_replies(self, conn, key, timeout, count=100):
+        reply = await conn.xread({key: 0}, count=count, block=int(timeout * 1000))
+        if not reply:
+            return []
+        entries = reply[0][1]
+        # Reply streams expire on their own, but a listener's stream lives on
+        await conn.xdel(key, *[entry_id for entry_id, _ in entries])
+        return [fields["reply"] for _, fields in entries]
+
+    async def receive(self, queues, timeout):
+        """Take the next task."""
+        if not self._recovered:
+            await self._recover(queues)
+        if time.monotonic() >= self._next_claim:
+            await self._claim(queues)
+
+        for queue in queues:
+            if self._buffer.get(queue):
+                return queue, self._buffer[queue].pop(0)
+
+        # Take from the first queue that isn't empty. Reading several streams at once
+        # would take an entry from each of them.
+        for queue in queues:
+            reply = await self._redis.xreadgroup(
+                self.GROUP, self.consumer, {self._key(queue): ">"}, count=1
+            )
+            if reply:
+                return queue, self._task(reply[0][1][0])
+
+        # Wait for any of them. Entries from more than one stream are kept for later.
+        reply = await self._redis.xreadgroup(
+            self.GROUP,
+            self.consumer,
+            {self._key(queue): ">" for queue in queues},
+            count=1,
+            block=int(timeout * 1000),
+        )
+        if not reply:
+            return None
+        streams = {stream: entries for stream, entries in reply}
+        for queue in queues:
+            for entry in streams.get(self._key(queue), []):
+                self._buffer.setdefault(queue, []).append(self._task(entry))
+        for queue in queues:
+            if self._buffer.get(queue):
+                return queue, self._buffer[queue].pop(0)
+        return None
+
+    async def reply(self, queue, task, code, result):
+        """Send the result of a task to the frontend and acknowledge the task."""
+        stream = self._key(queue)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            for name, reply_to in await self._recipients(task):
+                pipe.xadd(reply_to, {"reply": pack_reply(name, code, result)}).expire(
+                    reply_to, self.result_ttl
+                )
+            pipe.xack(stream, self.GROUP, task["_id"]).xdel(stream, task["_id"])
+            await pipe.execute()
+
+    async def ack(self, queue: str, task: Dict[str, str]):
+        """Acknowledge a task, so it isn't run again after a restart."""
+        stream = self._key(queue)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            await pipe.xack(stream, self.GROUP, task["_id"]).xdel(
+                stream, task["_id"]
+            ).execute()
+
+    async def _recover(self, queues):
+        """Take the tasks this worker took before a restart but didn't finish."""
+        self._recovered = True
+        for queue in queues:
+            reply = await self._redis.xreadgroup(
+                self.GROUP, self.consumer, {self._key(queue): "0"}
+            )
+            for entry in reply[0][1] if reply else []:
+                await self._restore(
+                    queue, entry, f"from before the restart of worker {self.consumer}"
+                )
+
+    async def _claim(self, queues):
+        """Take the tasks other workers didn't finish within `result_ttl`."""
+        self._next_claim = time.monotonic() + self.result_ttl
+        min_idle = int(self.result_ttl * 1000)
+        for queue in queues:
+            stream = self._key(queue)
+            pending = await self._redis.xpending_range(
+                stream, self.GROUP, "-", "+", self.CLAIM_COUNT
+            )
+            ids = [
+                p["message_id"]
+                for p in pending
+                if p["consumer"] != self.consumer
+                and p["time_since_delivered"] >= min_idle
+            ]
+            if not ids:
+                continue
+            for entry in await self._redis.xclaim(
+                stream, self.GROUP, self.consumer, min_idle, ids
+            ):
+                await self._restore(queue, entry, "left by another worker")
+
+    async def _restore(self, queue, entry, origin):
+        """Buffer a recovered task, unless nobody waits for its result any more."""
+        entry_id, fields = entry
+        if fields is None:
+            # Deleted while pending
+            await self._redis.xack(self._key(queue), self.GROUP, entry_id)
+            return
+        task = self._task(entry)
+        if task["name"] == SHUTDOWN:
+            await self.ack(queue, task)
+            return
+        if task.get("received") and (
+            time.time() - float(task["received"]) > self.result_ttl
+        ):
+            logger.warning(
+                f"Dropping unfinished call to /{task.get('endpoint')} {origin}: its "
+                f"frontend stopped waiting for the result."
+            )
+            await self.ack(queue, task)
+            return
+        logger.warning(
+            f"Recovered unfinished call to /{task.get('endpoint')} {origin}."
+        )
+        task["_recovered"] = True
+        self._buffer.setdefault(queue, []).append(task)
+
+    @staticmethod
+    def _task(entry) -> Dict[str, str]:
+        entry_id, task = entry
+        task["_id"] = entry_id
+        return task
+
+    def _key(self, queue):
+        return f"stream:{queue}"
+
+    def _enqueue_script(self):
+        return _ENQUEUE_SCRIPT.replace(
+            "QUEUE_LENGTH",
+            "local len = redis.call('xlen', queue)\n"
+            "        local pending = redis.call('xpending', queue, '"
+            + self.GROUP
+            + "')\n"
+            "        return len - pending[1]",
+        ).replace("ADD_TASK", "redis.call('xadd', KEYS[1], '*', unpack(ARGV, 5))")
+
+
+class EmbeddedTransport(Transport):
+    """
+    Transport within one process, without redis.
+
+    Tasks are passed to workers running in the same event loop as the frontend through
+    :class:`asyncio.Queue` objects and results are handed back through futures, so no redis
+    round trip is needed. The request and the result stay JSON strings, the same as on the
+    other transports, so the worker still decodes and encodes them. Needs a single frontend
+    process and a single process per worker pool.
+    """
+
+    in_process = True
+    uses_redis = False
+
+    def __init__(self, result_ttl: int):
+        super().__init__(result_ttl)
+        self._queue_names = []
+        self._queues = {}
+        self._arrived = None
+        # Coalesce keys of running tasks and the names of the tasks attached to them
+        self._leaders = {}
+        self._followers = {}
+        self._counters = defaultdict(int)
+        self._counters_lock = threading.Lock()
+
+    def setup(self, queues, counters=(), frontends=1):
+        """Nothing to prepare, the queues are created in the event loop."""
+        self._queue_names = list(queues)
+
+    def shutdown(self, queue):
+        """Nothing to do, the workers end with the event loop."""
+
+    def call(self, queue, task):
+        """Not possible, the workers only run in the event loop of the frontend."""
+        raise NotImplementedError(
+            "The embedded transport can't be called before the event loop runs."
+        )
+
+    def length(self, queue):
+        """Get the number of tasks waiting in a queue."""
+        if queue not in self._queues:
+            return 0
+        return self._queues[queue].qsize()
+
+    async def connect(self, listen=False):
+        """Create the queues in the running event loop. Only the first call does that."""
+        if self._arrived is not None:
+            return
+        self._arrived = asyncio.Event()
+        self._queues = {queue: asyncio.Queue() for queue in self._queue_names}
+
+    async def close(self):
+        """Answer all waiting requests with an error."""
+        for future in self._waiting.values():
+            if not future.done():
+                future.set_result((503, '{"reply": "Coco is shutting down."}'))
+
+    async def count(self, counter):
+        """Increment a counter read by the metrics server."""
+        with self._counters_lock:
+            self._counters[counter] += 1
+
+    def take_count(self, counter):
+        """Get the increments of a counter since the last call and reset it."""
+        with self._counters_lock:
+            return self._counters.pop(counter, 0)
+
+    async def enqueue(self, queue, task, limit=0, queues=None, coalesce=None):
+        """Queue a task."""
+        if queues is None:
+            queues = [queue]
+        name = task["name"]
+        if coalesce and coalesce in self._leaders:
+            self._followers[self._leaders[coalesce]].append(name)
+            status = ATTACHED
+        elif limit and sum(self.length(q) for q in queues) >= limit:
+            return FULL
+        else:
+            if coalesce:
+                task = dict(task, coalesce=coalesce)
+                self._leaders[coalesce] = name
+                self._followers[name] = []
+            self._queues[queue].put_nowait(task)
+            self._arrived.set()
+            status = QUEUED
+        self._waiting[name] = asyncio.get_event_loop().create_future()
+        return status
+
+    async def wait(self, name):
+        """Wait for the result of a task."""
+        try:
+            return await self._waiting[name]
+        finally:
+            self._waiting.pop(name, None)
+
+    async def receive(self, queues, timeout):
+        """Take the next task."""
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        while True:
+            for queue in queues:
+                if not self._queues[queue].empty():
+                    return queue, self._queues[queue].get_nowait()
+            # Every waiting worker wakes up when a task arrives and looks for one of its own
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                return None
+
+    async def reply(self, queue, task, code, result):
+        """Hand the result to the frontend, also to all requests attached to the task."""
+        name = task["name"]
+        names = [name]
+        if task.get("coalesce"):
+            del self._leaders[task["coalesce"]]
+            names += self._followers.pop(name)
+        for name in names:
+            future = self._waiting.get(name)
+            if future is not None and not future.done():
+                future.set_result((code, result))
+
+
+class SharedMemoryTransport(Transport):
+    """
+    Transport through ring buffers in shared memory, without redis.
+
+    Each queue is a :class:`RingBuffer` and so is the result buffer of each frontend process.
+    Tasks and results are pickled into the buffers, and a byte written to the pipe next to a
+    buffer wakes up the processes waiting on it. All buffers share one lock. The queue length
+    limit is enforced on the buffers, a task is also dropped if its queue runs out of space.
+
+    All processes have to be forked from the one calling :meth:`setup`. Identical requests
+    are only coalesced within each frontend process.
+    """
+
+    uses_redis = False
+
+    # Capacity in bytes of the buffer of each queue and of the result buffer of each frontend
+    QUEUE_SIZE = 1 << 20
+    REPLY_SIZE = 1 << 23
+
+    def __init__(self, result_ttl: int):
+        # Fail when the config is loaded on Python versions without shared memory
+        shared_memory()
+        super().__init__(result_ttl)
+        self._owner = None
+        self._lock = None
+        # Ring buffer, read and write end of the wakeup pipe for each queue and frontend
+        self._queues = {}
+        self._replies = []
+        self._counters = None
+        self._counter_index = {}
+        self._next_frontend = None
+        self._frontend = None
+        # Coalesce keys of running tasks and the names of the tasks attached to them
+        self._leaders = {}
+        self._followers = {}
+
+    def setup(self, queues, counters=(), frontends=1):
+        """Create the buffers, pipes and counters before any other process is forked."""
+        self._owner = os.getpid()
+        self._lock = multiprocessing.Lock()
+        self._queues = {queue: self._channel(self.QUEUE_SIZE) for queue in queues}
+        # The last one is used by :meth:`call`
+        self._replies = [self._channel(self.REPLY_SIZE) for _ in range(frontends + 1)]
+        self._counter_index = {counter: i for i, counter in enumerate(counters)}
+        self._counters = multiprocessing.Array("q", max(len(counters), 1))
+        self._next_frontend = multiprocessing.Value("i", 0)
+
+    def shutdown(self, queue):
+        """Tell a worker serving the queue to exit."""
+        ring, _, write = self._queues[queue]
+        with self._lock:
+            ring.put(pickle.dumps({"name": SHUTDOWN}))
+        self._wake(write)
+
+    def cleanup(self):
+        """Free the shared memory."""
+        if self._owner != os.getpid():
+            return
+        for ring, _, _ in [*self._queues.values(), *self._replies]:
+            ring.unlink()
+        self._owner = None
+
+    def call(self, queue, task):
+        """Queue a task and wait for the result, blocking."""
+        index = len(self._replies) - 1
+        ring, read, _ = self._replies[index]
+        queue_ring, _, write = self._queues[queue]
+        with self._lock:
+            queue_ring.put(self._pack(dict(task, reply_to=index)))
+        self._wake(write)
+        while True:
+            select.select([read], [], [])
+            self._drain(read)
+            with self._lock:
+                data = ring.get()
+            if data is not None:
+                _, code, result = unpack_reply(data.decode())
+                return code, result
+
+    def length(self, queue):
+        """Get the number of tasks waiting in a queue."""
+        with self._lock:
+            return len(self._queues[queue][0])
+
+    async def connect(self, listen=False):
+        """
+        Take a result buffer if this is a frontend process.
+
+        Only frontends with a listener can queue tasks.
+        """
+        if not listen:
+            return
+        with self._next_frontend.get_lock():
+            self._frontend = self._next_frontend.value
+            self._next_frontend.value += 1
+        if self._frontend >= len(self._replies) - 1:
+            raise RuntimeError(
+                f"Only {len(self._replies) - 1} frontend processes were set up."
+            )
+        asyncio.get_event_loop().add_reader(
+            self._replies[self._frontend][1], self._receive_replies
+        )
+
+    async def close(self):
+        """Stop receiving results."""
+        if self._frontend is not None:
+            asyncio.get_event_loop().remove_reader(self._replies[self._frontend][1])
+            self._frontend = None
+
+    async def count(self, counter):
+        """Increment a counter read by the metrics server."""
+        if counter in self._counter_index:
+            with self._counters.get_lock():
+                self._counters[self._counter_index[counter]] += 1
+
+    def take_count(self, counter):
+        """Get the increments of a counter since the last call and reset it."""
+        if counter not in self._counter_index:
+            return 0
+        with self._counters.get_lock():
+            value = self._counters[self._counter_index[counter]]
+            self._counters[self._counter_index[counter]] = 0
+        return value
+
+    async def enqueue(self, queue, task, limit=0, queues=None, coalesce=None):
+        """Queue a task."""
+        if queues is None:
+            queues = [queue]
+        name = task["name"]
+        if coalesce and coalesce in self._leaders:
+            self._followers[self._leaders[coalesce]][1].append(name)
+            status = ATTACHED
+        else:
+            data = self._pack(dict(task, reply_to=self._frontend))
+            ring, _, write = self._queues[queue]
+            with self._lock:
+                if limit and sum(len(self._queues[q][0]) for q in queues) >= limit:
+                    return FULL
+                if not ring.put(data):
+                    return FULL
+            self._wake(write)
+            if coalesce:
+                self._leaders[coalesce] = name
+                self._followers[name] = (coalesce, [])
+            status = QUEUED
+        self._waiting[name] = asyncio.get_event_loop().create_future()
+        return status
+
+    async def wait(self, name):
+        """Wait for the result of a task."""
+        try:
+            return await self._waiting[name]
+        finally:
+            self._waiting.pop(name, None)
+
+    def _receive_replies(self):
+        """Hand the results in the buffer of this frontend to the waiting requests."""
+        ring, read, _ = self._replies[self._frontend]
+        # Empty the pipe first, so a result added after reading the buffer wakes us again
+        self._drain(read)
+        replies = []
+        with self._lock:
+            data = ring.get()
+            while data is not None:
+                replies.append(data)
+                data = ring.get()
+        for data in replies:
+            name, code, result = unpack_reply(data.decode())
+            names = [name]
+            if name in self._followers:
+                coalesce, followers = self._followers.pop(name)
+                del self._leaders[coalesce]
+                names += followers
+            for name in names:
+                future = self._waiting.get(name)
+                if future is not None and not future.done():
+                    future.set_result((code, result))
+
+    async def receive(self, queues, timeout):
+        """Take the next task."""
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        pipes = [self._queues[queue][1] for queue in queues]
+        while True:
+            with self._lock:
+                for queue in queues:
+                    data = self._queues[queue][0].get()
+                    if data is not None:
+                        return queue, pickle.loads(data)
+
+            # Each task comes with a byte in the pipe of its queue. Take one byte before
+            # looking again, so the others still wake up the other workers.
+            readable = loop.create_future()
+            for pipe in pipes:
+                loop.add_reader(pipe, self._readable, readable, pipe)
+            try:
+                pipe = await asyncio.wait_for(readable, deadline - loop.time())
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                for pipe_ in pipes:
+                    loop.remove_reader(pipe_)
+            try:
+                os.read(pipe, 1)
+            except BlockingIOError:
+                pass
+
+    async def reply(self, queue, task, code, result):
+        """Send the result of a task to the frontend that queued it."""
+        name = task["name"]
+        ring, _, write = self._replies[int(task["reply_to"])]
+        data = pack_reply(name, code, result).encode()
+        if len(data) + 4 > ring.size:
+            logger.error(f"Result of /{task.get('endpoint')} too large ({len(data)}B).")
+            data = pack_reply(
+                name,
+                500,
+                '{"type": "InternalError", "message": "Result too large."}',
+            ).encode()
+        deadline = time.time() + self.result_ttl
+        while True:
+            with self._lock:
+                if ring.put(data):
+                    break
+            if time.time() > deadline:
+                logger.error(f"Result buffer full, dropping result of {name}.")
+                return
+            await asyncio.sleep(0.01)
+        self._wake(write)
+
+    @staticmethod
+    def _channel(size: int):
+        read, write = os.pipe()
+        os.set_blocking(read, False)
+        os.set_blocking(write, False)
+        return RingBuffer(size), read, write
+
+    @staticmethod
+    def _pack(task: Dict[str, str]) -> bytes:
+        return pickle.dumps(task, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _wake(pipe: int):
+        try:
+            os.write(pipe, b"\0")
+        except BlockingIOError:
+            # The pipe is full of wakeups already
+            pass
+
+    @staticmethod
+    def _drain(pipe: int):
+        try:
+            while os.read(pipe, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    @staticmethod
+    def _readable(future: asyncio.Future, pipe: int):
+        if not future.done():
+            future.set_result(pipe)
+
+
+TRANSPORTS = {
+    "list": ListTransport,
+    "stream": StreamTransport,
+    "shm": SharedMemoryTransport,
+    "embedded": EmbeddedTransport,
+}
+
+
+def get_transport(name: str, result_ttl: int) -> Transport:
+    """
+    Create a transport.
+
+    Parameters
+    ----------
+    name : str
+        One of :data:`TRANSPORTS`.
+    result_ttl : int
+        Seconds before unclaimed results and coalesce keys expire.
+
+    Returns
+    -------
+    :class:`Transport`
+    """
+    try:
+        return TRANSPORTS[name](result_ttl)
+    except KeyError:
+        raise ConfigError(
+            f"Unknown transport '{name}'. Use one of {list(TRANSPORTS)}."
+        ) from None
@@ -74,6 +74,33 @@ def str2total_seconds(time_str):
     return str2timedelta(time_str).total_seconds()
 
 
+DEFAULT_POOL = "default"
+DEFAULT_PRIORITY = "normal"
+
+
+def queue_name(pool: str, priority: str = DEFAULT_PRIORITY) -> str:
+    """
+    Get the name of the redis list used as a request queue.
+
+    Parameters
+    ----------
+    pool : str
+        Name of the worker pool.
+    priority : str
+        Name of the priority class.
+
+    Returns
+    -------
+    str
+        `"queue"` for the default pool, `"queue:<pool>"` for any other. Followed by
+        `"/<priority>"` for priority classes other than the default one.
+    """
+    name = "queue" if pool == DEFAULT_POOL else f"queue:{pool}"
+    if priority != DEFAULT_PRIORITY:
+        name = f"{name}/{priority}"
+    return name
+
+
 class Host:
     """Represents a host URL.
 
@@ -143,17 +170,40 @@ class PersistentState:
     ----------
     path
         Path to file to serialise the state in.
+
+    Attributes
+    ----------
+    version : int
+        Counts the changes of the state, either committed or reloaded from disk.
     """
 
     def __init__(self, path: os.PathLike):
         self._path = path
+        self.version = 0
         self._update = False
+        self._mtime = None
+        self._state = None
+        self.refresh()
 
-        if path.exists():
-            with path.open("r") as fh:
-                self._state = json.load(fh)
-        else:
-            self._state = None
+    def refresh(self) -> bool:
+        """Reload the state if the file was changed by another process.
+
+        Returns
+        -------
+        reloaded
+            True if the state was reloaded.
+        """
+        try:
+            mtime = self._path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+        with self._path.open("r") as fh:
+            self._state = json.load(fh)
+        self._mtime = mtime
+        self.version += 1
+        return True
 
     @property
     def state(self):
@@ -185,6 +235,8 @@ class PersistentState:
             self._state = copy.deepcopy(self._tmp_state)
             with atomic_write(self._path, overwrite=True) as f:
                 json.dump(self._state, f, indent=4)
+            self._mtime = self._path.stat().st_mtime_ns
+            self.version += 1
 
         except Exception as e:
             # If anything happens, rollback to the old state
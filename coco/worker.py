@@ -15,8 +15,18 @@ import aioredis
 
 from . import Result
 from .scheduler import Scheduler
-from .exceptions import CocoException, InvalidMethod, InvalidPath, InvalidUsage
+from .exceptions import (
+    CocoException,
+    InternalError,
+    InvalidMethod,
+    InvalidPath,
+    InvalidUsage,
+)
 from . import slack
+from .priority import WeightedRoundRobin
+from .request_forwarder import memo_scope
+from .transport import ListTransport, SHUTDOWN
+from .util import DEFAULT_POOL, DEFAULT_PRIORITY, queue_name
 
 logger = logging.getLogger(__name__)
 
@@ -41,162 +51,291 @@ def signal_handler(*_):
 signal.signal(signal.SIGINT, signal_handler)
 
 
-async def _open_redis_connection():
+def _state_locks(endpoint):
+    """Get the state locks to hold while calling an endpoint (all of it for unknown ones)."""
+    return getattr(endpoint, "state_locks", {"": True})
+
+
+def _repeatable(endpoint):
+    """Tell if an interrupted call to an endpoint can be run again (GET, no state writes)."""
+    return (
+        endpoint is not None
+        and endpoint.type == "GET"
+        and not any(_state_locks(endpoint).values())
+    )
+
+
+async def _call_endpoint(endpoints, method, endpoint_name, request, params):
+    """
+    Call an endpoint and handle any exceptions that occur.
+
+    Returns
+    -------
+    Tuple[dict, int]
+        JSON serialisable result and HTTP status code.
+    """
     try:
-        return aioredis.from_url(
-            "redis://127.0.0.1:6379", encoding="utf-8", decode_responses=True
-        ).client()
-    except ConnectionError as e:
-        logger.error(
-            f"coco.worker: failure connecting to redis. Make sure it is running: {e}"
+
+        if not request:
+            request = None
+        else:
+            try:
+                request = json.loads(request)
+            except json.JSONDecodeError as e:
+                raise InvalidUsage(f"Invalid JSON payload: {request}") from e
+            # Check that the requested endpoint exists
+            if endpoint_name not in endpoints:
+                msg = f"endpoint /{endpoint_name} not found."
+                logger.debug(
+                    f"coco.worker: Received request to /{endpoint_name}, but {msg}"
+                )
+                raise InvalidPath(msg)
+
+        # Parse URL query parameters
+        # TODO: This will be used by certain kotekan endpoints that do not accept
+        #       POST but need parameters specified. If we find another scheme to
+        #       make this work we should remove this feature as it is somewhat
+        #       redundant with the request values.
+        params = parse_qsl(params)
+
+        try:
+            endpoint = endpoints[endpoint_name]
+        except KeyError as exc:
+            raise InvalidPath(f"Endpoint /{endpoint_name} not found.") from exc
+
+        # Check that it is being requested with the correct method
+        if method != endpoint.type and method not in endpoint.type:
+            msg = (
+                f"endpoint /{endpoint_name} received {method} request (accepts "
+                f"{endpoint.type} only)"
+            )
+            logger.debug(f"coco.worker: {msg}")
+            raise InvalidMethod(msg)
+
+        logger.debug(f"coco.worker: Calling /{endpoint.name}: {request}")
+        with memo_scope():
+            result = await endpoint.call(request, params=params)
+
+        # Transform any Result into a report so it can be serialised
+        if isinstance(result, Result):
+            result = result.report()
+
+        code = 200
+
+    # Process a known exception source into a response
+    except CocoException as e:
+        result = e.to_dict()
+        code = e.status_code
+
+    # Unexpected exceptions are returned as HTTP 500 errors, and dump a
+    # traceback
+    except Exception as e:
+        etype = e.__class__.__qualname__
+        msg = e.args[0] if e.args else None
+        result = {"type": etype, "message": msg}
+        code = 500  # Internal server error
+        logger.exception(f"{etype} raised during endpoint processing: {msg}")
+
+    return result, code
+
+
+async def serve(
+    endpoints,
+    forwarder,
+    state,
+    transport,
+    concurrency=1,
+    pool=DEFAULT_POOL,
+    priorities=None,
+):
+    """
+    Wait for tasks and run them.
+
+    Takes tasks from the queues of the pool and runs them until told to shut down. Up to
+    `concurrency` tasks are run at the same time. Each priority class has its own queue.
+    Higher classes are served first, but all classes get a share of the worker according to
+    their weight, see :class:`WeightedRoundRobin`. While running, each task holds the lock of
+    the state for the `state_locks` of its endpoint, so tasks only run alongside each other
+    if they don't touch the same parts of the state. Tasks get the lock in the order they
+    were queued.
+
+    Parameters
+    ----------
+    endpoints : dict
+        A dict with keys being endpoint names and values being of type :class:`Endpoint`.
+    forwarder : :class:`RequestForwarder`
+        The request forwarder used by the endpoints. Its metrics have to be initialised.
+    state : :class:`State`
+        Coco's state.
+    transport : :class:`Transport`
+        Connected transport to receive the tasks and send the results with.
+    concurrency : int
+        Maximum number of tasks running at the same time. Default 1 (serial).
+    pool : str
+        Name of the worker pool. Only tasks from the queues of this pool are run.
+    priorities : dict
+        Names of the priority classes and their weights. Default: only the default class.
+    """
+    if priorities is None:
+        priorities = {DEFAULT_PRIORITY: 1}
+    queues = {queue_name(pool, priority): priority for priority in priorities}
+    round_robin = WeightedRoundRobin(priorities)
+
+    async def _run_task(queue, task, lock):
+        # Stays unset if the task is cancelled before the endpoint returned
+        result, code = None, None
+        try:
+            await lock.wait()
+            result, code = await _call_endpoint(
+                endpoints,
+                task.get("method"),
+                task.get("endpoint"),
+                task.get("request"),
+                task.get("params", ""),
+            )
+        finally:
+            state.lock.release(lock)
+        if code is not None:
+            await _send_result(queue, task, result, code)
+
+    async def _send_result(queue, task, result, code):
+        result = json.dumps(result)
+        # Always attempt to return the result so that the client doesn't hang...
+        # If processing this request took a long time, the redis server may have hung up..
+        try:
+            await transport.reply(queue, task, code, result)
+        except aioredis.exceptions.ConnectionError as err:
+            logger.debug(err)
+            logger.info(
+                f"Redis connection closed while processing /{task.get('endpoint')}. "
+                "Trying again..."
+            )
+            await transport.reply(queue, task, code, result)
+
+    # Free slots for concurrently running tasks
+    slots = asyncio.Semaphore(concurrency)
+    running = set()
+
+    while True:
+        await slots.acquire()
+
+        # Wait for an endpoint call in one of the queues. They are passed in the order
+        # they are due, the first one that isn't empty is used.
+        order = round_robin.order()
+        reply = await transport.receive(
+            [queue_name(pool, priority) for priority in order], 30
         )
-        sys.exit(1)
+        if reply is None:
+            slots.release()
+            continue
+        queue, task = reply
+
+        # check for shutdown condition
+        if task["name"] == SHUTDOWN:
+            logger.info("coco.worker: Received shutdown command. Exiting...")
+            if running:
+                await asyncio.wait(running)
+            return
+
+        priority = queues[queue]
+        round_robin.served(priority)
+
+        endpoint_name = task.get("endpoint")
+        if task.get("_recovered") and not _repeatable(endpoints.get(endpoint_name)):
+            # It may have changed something before it was interrupted
+            error = InternalError(
+                f"Call to /{endpoint_name} was interrupted by a worker restart and is "
+                f"not run again, because the endpoint isn't a GET or writes the state."
+            )
+            logger.warning(f"coco.worker: {error.message}")
+            await _send_result(queue, task, error.to_dict(), error.status_code)
+            slots.release()
+            continue
+        if task.get("received"):
+            forwarder.queue_wait_time.labels(endpoint_name, pool, priority).observe(
+                time.time() - float(task["received"])
+            )
+
+        # Queue for the lock right away to keep the order of the tasks
+        lock = state.lock.acquire(_state_locks(endpoints.get(endpoint_name)))
+
+        future = asyncio.ensure_future(_run_task(queue, task, lock))
+        running.add(future)
+        future.add_done_callback(running.discard)
+        future.add_done_callback(lambda _: slots.release())
 
 
 def main_loop(
-    endpoints, forwarder, coco_port, metrics_port, log_level, frontend_timeout
+    endpoints,
+    forwarder,
+    state,
+    coco_port,
+    metrics_port,
+    log_level,
+    frontend_timeout,
+    concurrency=1,
+    pool=DEFAULT_POOL,
+    pools=(DEFAULT_POOL,),
+    priorities=None,
+    primary=True,
+    transport=None,
+    consumer=None,
 ):
     """
-    Wait for tasks and run them.
+    Run a worker process.
 
-    Queries the redis queue for new tasks and runs them serialized until killed.
+    Serves the metrics of the process and runs the tasks of the pool with :func:`serve` until
+    told to shut down.
 
     Parameters
     ----------
     endpoints : dict
         A dict with keys being endpoint names and values being of type :class:`Endpoint`.
+    forwarder : :class:`RequestForwarder`
+        The request forwarder used by the endpoints.
+    state : :class:`State`
+        Coco's state.
     frontend_timeout : int
         Number of seconds before coco sanic frontend times out.
+    concurrency : int
+        Maximum number of tasks running at the same time. Default 1 (serial).
+    pool : str
+        Name of the worker pool this process belongs to. Only tasks from the queue of this
+        pool are run.
+    pools : list of str
+        Names of all worker pools.
+    priorities : dict
+        Names of the priority classes and their weights. Default: only the default class.
+    primary : bool
+        If this is the primary worker process. Only the primary process runs the scheduler
+        and reports the queue metrics.
+    transport : :class:`Transport`
+        Transport to receive the tasks and send the results with. Default: redis lists.
+    consumer : str
+        Name of this worker process, unique among all worker processes.
     """
+    if priorities is None:
+        priorities = {DEFAULT_PRIORITY: 1}
+    if transport is None:
+        transport = ListTransport(int(frontend_timeout) + 1)
+    if consumer is not None:
+        transport.consumer = consumer
 
     async def go():
-
         # start the prometheus server for forwarded requests
-        forwarder.start_prometheus_server(metrics_port)
+        forwarder.start_prometheus_server(
+            metrics_port, pools, priorities, primary, transport
+        )
         forwarder.init_metrics()
 
-        conn = await _open_redis_connection()
-        code = None
-
-        while True:
-            # Wait until the name of an endpoint call is in the queue.
-            name = await conn.execute_command("blpop", "queue", 30)
-            if name is None:
-                continue
-            name = name[1]
-
-            # check for shutdown condition
-            if name == "coco_shutdown":
-                logger.info("coco.worker: Received shutdown command. Exiting...")
-                exit(0)
-
-            # Use the name to get all info on the call and delete from redis.
-            [
-                method,
-                endpoint_name,
-                request,
-                params,
-                received,
-            ] = await conn.execute_command(
-                "hmget", name, "method", "endpoint", "request", "params", "received"
-            )
-            if received:
-                received = float(received)
-                forwarder.queue_wait_time.labels(endpoint_name).observe(
-                    time.time() - received
-                )
-
-            await conn.execute_command("del", name)
-            # Call the endpoint, and handle any exceptions that occur
-            try:
-
-                if not request:
-                    request = None
-                else:
-                    try:
-                        request = json.loads(request)
-                    except json.JSONDecodeError as e:
-                        raise InvalidUsage(f"Invalid JSON payload: {request}") from e
-                    # Check that the requested endpoint exists
-                    if endpoint_name not in endpoints:
-                        msg = f"endpoint /{endpoint_name} not found."
-                        logger.debug(
-                            f"coco.worker: Received request to /{endpoint_name}, but {msg}"
-                        )
-                        raise InvalidPath(msg)
-
-                # Parse URL query parameters
-                # TODO: This will be used by certain kotekan endpoints that do not accept
-                #       POST but need parameters specified. If we find another scheme to
-                #       make this work we should remove this feature as it is somewhat
-                #       redundant with the request values.
-                params = parse_qsl(params)
-
-                try:
-                    endpoint = endpoints[endpoint_name]
-                except KeyError as exc:
-                    raise InvalidPath(f"Endpoint /{endpoint_name} not found.") from exc
-
-                # Check that it is being requested with the correct method
-                if method != endpoint.type and method not in endpoint.type:
-                    msg = (
-                        f"endpoint /{endpoint_name} received {method} request (accepts "
-                        f"{endpoint.type} only)"
-                    )
-                    logger.debug(f"coco.worker: {msg}")
-                    raise InvalidMethod(msg)
-
-                logger.debug(f"coco.worker: Calling /{endpoint.name}: {request}")
-                result = await endpoint.call(request, params=params)
-
-                # Transform any Result into a report so it can be serialised
-                if isinstance(result, Result):
-                    result = result.report()
-
-                code = 200
-
-            # Process a known exception source into a response
-            except CocoException as e:
-                result = e.to_dict()
-                code = e.status_code
-
-            # Unexpected exceptions are returned as HTTP 500 errors, and dump a
-            # traceback
-            except Exception as e:
-                etype = e.__class__.__qualname__
-                msg = e.args[0] if e.args else None
-                result = {"type": etype, "message": msg}
-                code = 500  # Internal server error
-                logger.exception(f"{etype} raised during endpoint processing: {msg}")
-
-                # Normal exceptions should be supressed, BaseExceptions (e.g.
-                # KeyboardInterrupt) should be re-raised
-                if not isinstance(e, Exception):
-                    raise e
-
-            # Always attempt to return the result so that the client doesn't hang...
-            finally:
-                # If processing this request took a long time, the redis server may have hung up..
-                try:
-                    await conn.execute_command(
-                        "rpush", f"{name}:res", json.dumps(result)
-                    )
-                except aioredis.exceptions.ConnectionError as err:
-                    logger.debug(err)
-                    logger.info(
-                        f"Redis connection closed while processing /{endpoint_name}. Opening new connection..."
-                    )
-
-                    # open new connection and try one more time
-                    conn = await _open_redis_connection()
-                    await conn.execute_command(
-                        "rpush", f"{name}:res", json.dumps(result)
-                    )
-                finally:
-                    await conn.execute_command("rpush", f"{name}:code", code)
-
-        # optionally close connection
-        await conn.close()
+        await transport.connect()
+        await forwarder.open_session()
+        forwarder.start_health_probes()
+        await serve(
+            endpoints, forwarder, state, transport, concurrency, pool, priorities
+        )
+        await forwarder.close_session()
+        exit(0)
 
     logger.setLevel(log_level)
 
@@ -208,10 +347,13 @@ def main_loop(
     # Start up slack logging for the worker
     slack.start(loop)
 
-    scheduler = Scheduler(
-        endpoints, "127.0.0.1", coco_port, frontend_timeout, log_level
-    )
-    loop.run_until_complete(asyncio.gather(go(), scheduler.start()))
+    if primary:
+        scheduler = Scheduler(
+            endpoints, "127.0.0.1", coco_port, frontend_timeout, log_level
+        )
+        loop.run_until_complete(asyncio.gather(go(), scheduler.start()))
+    else:
+        loop.run_until_complete(go())
 
     # Cleanup
     loop.run_until_complete(slack.stop())
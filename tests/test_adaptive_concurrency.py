@@ -0,0 +1,108 @@
+"""Test adapting the number of requests in flight to how well the hosts cope."""
+import asyncio
+import time
+
+import pytest
+import requests
+from prometheus_client.parser import text_string_to_metric_families
+
+from coco.exceptions import ConfigError
+from coco.limiter import AIMDLimit
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+
+PORT = 12063
+CONFIG = {
+    "log_level": "DEBUG",
+    "metrics_port": PORT,
+    "adaptive_concurrency": {"initial": 2, "max": 4},
+}
+ENDPOINTS = {
+    "test": {"group": "test", "values": {"foo": "int"}},
+}
+
+
+def callback(data):
+    """Reply with the incoming json request."""
+    return data
+
+
+N_HOSTS = 4
+CALLBACKS = {"test": callback}
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture
+def runner(farm):
+    """Create a coco runner."""
+    CONFIG["groups"] = {"test": farm.hosts}
+    with coco_runner.Runner(CONFIG, ENDPOINTS) as runner:
+        yield runner
+
+
+def _limit():
+    metrics = requests.get(f"http://localhost:{PORT}/metrics")
+    for metric in text_string_to_metric_families(metrics.text):
+        for sample in metric.samples:
+            if sample.name == "coco_adaptive_concurrency_limit":
+                return sample.value
+    return None
+
+
+def test_adaptive_concurrency(farm, runner):
+    """Test that all hosts are called and the limit is exported."""
+    reply = runner.client("test", ["1"])
+    assert reply["success"] is True
+    for h in farm.hosts:
+        assert reply["test"][h] == {"reply": {"foo": 1}, "status": 200}
+    assert 1 <= _limit() <= 4
+
+
+def test_aimd():
+    """Test growing and cutting the limit."""
+    aimd = AIMDLimit(initial=2, minimum=1, maximum=3, backoff=0.5)
+    sent = time.time()
+    aimd.record(sent, False)
+    aimd.record(sent, False)
+    assert aimd.limit == pytest.approx(2.9, abs=0.1)
+    for _ in range(10):
+        aimd.record(sent, False)
+    assert aimd.limit == 3
+
+    # Requests of the same round only cut it once
+    sent = time.time()
+    aimd.record(sent, True)
+    aimd.record(sent, True)
+    assert aimd.limit == 1.5
+    aimd.record(time.time(), True)
+    assert aimd.limit == 1
+
+    with pytest.raises(ConfigError):
+        AIMDLimit.from_config({"initial": 8, "max": 4})
+
+
+def test_aimd_slot():
+    """Test that requests over the limit wait for a slot."""
+    aimd = AIMDLimit(initial=2)
+    running = []
+    most = 0
+
+    async def request():
+        nonlocal most
+        async with aimd.slot():
+            running.append(1)
+            most = max(most, len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+    async def run():
+        await asyncio.gather(*[request() for _ in range(8)])
+
+    asyncio.run(run())
+    assert most == 2
+    assert aimd.in_flight == 0
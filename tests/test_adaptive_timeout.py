@@ -0,0 +1,84 @@
+"""Test timeouts learned for each host."""
+import multiprocessing
+import time
+
+import pytest
+
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+
+CONFIG = {
+    "log_level": "DEBUG",
+    "timeout": "10s",
+    "adaptive_timeout": {"multiplier": 2, "floor": 0.5},
+}
+ENDPOINTS = {
+    "adaptive": {
+        "group": "test",
+        "values": {"foo": "int"},
+        "call": {"forward": "slow_adaptive"},
+    },
+    "static": {
+        "group": "test",
+        "values": {"foo": "int"},
+        "call": {"forward": {"name": "slow_static", "adaptive_timeout": False}},
+    },
+}
+N_HOSTS = 2
+N_FAST = 2 * N_HOSTS
+SLOW = 3
+
+
+class SlowOnce(object):
+    """Reply right away, except for one call after `N_FAST` calls."""
+
+    def __init__(self):
+        self.count = multiprocessing.Value("i", 0)
+
+    def __call__(self, data):
+        with self.count.get_lock():
+            self.count.value += 1
+            n = self.count.value
+        if n == N_FAST + 1:
+            time.sleep(SLOW)
+        return data
+
+
+CALLBACKS = {"slow_adaptive": SlowOnce(), "slow_static": SlowOnce()}
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture
+def runner(farm):
+    """Create a coco runner."""
+    CONFIG["groups"] = {"test": farm.hosts}
+    with coco_runner.Runner(CONFIG, ENDPOINTS) as runner:
+        yield runner
+
+
+def _sweep(runner, endpoint, forward):
+    start = time.time()
+    reply = runner.client(endpoint, ["1"])
+    statuses = sorted(h["status"] for h in reply[forward].values())
+    return statuses, time.time() - start
+
+
+@pytest.mark.parametrize("endpoint", ["adaptive", "static"])
+def test_adaptive_timeout(farm, runner, endpoint):
+    """Test that a host that got slow is given up on long before the configured timeout."""
+    forward = f"slow_{endpoint}"
+    for _ in range(N_FAST // N_HOSTS):
+        assert _sweep(runner, endpoint, forward)[0] == [200] * N_HOSTS
+
+    statuses, duration = _sweep(runner, endpoint, forward)
+    if endpoint == "adaptive":
+        assert statuses == [0, 200]
+        assert duration < SLOW
+    else:
+        assert statuses == [200, 200]
+        assert duration >= SLOW
@@ -29,8 +29,32 @@ ENDPOINTS = {
         "values": {"rand": "bool"},
         "call": {"forward": {"name": "rand", "reply": {"identical": ["rand"]}}},
     },
+    "stream_check": {
+        "group": "test",
+        "values": {"ok": "bool"},
+        "call": {
+            "forward": {
+                "name": "pong",
+                "reply": {"value": {"ok": True}, "identical": ["ok"]},
+                "stream_checks": True,
+            }
+        },
+    },
+    "stream_single_host": {
+        "group": "test",
+        "values": {"ok": "bool"},
+        "call": {
+            "forward": {
+                "name": "pong",
+                "reply": {"value": {"ok": True}},
+                "stream_checks": True,
+                "on_failure": {"call_single_host": "fix"},
+            }
+        },
+    },
     "pong": {"group": "test"},
     "rand": {"group": "test"},
+    "fix": {"group": "test"},
     # For before check
     "bvalue_check": {
         "group": "test",
@@ -102,8 +126,9 @@ class RandCallback(object):
 
 rand_callback = RandCallback()
 
+
 N_HOSTS = 2
-CALLBACKS = {"pong": callback, "rand": rand_callback}
+CALLBACKS = {"pong": callback, "rand": rand_callback, "fix": callback}
 
 
 @pytest.fixture
@@ -267,3 +292,28 @@ def test_forward(farm, runner):
     assert response["success"] is False
     failed_host = list(response["failed_checks"]["pong"].keys())
     assert len(failed_host) == N_HOSTS
+
+
+def test_stream_checks(farm, runner):
+    """Test checking the replies of each host as they arrive."""
+    response = runner.client("stream_check", ["True"])
+    assert response["success"] is True
+    assert "failed_checks" not in response
+
+    response = runner.client("stream_check", ["False"])
+    assert response["success"] is False
+    failed_host = list(response["failed_checks"]["pong"].keys())
+    assert len(failed_host) == N_HOSTS
+    reply = response["failed_checks"]["pong"][failed_host[0]]["reply"]
+    assert reply["value"] == ["ok"]
+
+
+def test_stream_checks_single_host(farm, runner):
+    """Test that the hosts that failed a streamed check get one call together."""
+    response = runner.client("stream_single_host", ["False"])
+    assert response["success"] is False
+    assert len(response["failed_checks"]["pong"]) == N_HOSTS
+    for p in farm.ports:
+        assert farm.counters()[p]["fix"] == 1
+    # The report has the replies of all of them
+    assert set(response["fix"]["fix"]) == set(farm.hosts)
@@ -0,0 +1,163 @@
+"""Test the circuit breakers of hosts that stopped answering."""
+import asyncio
+import socket
+import time
+
+import pytest
+
+from coco.breaker import CLOSED, HALF_OPEN, OPEN, OPEN_STATUS, CircuitBreakers
+from coco.limiter import AIMDLimit, ConcurrencyLimiter
+from coco.request_forwarder import RequestForwarder
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+from coco.util import Host
+
+COOLDOWN = 1
+CONFIG = {
+    "log_level": "DEBUG",
+    "circuit_breaker": {"failures": 2, "cooldown": COOLDOWN},
+}
+ENDPOINTS = {
+    "test": {"group": "test", "values": {"foo": "int"}},
+}
+
+
+def callback(data):
+    """Reply with the incoming json request."""
+    return data
+
+
+N_HOSTS = 2
+CALLBACKS = {"test": callback}
+
+
+def _unused_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+DEAD_HOST = f"http://localhost:{_unused_port()}/"
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture
+def runner(farm):
+    """Create a coco runner with a host that doesn't answer."""
+    CONFIG["groups"] = {"test": farm.hosts + [DEAD_HOST]}
+    with coco_runner.Runner(CONFIG, ENDPOINTS) as runner:
+        yield runner
+
+
+def test_breakers():
+    """Test opening, probing and closing a breaker."""
+    breakers = CircuitBreakers(failures=2, cooldown=0.1)
+    host = Host(DEAD_HOST)
+    assert breakers.allow(host)
+
+    breakers.record(host, False)
+    assert breakers.states() == {host: CLOSED}
+    breakers.record(host, False)
+    assert breakers.states() == {host: OPEN}
+    assert not breakers.allow(host)
+
+    # After the cooldown one call probes the host, a failed probe opens it again
+    time.sleep(0.1)
+    assert breakers.allow(host)
+    assert breakers.states() == {host: HALF_OPEN}
+    assert not breakers.allow(host)
+    breakers.record(host, False)
+    assert breakers.states() == {host: OPEN}
+
+    # A cancelled probe lets the next call probe
+    time.sleep(0.1)
+    assert breakers.allow(host)
+    breakers.record(host, None)
+    assert breakers.allow(host)
+    breakers.record(host, True)
+    assert breakers.states() == {host: CLOSED}
+    assert breakers.allow(host)
+
+
+def _half_open(tmp_path):
+    """Get a forwarder with the breaker of the dead host ready for a probe."""
+    forwarder = RequestForwarder(tmp_path / "blocklist.json", 1)
+    forwarder.set_circuit_breakers(CircuitBreakers(failures=1, cooldown=0.01))
+    host = Host(DEAD_HOST)
+    forwarder.breakers.record(host, False)
+    time.sleep(0.01)
+    return forwarder, host
+
+
+def test_probe_cancelled_in_slot(tmp_path):
+    """Test that a probe cancelled while it waits for its concurrency slot ends."""
+    forwarder, host = _half_open(tmp_path)
+    forwarder.set_concurrency_limiter(ConcurrencyLimiter(per_host=1))
+
+    async def run():
+        async with forwarder.limiter.slot(host):
+            probe = asyncio.ensure_future(
+                forwarder._request(None, "GET", host, "test", None, [], 1)
+            )
+            await asyncio.sleep(0.01)
+            probe.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await probe
+
+    asyncio.run(run())
+    assert forwarder.breakers.states() == {host: HALF_OPEN}
+    assert forwarder.breakers.allow(host)
+
+
+def test_hedge_of_probe(tmp_path):
+    """Test that the second request to a probed host isn't rejected by its breaker."""
+    forwarder, host = _half_open(tmp_path)
+    forwarder.set_adaptive_concurrency(AIMDLimit(initial=1))
+    assert forwarder.breakers.allow(host)
+
+    async def run():
+        async with forwarder.aimd.slot():
+            hedge = asyncio.ensure_future(
+                forwarder._request(None, "GET", host, "test", None, [], 1, hedge=True)
+            )
+            await asyncio.sleep(0.01)
+            assert not hedge.done()
+            hedge.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await hedge
+
+    asyncio.run(run())
+    # The first request still probes the host
+    assert not forwarder.breakers.allow(host)
+
+
+def test_circuit_breaker(farm, runner):
+    """Test that calls to a dead host fail right away after a few failures."""
+
+    def dead_host_status():
+        reply = runner.client("test", ["1"])
+        for h in farm.hosts:
+            assert reply["test"][h]["status"] == 200
+        return reply["test"][DEAD_HOST]["status"]
+
+    assert dead_host_status() == 0
+    assert dead_host_status() == 0
+    assert dead_host_status() == OPEN_STATUS
+
+    reply = runner.client("circuit-breakers")
+    # Only the breakers of the worker process that handled the call
+    assert isinstance(reply["circuit-breakers"]["http://coco/"]["reply"]["pid"], int)
+    breakers = reply["circuit-breakers"]["http://coco/"]["reply"]["breakers"]
+    assert breakers[str(Host(DEAD_HOST))] == {"state": OPEN, "failures": 2}
+    for h in farm.hosts:
+        assert breakers[str(Host(h))]["state"] == CLOSED
+
+    # The host gets probed after the cooldown
+    time.sleep(COOLDOWN)
+    assert dead_host_status() == 0
+    assert dead_host_status() == OPEN_STATUS
@@ -0,0 +1,111 @@
+"""Test coalescing identical requests."""
+import asyncio
+import time
+
+import pytest
+import requests
+from aiohttp import request
+from prometheus_client.parser import text_string_to_metric_families
+
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+
+PORT = 12055
+METRICS_PORT = 12056
+T_WAIT = 1
+N_CALLS = 3
+CONFIG = {
+    "log_level": "DEBUG",
+    "port": PORT,
+    "metrics_port": METRICS_PORT,
+    "worker_concurrency": 1,
+}
+ENDPOINTS = {
+    "coalesced": {
+        "group": "test",
+        "coalesce": True,
+        "before": [{"name": "wait", "request": {"duration": T_WAIT}}],
+    },
+}
+
+
+def callback(data):
+    """Reply with the incoming json request."""
+    return data
+
+
+N_HOSTS = 2
+CALLBACKS = {edpt: callback for edpt in ENDPOINTS}
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture
+def runner(farm):
+    """Create a coco runner."""
+    CONFIG["groups"] = {"test": farm.hosts}
+    with coco_runner.Runner(CONFIG, ENDPOINTS) as runner:
+        yield runner
+
+
+async def _client(endpoint, data, headers=None):
+    async with request(
+        "get", f"http://localhost:{PORT}/{endpoint}", json=data, headers=headers
+    ) as r:
+        return r.status, await r.json()
+
+
+def _call(*data, headers=None):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    start = time.time()
+    replies = loop.run_until_complete(
+        asyncio.gather(
+            *[
+                _client("coalesced", d, h)
+                for d, h in zip(data, headers or [None] * len(data))
+            ]
+        )
+    )
+    loop.close()
+    return time.time() - start, replies
+
+
+def _coalesced_count():
+    metrics = requests.get(f"http://localhost:{METRICS_PORT}/metrics")
+    for family in text_string_to_metric_families(metrics.text):
+        for sample in family.samples:
+            if sample.name == "coco_coalesced_request_total":
+                return sample.value
+    return None
+
+
+def test_coalesce(farm, runner):
+    """Test that identical requests share one call."""
+    data = {"coco_report_type": "FULL"}
+    t, replies = _call(*[data] * N_CALLS)
+
+    for status, reply in replies:
+        assert status == 200
+        assert reply == replies[0][1]
+        for h in farm.hosts:
+            assert h in reply["coalesced"]
+    # The calls didn't wait for each other in the queue
+    assert t < 2 * T_WAIT
+    assert _coalesced_count() == N_CALLS - 1
+
+    # Different requests are not coalesced
+    t, replies = _call({"coco_report_type": "FULL"}, {"coco_report_type": "OVERVIEW"})
+    assert t >= 2 * T_WAIT
+    assert _coalesced_count() == N_CALLS - 1
+
+    # Neither are requests of different priority classes
+    t, replies = _call(
+        data, data, headers=({"X-Coco-Priority": "high"}, {"X-Coco-Priority": "low"})
+    )
+    assert t >= 2 * T_WAIT
+    assert _coalesced_count() == N_CALLS - 1
@@ -0,0 +1,119 @@
+"""Test running queued requests concurrently."""
+import asyncio
+import time
+
+import pytest
+from aiohttp import request
+
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+
+PORT = 12055
+T_WAIT = 2
+CONFIG = {"log_level": "DEBUG", "port": PORT, "worker_concurrency": 2}
+ENDPOINTS = {
+    "do_wait": {
+        "group": "test",
+        "isolation": "shared",
+        "call": {"coco": {"name": "wait", "request": {"duration": T_WAIT}}},
+    },
+    "shared": {"group": "test", "isolation": "shared"},
+    "exclusive": {"group": "test", "isolation": "exclusive"},
+    "exclusive_wait": {
+        "group": "test",
+        "isolation": "exclusive",
+        "call": {"coco": {"name": "wait", "request": {"duration": T_WAIT}}},
+    },
+    # isolation: auto, doesn't touch the state
+    "stateless": {"group": "test"},
+    # isolation: auto
+    "wait_and_set_foo": {
+        "group": "test",
+        "call": {"coco": {"name": "wait", "request": {"duration": T_WAIT}}},
+        "set_state": {"foo/bar": 1},
+    },
+    "get_foo": {"call": {"forward": None}, "get_state": "foo"},
+    "get_other": {"call": {"forward": None}, "get_state": "other"},
+}
+
+
+def callback(data):
+    """Reply with the incoming json request."""
+    return data
+
+
+N_HOSTS = 2
+CALLBACKS = {edpt: callback for edpt in ENDPOINTS}
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture
+def runner(farm):
+    """Create a coco runner."""
+    CONFIG["groups"] = {"test": farm.hosts}
+    with coco_runner.Runner(CONFIG, ENDPOINTS) as runner:
+        yield runner
+
+
+async def _client(endpoint, sleep=None):
+    if sleep:
+        await asyncio.sleep(sleep)
+    async with request(
+        "get", f"http://localhost:{PORT}/{endpoint}", json={"coco_report_type": "FULL"}
+    ) as r:
+        return time.time(), await r.json()
+
+
+def _call_while_waiting(endpoint, wait_endpoint="do_wait"):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    start = time.time()
+    replies = loop.run_until_complete(
+        asyncio.gather(_client(wait_endpoint), _client(endpoint, sleep=0.2))
+    )
+    loop.close()
+    return [t - start for t, _ in replies], [r for _, r in replies]
+
+
+def test_shared(farm, runner):
+    """Test that shared endpoints don't wait for each other."""
+    (t_wait, t_shared), (_, reply) = _call_while_waiting("shared")
+
+    for h in farm.hosts:
+        assert h in reply["shared"]
+    assert t_wait >= T_WAIT
+    assert t_shared < T_WAIT
+
+
+def test_exclusive(farm, runner):
+    """Test that an exclusive endpoint waits for a running shared one."""
+    (t_wait, t_exclusive), (_, reply) = _call_while_waiting("exclusive")
+
+    for h in farm.hosts:
+        assert h in reply["exclusive"]
+    assert t_exclusive >= t_wait
+
+
+def test_exclusive_stateless(farm, runner):
+    """Test that an endpoint not touching the state waits for a running exclusive one."""
+    (_, t_stateless), (_, reply) = _call_while_waiting("stateless", "exclusive_wait")
+
+    for h in farm.hosts:
+        assert h in reply["stateless"]
+    assert t_stateless >= T_WAIT
+
+
+def test_auto(farm, runner):
+    """Test that endpoints only wait for others touching the same parts of the state."""
+    (t_wait, t_other), (_, reply) = _call_while_waiting("get_other", "wait_and_set_foo")
+    assert reply["success"]
+    assert t_other < T_WAIT
+
+    (t_wait, t_foo), (_, reply) = _call_while_waiting("get_foo", "wait_and_set_foo")
+    assert t_foo >= t_wait
+    assert reply["state"] == {"foo": {"bar": 1}}
@@ -0,0 +1,89 @@
+"""Test the limits of requests in flight to each host and group."""
+import time
+
+import pytest
+import requests
+from prometheus_client.parser import text_string_to_metric_families
+
+from coco.exceptions import ConfigError
+from coco.limiter import ConcurrencyLimiter
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+from coco.util import Host
+
+PORT = 12062
+SLOW = 1
+CONFIG = {
+    "log_level": "DEBUG",
+    "metrics_port": PORT,
+    "concurrency_limits": {"per_host": 1},
+}
+ENDPOINTS = {
+    "both": {
+        "group": "test",
+        "values": {"foo": "int"},
+        "call": {"forward": ["slow_a", "slow_b"]},
+        "parallel": ["forward"],
+    },
+}
+
+
+def callback(data):
+    """Reply with the incoming json request after a while."""
+    time.sleep(SLOW)
+    return data
+
+
+N_HOSTS = 2
+CALLBACKS = {"slow_a": callback, "slow_b": callback}
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture
+def runner(farm):
+    """Create a coco runner."""
+    CONFIG["groups"] = {"test": farm.hosts}
+    with coco_runner.Runner(CONFIG, ENDPOINTS) as runner:
+        yield runner
+
+
+def _wait_count():
+    metrics = requests.get(f"http://localhost:{PORT}/metrics")
+    count = 0
+    for metric in text_string_to_metric_families(metrics.text):
+        for sample in metric.samples:
+            if sample.name == "coco_limiter_wait_time_seconds_count":
+                count += sample.value
+    return count
+
+
+def test_per_host(farm, runner):
+    """Test that each host only gets one request at a time."""
+    start = time.time()
+    reply = runner.client("both", ["1"])
+    assert time.time() - start >= 2 * SLOW
+
+    assert reply["success"] is True
+    for name in ["slow_a", "slow_b"]:
+        for h in farm.hosts:
+            assert reply[name][h] == {"reply": {"foo": 1}, "status": 200}
+    assert _wait_count() == 2 * N_HOSTS
+
+
+def test_limits():
+    """Test which limits apply to a host."""
+    a, b = Host("localhost:1"), Host("localhost:2")
+    limiter = ConcurrencyLimiter(2, {b: 0}, {"x": 8, "y": 4, "z": 0})
+    limiter.add_group("y", [a, b])
+    limiter.add_group("x", [a])
+    limiter.add_group("z", [a])
+    assert limiter.limits(a) == [("group x", 8), ("group y", 4), (f"host {a}", 2)]
+    assert limiter.limits(b) == [("group y", 4)]
+
+    with pytest.raises(ConfigError):
+        ConcurrencyLimiter.from_config({"per_host": -1})
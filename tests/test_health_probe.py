@@ -0,0 +1,82 @@
+"""Test probing the hosts in the background."""
+import socket
+import time
+
+import pytest
+import requests
+from prometheus_client.parser import text_string_to_metric_families
+
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+from coco.util import Host
+
+PORT = 12059
+INTERVAL = 0.2
+CONFIG = {
+    "log_level": "DEBUG",
+    "metrics_port": PORT,
+    "health_probe": {"interval": INTERVAL},
+}
+ENDPOINTS = {
+    "test": {"group": "test", "values": {"foo": "int"}},
+}
+
+
+def callback(data):
+    """Reply with the incoming json request."""
+    return data
+
+
+N_HOSTS = 2
+CALLBACKS = {"test": callback}
+
+
+def _unused_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+DEAD_HOST = f"http://localhost:{_unused_port()}/"
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture(params=["list", "embedded"])
+def runner(farm, request):
+    """Create a coco runner with a host that doesn't answer."""
+    CONFIG["groups"] = {"test": farm.hosts + [DEAD_HOST]}
+    CONFIG["transport"] = request.param
+    if request.param == "embedded":
+        CONFIG["n_workers"] = 1
+        CONFIG["worker_pools"] = {}
+    with coco_runner.Runner(CONFIG, ENDPOINTS) as runner:
+        yield runner
+
+
+def _host_up():
+    metrics = requests.get(f"http://localhost:{PORT}/metrics")
+    up = {}
+    for metric in text_string_to_metric_families(metrics.text):
+        for sample in metric.samples:
+            if sample.name == "coco_host_up":
+                up[f"{sample.labels['host']}:{sample.labels['port']}"] = sample.value
+    return up
+
+
+def test_health_probe(farm, runner):
+    """Test that hosts that are down are not called."""
+    time.sleep(5 * INTERVAL)
+    up = _host_up()
+    assert up[str(Host(DEAD_HOST))] == 0
+    for h in farm.hosts:
+        assert up[str(Host(h))] == 1
+
+    reply = runner.client("test", ["1"])
+    for h in farm.hosts:
+        assert reply["test"][h]["status"] == 200
+    assert reply["test"][DEAD_HOST]["status"] == -1
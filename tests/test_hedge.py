@@ -0,0 +1,78 @@
+"""Test sending a second request to slow hosts."""
+import multiprocessing
+import time
+
+import pytest
+import requests
+from prometheus_client.parser import text_string_to_metric_families
+
+from coco.request_forwarder import HEDGE_MIN_REPLIES
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+
+PORT = 12057
+CONFIG = {"log_level": "DEBUG", "metrics_port": PORT, "timeout": "10s"}
+ENDPOINTS = {
+    "hedged": {
+        "group": "test",
+        "values": {"foo": "int"},
+        "call": {"forward": {"name": "slow", "hedge": 0.9}},
+    }
+}
+SLOW = 3
+N_HOSTS = 2
+
+
+class SlowOnce(object):
+    """Reply slowly to one request once enough replies were observed for hedging."""
+
+    def __init__(self):
+        self.count = multiprocessing.Value("i", 0)
+
+    def __call__(self, data):
+        with self.count.get_lock():
+            self.count.value += 1
+            n = self.count.value
+        if n == HEDGE_MIN_REPLIES + 1:
+            time.sleep(SLOW)
+        return data
+
+
+CALLBACKS = {"slow": SlowOnce()}
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    CALLBACKS["slow"].count.value = 0
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture(params=[{}, {"per_host": 1}])
+def runner(farm, request):
+    """Create a coco runner, with or without concurrency limits."""
+    CONFIG["groups"] = {"test": farm.hosts}
+    CONFIG["concurrency_limits"] = request.param
+    with coco_runner.Runner(CONFIG, ENDPOINTS) as runner:
+        yield runner
+
+
+def test_hedge(farm, runner):
+    """Test that a slow reply is replaced by the reply to a second request."""
+    for _ in range(HEDGE_MIN_REPLIES // N_HOSTS):
+        runner.client("hedged", ["1"])
+
+    start = time.time()
+    reply = runner.client("hedged", ["1"])
+    assert time.time() - start < SLOW
+    for h in farm.hosts:
+        assert reply["slow"][h]["status"] == 200
+
+    metrics = requests.get(f"http://localhost:{PORT}/metrics")
+    counts = {}
+    for metric in text_string_to_metric_families(metrics.text):
+        for sample in metric.samples:
+            if sample.name.startswith("coco_hedged_request"):
+                counts[sample.name] = sample.value
+    assert counts["coco_hedged_request_total"] >= 1
+    assert counts["coco_hedged_request_won_total"] >= 1
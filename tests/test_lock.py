@@ -0,0 +1,108 @@
+"""Test the readers/writer lock over state paths."""
+import asyncio
+
+from coco.lock import PathLock
+
+
+def test_lock_order():
+    """Test that readers share the lock and a writer keeps the order."""
+
+    async def run():
+        lock = PathLock()
+        r1 = lock.acquire({"": False})
+        r2 = lock.acquire({"": False})
+        w = lock.acquire({"": True})
+        r3 = lock.acquire({"": False})
+
+        assert r1.granted.done() and r2.granted.done()
+        assert not w.granted.done()
+        # The reader that came after the writer has to wait for it
+        assert not r3.granted.done()
+
+        lock.release(r1)
+        lock.release(r2)
+        assert w.granted.done()
+        assert not r3.granted.done()
+
+        lock.release(w)
+        assert r3.granted.done()
+
+        lock.release(r3)
+        assert not lock.locked
+
+    asyncio.run(run())
+
+
+def test_lock_subtrees():
+    """Test that writers on separate subtrees don't block each other."""
+
+    async def run():
+        lock = PathLock()
+        foo = lock.acquire({"foo": True})
+        bar = lock.acquire({"/bar/": True, "foo/x": False})
+        baz = lock.acquire({"baz/x": True})
+        everything = lock.acquire({"": False})
+        nothing = lock.acquire({})
+        baz_y = lock.acquire({"baz/y": False})
+
+        assert foo.granted.done()
+        # Reads inside the subtree that is being written
+        assert not bar.granted.done()
+        assert baz.granted.done()
+        assert not everything.granted.done()
+        assert nothing.granted.done()
+        # Doesn't conflict with anything queued before it
+        assert baz_y.granted.done()
+
+        lock.release(foo)
+        assert bar.granted.done()
+        assert not everything.granted.done()
+
+        lock.release(bar)
+        lock.release(baz)
+        assert everything.granted.done()
+
+    asyncio.run(run())
+
+
+def test_lock_cancel():
+    """Test that giving up a request doesn't block the queue."""
+
+    async def run():
+        lock = PathLock()
+        r = lock.acquire({"": False})
+        w = lock.acquire({"": True})
+        r2 = lock.acquire({"": False})
+        lock.release(w)
+        assert w.granted.cancelled()
+        assert r.granted.done() and r2.granted.done()
+
+        lock.release(r)
+        lock.release(r2)
+        assert not lock.locked
+
+    asyncio.run(run())
+
+
+def test_lock_exclusive_tree():
+    """Test that exclusive access to everything also blocks requests touching nothing."""
+
+    async def run():
+        lock = PathLock()
+        nothing = lock.acquire({})
+        everything = lock.acquire({"": True})
+        later = lock.acquire({})
+
+        assert nothing.granted.done()
+        assert not everything.granted.done()
+        # Doesn't overtake the exclusive request
+        assert not later.granted.done()
+
+        lock.release(nothing)
+        assert everything.granted.done()
+        assert not later.granted.done()
+
+        lock.release(everything)
+        assert later.granted.done()
+
+    asyncio.run(run())
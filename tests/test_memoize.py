@@ -0,0 +1,90 @@
+"""Test sharing the result of identical sub-calls within one request."""
+import pytest
+
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+
+CONFIG = {"log_level": "DEBUG"}
+STATUS = {"name": "status", "request": {"foo": 1}}
+ENDPOINTS = {
+    "status": {"group": "test", "values": {"foo": "int"}, "memoize": True},
+    "sub_a": {"group": "test", "call": {"forward": None}, "before": STATUS},
+    "sub_b": {"group": "test", "call": {"forward": None}, "before": STATUS},
+    "sub_check": {
+        "group": "test",
+        "call": {"forward": None},
+        "before": dict(STATUS, reply={"value": {"foo": 2}}),
+    },
+    "mixed": {
+        "group": "test",
+        "call": {"forward": None, "coco": ["sub_a", "sub_check"]},
+    },
+    "serial": {"group": "test", "call": {"forward": None, "coco": ["sub_a", "sub_b"]}},
+    "parallel": {
+        "group": "test",
+        "call": {"forward": None, "coco": ["sub_a", "sub_b"]},
+        "parallel": ["coco"],
+    },
+}
+
+
+def callback(data):
+    """Reply with the incoming json request."""
+    return data
+
+
+N_HOSTS = 2
+CALLBACKS = {"status": callback}
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture
+def runner(farm):
+    """Create a coco runner."""
+    CONFIG["groups"] = {"test": farm.hosts}
+    with coco_runner.Runner(CONFIG, ENDPOINTS) as runner:
+        yield runner
+
+
+def _status_calls(farm):
+    return [farm.counters()[p].get("status", 0) for p in farm.ports]
+
+
+@pytest.mark.parametrize("endpoint", ["serial", "parallel"])
+def test_memoize(farm, runner, endpoint):
+    """Test that the sub-endpoints share one status call per request."""
+    reply = runner.client(endpoint)
+    assert reply["success"] is True
+    for sub in ["sub_a", "sub_b"]:
+        for h in farm.hosts:
+            assert reply[sub]["status"]["status"][h] == {
+                "reply": {"foo": 1},
+                "status": 200,
+            }
+    assert _status_calls(farm) == [1] * N_HOSTS
+
+    # The next request calls the hosts again
+    runner.client(endpoint)
+    assert _status_calls(farm) == [2] * N_HOSTS
+
+
+def test_memoize_checks(farm, runner):
+    """Test that a failed check of one caller doesn't change the result of another."""
+    reply = runner.client("mixed")
+    assert _status_calls(farm) == [1] * N_HOSTS
+    assert reply["success"] is False
+
+    assert reply["sub_a"]["success"] is True
+    assert reply["sub_a"]["status"]["success"] is True
+    assert "failed_checks" not in reply["sub_a"]["status"]
+
+    assert reply["sub_check"]["success"] is False
+    for h in farm.hosts:
+        assert reply["sub_check"]["status"]["failed_checks"]["status"][h] == {
+            "reply": {"value": ["foo"]}
+        }
@@ -58,6 +58,8 @@ def test_metrics(farm, runner):
     count_coco = []
     count_forward = []
     count_wait_time = {}
+    connection_pool = {}
+    open_connections = None
     for metric in metrics:
         for sample in metric.samples:
             if sample.name == f"coco_dropped_request_total":
@@ -66,10 +68,14 @@ def test_metrics(farm, runner):
                 count_forward.append(sample)
             elif sample.name == "coco_queue_wait_time_seconds_count":
                 count_wait_time[sample.labels["endpoint"]] = sample
+            elif sample.name == "coco_connection_pool_request_total":
+                connection_pool[sample.labels["result"]] = sample.value
+            elif sample.name == "coco_open_connections":
+                open_connections = sample.value
 
     # Only expect one endpoint call
     assert (
-        len(count_coco) == 8
+        len(count_coco) == 9
     )  # 1, plus two from internal metrics. Needs to be kept up to date
     count_coco = count_coco[0]
     assert list(count_coco.labels.keys()) == ["endpoint"]
@@ -93,4 +99,8 @@ def test_metrics(farm, runner):
     assert len(count_wait_time) == 1
     assert count_wait_time["status"].value == 2
 
+    # One connection per host, reused for the following calls
+    assert connection_pool == {"miss": N_HOSTS, "hit": N_HOSTS * (N_CALLS - 1)}
+    assert open_connections == N_HOSTS
+
     del metrics
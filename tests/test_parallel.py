@@ -0,0 +1,70 @@
+"""Test calling the forwards of an endpoint at the same time."""
+import time
+
+import pytest
+
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+
+SLOW = 1
+SUB_ENDPOINTS = ["status_a", "status_b", "status_c"]
+CONFIG = {"log_level": "DEBUG"}
+ENDPOINTS = {
+    name: {"group": "test", "values": {"foo": "int"}} for name in SUB_ENDPOINTS
+}
+ENDPOINTS["serial"] = {
+    "group": "test",
+    "values": {"foo": "int"},
+    "call": {"forward": None, "coco": SUB_ENDPOINTS},
+}
+ENDPOINTS["parallel"] = {
+    "group": "test",
+    "values": {"foo": "int"},
+    "call": {"forward": None, "coco": SUB_ENDPOINTS},
+    "parallel": ["coco"],
+}
+
+
+def callback(data):
+    """Reply with the incoming json request after a while."""
+    time.sleep(SLOW)
+    return data
+
+
+N_HOSTS = 2
+CALLBACKS = {name: callback for name in SUB_ENDPOINTS}
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture
+def runner(farm):
+    """Create a coco runner."""
+    CONFIG["groups"] = {"test": farm.hosts}
+    with coco_runner.Runner(CONFIG, ENDPOINTS) as runner:
+        yield runner
+
+
+def _call(runner, endpoint):
+    start = time.time()
+    reply = runner.client(endpoint, ["1"])
+    return reply, time.time() - start
+
+
+def test_parallel(farm, runner):
+    """Test that parallel forwards take as long as the slowest and reply the same."""
+    serial, t_serial = _call(runner, "serial")
+    parallel, t_parallel = _call(runner, "parallel")
+    assert t_serial >= len(SUB_ENDPOINTS) * SLOW
+    assert t_parallel < 2 * SLOW
+
+    assert parallel["success"] is True
+    assert list(parallel) == list(serial)
+    for name in SUB_ENDPOINTS:
+        assert parallel[name] == serial[name]
+        for h in farm.hosts:
+            assert parallel[name][name][h] == {"reply": {"foo": 1}, "status": 200}
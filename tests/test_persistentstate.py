@@ -24,6 +24,7 @@ def test_state(tmp_path):
 
     # Check that state is set to be the same
     assert ps.state == test_state
+    assert ps.version == 1
     # ... but also that it is a copy not a reference
     assert ps.state is not test_state
     assert ps._state is not test_state
@@ -42,6 +43,7 @@ def test_state(tmp_path):
 
     # Test that the state has not changed
     assert ps.state == test_state
+    assert ps.version == 1
 
     # Test that the state has not changed on disk either
     with p.open("r") as fh:
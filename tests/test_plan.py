@@ -0,0 +1,97 @@
+"""Test the execution plans of the endpoints."""
+import pytest
+
+from coco.exceptions import ConfigError
+from coco.plan import Plans
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+
+CONFIG = {"log_level": "DEBUG", "forward_concurrency": 1}
+ENDPOINTS = {
+    "a": {"group": "test", "values": {"foo": "int"}},
+    "c": {"group": "test", "values": {"foo": "int"}},
+    "b": {"group": "test", "values": {"foo": "int"}, "call": {"coco": "c"}},
+    "top": {
+        "group": "test",
+        "values": {"foo": "int"},
+        "call": {"forward": None, "coco": ["a", "b"]},
+        "parallel": ["coco"],
+    },
+    "twice": {
+        "group": "test",
+        "values": {"foo": "int"},
+        "call": {"forward": None},
+        "before": "a",
+        "after": "a",
+    },
+}
+
+
+def callback(data):
+    """Reply with the incoming json request."""
+    return data
+
+
+N_HOSTS = 2
+CALLBACKS = {name: callback for name in ["a", "b", "c"]}
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture
+def runner(farm):
+    """Create a coco runner."""
+    config = dict(CONFIG, groups={"test": farm.hosts})
+    with coco_runner.Runner(config, ENDPOINTS) as runner:
+        yield runner
+
+
+def _plan(runner, endpoint):
+    reply = runner.client("plan", [endpoint])
+    return reply["plan"]["http://coco/"]["reply"][endpoint]
+
+
+def test_plan(farm, runner):
+    """Test the critical path and fan-out of nested endpoints."""
+    plan = _plan(runner, "top")
+    assert plan["rounds"] == 2
+    assert plan["critical_path"] == ["/b", "b (test)", "/c", "c (test)"]
+    assert plan["fan_out"] == 3 * N_HOSTS
+    assert plan["stages"] == [
+        {"stage": "coco", "parallel": True, "forwards": ["/a", "/b"]}
+    ]
+    assert plan["shared"] == {}
+
+    plan = _plan(runner, "twice")
+    assert plan["rounds"] == 2
+    assert plan["shared"] == {"a": 2}
+
+    # Forwards still work with the concurrency limit
+    reply = runner.client("top", ["1"])
+    assert reply["success"] is True
+    for h in farm.hosts:
+        assert reply["a"]["a"][h] == {"reply": {"foo": 1}, "status": 200}
+
+
+class _Linked:
+    def __init__(self, *linked):
+        self.linked = list(linked)
+
+    def linked_endpoints(self):
+        return self.linked
+
+
+def test_cycle():
+    """Test that endpoints calling each other in a cycle are rejected."""
+    endpoints = {"x": _Linked("y"), "y": _Linked("z"), "z": _Linked("x")}
+    with pytest.raises(ConfigError) as excinfo:
+        Plans(endpoints, {}).compile()
+    assert "/x -> /y -> /z -> /x" in excinfo.value.message
+
+    with pytest.raises(ConfigError) as excinfo:
+        Plans({"x": _Linked("nope")}, {}).compile()
+    assert "does not exist" in excinfo.value.message
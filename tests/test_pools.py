@@ -0,0 +1,80 @@
+"""Test running endpoints in separate worker pools."""
+import asyncio
+import time
+
+import pytest
+from aiohttp import request
+
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+
+PORT = 12055
+T_WAIT = 2
+CONFIG = {
+    "log_level": "DEBUG",
+    "port": PORT,
+    "worker_pools": {"slow": {"processes": 2}},
+}
+ENDPOINTS = {
+    "do_wait": {
+        "group": "test",
+        "pool": "slow",
+        "call": {"coco": {"name": "wait", "request": {"duration": T_WAIT}}},
+    },
+    "fast": {"group": "test"},
+    "also_slow": {"group": "test", "pool": "slow"},
+}
+
+
+def callback(data):
+    """Reply with the incoming json request."""
+    return data
+
+
+N_HOSTS = 2
+CALLBACKS = {edpt: callback for edpt in ENDPOINTS}
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture
+def runner(farm):
+    """Create a coco runner."""
+    CONFIG["groups"] = {"test": farm.hosts}
+    with coco_runner.Runner(CONFIG, ENDPOINTS) as runner:
+        yield runner
+
+
+async def _client(endpoint, sleep=None):
+    if sleep:
+        await asyncio.sleep(sleep)
+    async with request(
+        "get", f"http://localhost:{PORT}/{endpoint}", json={"coco_report_type": "FULL"}
+    ) as r:
+        return time.time(), await r.json()
+
+
+def _call_while_waiting(endpoint):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    start = time.time()
+    replies = loop.run_until_complete(
+        asyncio.gather(_client("do_wait"), _client(endpoint, sleep=0.2))
+    )
+    loop.close()
+    return [t - start for t, _ in replies], [r for _, r in replies]
+
+
+def test_pools(farm, runner):
+    """Test that a busy pool doesn't hold up other pools or its other processes."""
+    for endpoint in ("fast", "also_slow"):
+        (t_wait, t_other), (_, reply) = _call_while_waiting(endpoint)
+
+        for h in farm.hosts:
+            assert h in reply[endpoint]
+        assert t_wait >= T_WAIT
+        assert t_other < T_WAIT
@@ -0,0 +1,118 @@
+"""Test priority classes of the request queue."""
+import asyncio
+import time
+
+import pytest
+from aiohttp import request
+
+from coco.priority import WeightedRoundRobin
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+
+PORT = 12055
+T_WAIT = 2
+CONFIG = {"log_level": "DEBUG", "port": PORT, "worker_concurrency": 1}
+ENDPOINTS = {
+    "do_wait": {
+        "group": "test",
+        "priority": "low",
+        "call": {"coco": {"name": "wait", "request": {"duration": T_WAIT}}},
+    },
+    "slow_low": {
+        "group": "test",
+        "priority": "low",
+        "call": {"coco": {"name": "wait", "request": {"duration": 1}}},
+    },
+    "fast": {"group": "test"},
+}
+
+
+def callback(data):
+    """Reply with the incoming json request."""
+    return data
+
+
+N_HOSTS = 2
+CALLBACKS = {edpt: callback for edpt in ENDPOINTS}
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture
+def runner(farm):
+    """Create a coco runner."""
+    CONFIG["groups"] = {"test": farm.hosts}
+    with coco_runner.Runner(CONFIG, ENDPOINTS) as runner:
+        yield runner
+
+
+def test_round_robin():
+    """Test that classes are served in proportion to their weights."""
+    rr = WeightedRoundRobin({"high": 3, "low": 1})
+    served = []
+    for _ in range(8):
+        name = rr.order()[0]
+        rr.served(name)
+        served.append(name)
+    assert served.count("high") == 6
+    assert served.count("low") == 2
+    assert served[0] == "high"
+
+
+def test_round_robin_empty():
+    """Test that a class doesn't save up credit while it is empty."""
+    rr = WeightedRoundRobin({"high": 3, "low": 1})
+    # Only low requests are waiting for a while
+    for _ in range(10):
+        rr.served("low")
+    # Then high requests come in, low still gets its share
+    served = []
+    for _ in range(8):
+        name = rr.order()[0]
+        rr.served(name)
+        served.append(name)
+    assert served.count("low") == 2
+
+
+async def _client(endpoint, sleep=None, headers=None):
+    if sleep:
+        await asyncio.sleep(sleep)
+    async with request(
+        "get",
+        f"http://localhost:{PORT}/{endpoint}",
+        json={"coco_report_type": "FULL"},
+        headers=headers,
+    ) as r:
+        return time.time(), r.status
+
+
+def _run(*calls):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    replies = loop.run_until_complete(asyncio.gather(*calls))
+    loop.close()
+    return replies
+
+
+def test_priority(farm, runner):
+    """Test that a call of a higher class overtakes queued calls of lower classes."""
+    (_, _), (t_low, _), (t_fast, status) = _run(
+        _client("do_wait"), _client("slow_low", sleep=0.2), _client("fast", sleep=0.4)
+    )
+    assert status == 200
+    assert t_fast < t_low
+
+    # The header overwrites the class of the endpoint
+    (_, _), (t_low, _), (t_fast, _) = _run(
+        _client("do_wait"),
+        _client("slow_low", sleep=0.2),
+        _client("fast", sleep=0.4, headers={"X-Coco-Priority": "low"}),
+    )
+    assert t_fast > t_low
+
+    (_, status) = _run(_client("fast", headers={"X-Coco-Priority": "unknown"}))[0]
+    assert status == 400
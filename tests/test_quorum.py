@@ -0,0 +1,82 @@
+"""Test completing forwards once a quorum of hosts replied."""
+import multiprocessing
+import time
+
+import pytest
+
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+
+CONFIG = {"log_level": "DEBUG", "timeout": "10s"}
+ENDPOINTS = {
+    "count": {
+        "group": "test",
+        "values": {"foo": "int"},
+        "call": {"forward": {"name": "slow", "quorum": 1}},
+    },
+    "fraction": {
+        "group": "test",
+        "values": {"foo": "int"},
+        "call": {"forward": {"name": "slow", "quorum": 0.5}},
+    },
+    "all": {
+        "group": "test",
+        "values": {"foo": "int"},
+        "call": {"forward": {"name": "slow", "quorum": 1.0}},
+    },
+}
+SLOW = 3
+N_HOSTS = 2
+
+
+class FirstFast(object):
+    """Reply right away to the first of every N_HOSTS calls and slowly to the others."""
+
+    def __init__(self):
+        self.count = multiprocessing.Value("i", 0)
+
+    def __call__(self, data):
+        with self.count.get_lock():
+            self.count.value += 1
+            n = self.count.value
+        if n % N_HOSTS != 1:
+            time.sleep(SLOW)
+        return data
+
+
+CALLBACKS = {"slow": FirstFast()}
+
+
+@pytest.fixture(scope="module")
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture(scope="module")
+def runner(farm):
+    """Create a coco runner."""
+    CONFIG["groups"] = {"test": farm.hosts}
+    with coco_runner.Runner(CONFIG, ENDPOINTS) as runner:
+        yield runner
+
+
+@pytest.mark.parametrize("endpoint", ["count", "fraction"])
+def test_quorum(farm, runner, endpoint):
+    """Test that the forward doesn't wait for the slow host."""
+    start = time.time()
+    reply = runner.client(endpoint, ["1"])
+    assert time.time() - start < SLOW
+    assert reply["success"] is True
+    assert len(reply["slow"]) == 1
+    # Let the slow host finish before the next call
+    time.sleep(SLOW)
+
+
+def test_all(farm, runner):
+    """Test waiting for all hosts."""
+    start = time.time()
+    reply = runner.client("all", ["1"])
+    assert time.time() - start >= SLOW
+    assert reply["success"] is True
+    assert len(reply["slow"]) == N_HOSTS
@@ -0,0 +1,104 @@
+"""Test calling hosts through a relay coco instance."""
+import time
+
+import pytest
+import requests
+from prometheus_client.parser import text_string_to_metric_families
+
+from coco.request_forwarder import _pack_replies, _unpack_replies
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+from coco.util import Host
+
+RELAY_PORT = 12060
+METRICS_PORT = 12056
+INTERVAL = 0.2
+CONFIG = {
+    "log_level": "DEBUG",
+    "port": 12055,
+    "metrics_port": METRICS_PORT,
+    "transport": "list",
+}
+RELAY_CONFIG = {
+    "log_level": "DEBUG",
+    "port": RELAY_PORT,
+    "metrics_port": 12061,
+    "transport": "embedded",
+    "n_workers": 1,
+    "worker_pools": {},
+    "relay": True,
+}
+ENDPOINTS = {
+    "test": {"group": "test", "values": {"foo": "int"}},
+    "quorum": {
+        "group": "test",
+        "values": {"foo": "int"},
+        "call": {"forward": {"name": "test", "quorum": 1.0}},
+    },
+}
+
+
+def callback(data):
+    """Reply with the incoming json request."""
+    return data
+
+
+N_HOSTS = 4
+CALLBACKS = {"test": callback}
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture
+def runner(farm):
+    """Create a coco runner that calls half of the hosts through a relay."""
+    relayed = farm.hosts[N_HOSTS // 2 :]
+    RELAY_CONFIG["groups"] = {"test": relayed}
+    with coco_runner.Runner(RELAY_CONFIG, ENDPOINTS):
+        CONFIG["groups"] = {"test": farm.hosts}
+        CONFIG["relays"] = {f"localhost:{RELAY_PORT}": relayed}
+        CONFIG["relay"] = False
+        CONFIG["health_probe"] = {"interval": INTERVAL}
+        with coco_runner.Runner(CONFIG, ENDPOINTS) as runner:
+            yield runner
+
+
+def test_pack_replies():
+    """Test that identical replies are sent once."""
+    hosts = [Host(f"localhost:{port}") for port in range(3)]
+    replies = {hosts[0]: ({"a": 1}, 200), hosts[1]: ({"a": 1}, 200), hosts[2]: ("x", 0)}
+    packed = _pack_replies(replies)
+    assert packed["replies"] == [{"a": 1}, "x"]
+    assert _unpack_replies(packed, hosts) == replies
+
+
+def test_relay(farm, runner):
+    """Test that relayed hosts are called once and their replies merged."""
+    reply = runner.client("test", ["1"])
+    assert reply["success"] is True
+    for h in farm.hosts:
+        assert reply["test"][h] == {"reply": {"foo": 1}, "status": 200}
+    for p in farm.ports:
+        assert farm.counters()[p]["test"] == 1
+
+    # Relayed replies count for the quorum
+    reply = runner.client("quorum", ["1"])
+    assert reply["success"] is True
+    for h in farm.hosts:
+        assert reply["test"][h]["status"] == 200
+
+
+def test_relay_probes(farm, runner):
+    """Test that relayed hosts are left to the relay to probe."""
+    time.sleep(5 * INTERVAL)
+    metrics = requests.get(f"http://localhost:{METRICS_PORT}/metrics")
+    probed = set()
+    for metric in text_string_to_metric_families(metrics.text):
+        for sample in metric.samples:
+            if sample.name == "coco_host_up":
+                probed.add(Host(f"{sample.labels['host']}:{sample.labels['port']}"))
+    assert probed == {Host(h) for h in farm.hosts[: N_HOSTS // 2]}
@@ -0,0 +1,119 @@
+"""Test retrying failed calls to hosts."""
+import multiprocessing
+
+import pytest
+import requests
+from prometheus_client.parser import text_string_to_metric_families
+from werkzeug.exceptions import ServiceUnavailable
+
+from coco.endpoint import Endpoint
+from coco.exceptions import ConfigError
+from coco.state import State
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+
+PORT = 12058
+CONFIG = {"log_level": "DEBUG", "metrics_port": PORT}
+ENDPOINTS = {
+    "retry_some": {
+        "group": "test",
+        "values": {"foo": "int"},
+        "call": {
+            "forward": {
+                "name": "flaky_some",
+                "retry": {"attempts": 2, "backoff": 0.01, "budget": 0.5},
+            }
+        },
+    },
+    "retry_all": {
+        "group": "test",
+        "values": {"foo": "int"},
+        "call": {
+            "forward": {
+                "name": "flaky_all",
+                "retry": {"attempts": 2, "backoff": 0.01, "budget": 1.0},
+            }
+        },
+    },
+}
+N_HOSTS = 2
+
+
+class FailFirst(object):
+    """Reply with status 503 to the first call of each host."""
+
+    def __init__(self):
+        self.count = multiprocessing.Value("i", 0)
+
+    def __call__(self, data):
+        with self.count.get_lock():
+            self.count.value += 1
+            n = self.count.value
+        if n <= N_HOSTS:
+            raise ServiceUnavailable()
+        return data
+
+
+CALLBACKS = {"flaky_some": FailFirst(), "flaky_all": FailFirst()}
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture
+def runner(farm):
+    """Create a coco runner."""
+    CONFIG["groups"] = {"test": farm.hosts}
+    with coco_runner.Runner(CONFIG, ENDPOINTS) as runner:
+        yield runner
+
+
+def _calls(endpoint):
+    metrics = requests.get(f"http://localhost:{PORT}/metrics")
+    calls = {}
+    retried = 0
+    for metric in text_string_to_metric_families(metrics.text):
+        for sample in metric.samples:
+            if sample.labels.get("endpoint") != endpoint:
+                continue
+            if sample.name == "coco_calls_total":
+                status = sample.labels["status"]
+                calls[status] = calls.get(status, 0) + sample.value
+            elif sample.name == "coco_retried_request_total":
+                retried += sample.value
+    return calls, retried
+
+
+def test_retry(farm, runner):
+    """Test that failed calls are retried within the budget."""
+    reply = runner.client("retry_all", ["1"])
+    assert [reply["flaky_all"][h]["status"] for h in farm.hosts] == [200, 200]
+    assert _calls("flaky_all") == ({"503": 2, "200": 2}, 2)
+
+    # Only one of the two hosts may be retried
+    reply = runner.client("retry_some", ["1"])
+    statuses = sorted(reply["flaky_some"][h]["status"] for h in farm.hosts)
+    assert statuses == [200, 503]
+    assert _calls("flaky_some") == ({"503": 2, "200": 1}, 1)
+
+
+@pytest.mark.parametrize("option", [{"hedge": 0.9}, {"retry": {"attempts": 2}}])
+def test_not_idempotent(option, tmp_path):
+    """Test that hosts are only called twice by forwards marked as idempotent."""
+    state = State("DEBUG", tmp_path, default_state_files={}, exclude_from_reset=[])
+    forward = dict(option, name="flaky_some")
+    conf = {"group": "test", "type": "POST", "call": {"forward": forward}}
+    with pytest.raises(ConfigError) as excinfo:
+        Endpoint("post", conf, None, state)
+    assert "idempotent" in excinfo.value.message
+
+    forward["idempotent"] = True
+    Endpoint("post", conf, None, state)
+
+    conf = {"group": "test", "save_state": "x", "call": {"forward": forward}}
+    forward["idempotent"] = False
+    with pytest.raises(ConfigError):
+        Endpoint("get", conf, None, state)
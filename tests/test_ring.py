@@ -0,0 +1,57 @@
+"""Test the shared memory ring buffer."""
+import sys
+
+import pytest
+
+from coco.exceptions import ConfigError
+from coco.ring import RingBuffer
+from coco.transport import get_transport
+
+
+@pytest.fixture
+def ring():
+    """Create a small ring buffer."""
+    ring = RingBuffer(32)
+    yield ring
+    ring.unlink()
+
+
+def test_order(ring):
+    """Test messages come out in the order they went in."""
+    assert ring.get() is None
+    assert ring.put(b"foo")
+    assert ring.put(b"")
+    assert ring.put(b"bar")
+    assert len(ring) == 3
+    assert ring.get() == b"foo"
+    assert ring.get() == b""
+    assert ring.get() == b"bar"
+    assert ring.get() is None
+    assert len(ring) == 0
+
+
+def test_full(ring):
+    """Test messages that don't fit are refused."""
+    assert not ring.put(b"x" * 29)
+    assert ring.put(b"x" * 28)
+    assert not ring.put(b"")
+    assert ring.get() == b"x" * 28
+    assert ring.put(b"")
+
+
+def test_wrap_around(ring):
+    """Test messages wrapping around the end of the buffer."""
+    for i in range(20):
+        message = bytes(range(i, i + 10))
+        assert ring.put(message)
+        assert ring.put(message[::-1])
+        assert ring.get() == message
+        assert ring.get() == message[::-1]
+
+
+def test_no_shared_memory(monkeypatch):
+    """Test that the shm transport is rejected on Python versions without shared memory."""
+    monkeypatch.setitem(sys.modules, "multiprocessing.shared_memory", None)
+    with pytest.raises(ConfigError) as excinfo:
+        get_transport("shm", 10)
+    assert "Python >= 3.8" in excinfo.value.message
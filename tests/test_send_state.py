@@ -0,0 +1,58 @@
+"""Test forwarding blocks of the state."""
+import json
+import tempfile
+
+import pytest
+
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+
+CONFIG = {"log_level": "DEBUG"}
+ENDPOINTS = {
+    "send": {"group": "test", "send_state": "conf"},
+    "change": {
+        "group": "test",
+        "values": {"foo": "int"},
+        "save_state": "conf",
+    },
+}
+
+
+def callback(data):
+    """Reply with the incoming json request."""
+    return data
+
+
+CALLBACKS = {endpt: callback for endpt in ENDPOINTS}
+STATEFILE = tempfile.NamedTemporaryFile("w")
+N_HOSTS = 2
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture
+def runner(farm):
+    """Create a coco runner."""
+    CONFIG["groups"] = {"test": farm.hosts}
+    json.dump({"foo": 0, "bar": "a"}, STATEFILE)
+    STATEFILE.flush()
+    CONFIG["load_state"] = {"conf": STATEFILE.name}
+    with coco_runner.Runner(CONFIG, ENDPOINTS, reset_on_start=True) as runner:
+        yield runner
+
+
+def test_send_state(farm, runner):
+    """Test that the hosts get the current state, also when it was sent before."""
+    for _ in range(2):
+        reply = runner.client("send")
+        for h in farm.hosts:
+            assert reply["send"][h]["reply"] == {"foo": 0, "bar": "a"}
+
+    runner.client("change", ["1"])
+    reply = runner.client("send")
+    for h in farm.hosts:
+        assert reply["send"][h]["reply"] == {"foo": 1, "bar": "a"}
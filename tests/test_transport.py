@@ -0,0 +1,243 @@
+"""Test the transports between frontend and worker."""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from coco.test import coco_runner
+from coco.test import endpoint_farm
+from coco.transport import ATTACHED, FULL, QUEUED, StreamTransport, TRANSPORTS
+from coco.worker import _repeatable
+
+CONFIG = {"log_level": "DEBUG", "queue_length": 10, "worker_pools": {}}
+ENDPOINTS = {
+    "test": {
+        "group": "test",
+        "call": {"forward": "test"},
+        "values": {"foo": "int"},
+    },
+    "coalesced": {
+        "group": "test",
+        "call": {"forward": "test"},
+        "values": {"foo": "int"},
+        "coalesce": True,
+    },
+}
+
+
+def callback(data):
+    """Reply with the incoming json request."""
+    return data
+
+
+N_HOSTS = 2
+CALLBACKS = {"test": callback}
+REDIS_TRANSPORTS = [name for name, t in TRANSPORTS.items() if t.uses_redis]
+
+
+@pytest.fixture
+def farm():
+    """Create an endpoint test farm."""
+    return endpoint_farm.Farm(N_HOSTS, CALLBACKS)
+
+
+@pytest.fixture(params=list(TRANSPORTS))
+def runner(request, farm):
+    """Create a coco runner for each transport."""
+    CONFIG["groups"] = {"test": farm.hosts}
+    CONFIG["transport"] = request.param
+    with coco_runner.Runner(CONFIG, ENDPOINTS) as runner:
+        yield runner
+    CONFIG["transport"] = "list"
+
+
+def test_call(farm, runner):
+    """Test calling endpoints through each transport."""
+    for endpoint in ENDPOINTS:
+        reply = runner.client(endpoint, ["1"])
+        for h in farm.hosts:
+            assert h in reply["test"]
+            assert reply["test"][h]["status"] == 200
+            assert reply["test"][h]["reply"] == {"foo": 1}
+
+
+def _task(name):
+    return {
+        "name": name,
+        "method": "GET",
+        "endpoint": "test",
+        "request": "{}",
+        "params": "",
+        "received": time.time(),
+    }
+
+
+@pytest.mark.parametrize("name", list(TRANSPORTS))
+def test_enqueue(name):
+    """Test queue length limit and coalescing."""
+    queue = f"test-enqueue-{time.time()}"
+
+    async def run():
+        transport = TRANSPORTS[name](10)
+        transport.setup([queue])
+        await transport.connect(listen=True)
+
+        a, b, c, d = [_task(f"{queue}-{x}") for x in "abcd"]
+        assert await transport.enqueue(queue, a, 2) == QUEUED
+        key = f"coalesce:{queue}"
+        assert await transport.enqueue(queue, b, 2, coalesce=key) == QUEUED
+        assert await transport.enqueue(queue, c, 2, coalesce=key) == ATTACHED
+        assert await transport.enqueue(queue, d, 2) == FULL
+        assert transport.length(queue) == 2
+
+        # Answering b also answers c
+        await transport.receive([queue], 1)
+        q, task = await transport.receive([queue], 1)
+        assert task["name"] == b["name"]
+        await transport.reply(q, task, 200, '"b"')
+        assert await transport.wait(c["name"]) == (200, '"b"')
+        assert await transport.wait(b["name"]) == (200, '"b"')
+
+        await transport.close()
+        transport.cleanup()
+
+    asyncio.run(run())
+
+
+def test_stream_recovery():
+    """Test that a task taken by a worker that died is run after a restart."""
+    queue = f"test-recovery-{time.time()}"
+
+    async def run():
+        frontend = StreamTransport(10)
+        frontend.setup([queue])
+        await frontend.connect()
+        task = _task(f"{queue}-a")
+        await frontend.enqueue(queue, task)
+
+        # A worker takes the task and dies
+        worker = StreamTransport(10, consumer="worker-0")
+        await worker.connect()
+        _, task = await worker.receive([queue], 1)
+        assert task["name"] == f"{queue}-a"
+        await worker.close()
+        assert await worker_receive_nothing(queue, "worker-1")
+
+        # It gets the task again after a restart
+        worker = StreamTransport(10, consumer="worker-0")
+        await worker.connect()
+        q, task = await worker.receive([queue], 1)
+        assert task["name"] == f"{queue}-a"
+        assert task["_recovered"] is True
+        await worker.reply(q, task, 200, '"a"')
+        assert await frontend.wait(f"{queue}-a") == (200, '"a"')
+
+        # Once answered, it's gone
+        await worker.close()
+        worker = StreamTransport(10, consumer="worker-0")
+        await worker.connect()
+        assert await worker.receive([queue], 1) is None
+
+        await worker.close()
+        await frontend.close()
+
+    async def worker_receive_nothing(queue, consumer):
+        # Other workers don't get it
+        worker = StreamTransport(10, consumer=consumer)
+        await worker.connect()
+        nothing = await worker.receive([queue], 1) is None
+        await worker.close()
+        return nothing
+
+    asyncio.run(run())
+
+
+def test_stream_claim():
+    """Test that tasks of a worker that doesn't come back are dropped by the others."""
+    queue = f"test-claim-{time.time()}"
+    ttl = 1
+
+    async def run():
+        frontend = StreamTransport(ttl)
+        frontend.setup([queue])
+        await frontend.connect()
+        await frontend.enqueue(queue, _task(f"{queue}-a"))
+
+        # A worker takes the task and never comes back
+        worker = StreamTransport(ttl, consumer="worker-0")
+        await worker.connect()
+        _, task = await worker.receive([queue], 1)
+        assert task["name"] == f"{queue}-a"
+        await worker.close()
+
+        # Another worker takes it over once it is idle for long enough, but the frontend
+        # doesn't wait for it any more
+        await asyncio.sleep(ttl + 0.1)
+        worker = StreamTransport(ttl, consumer="worker-1")
+        await worker.connect()
+        assert await worker.receive([queue], 0.1) is None
+        stream = frontend._key(queue)
+        assert (await frontend._redis.xpending(stream, frontend.GROUP))["pending"] == 0
+
+        await worker.close()
+        await frontend.close()
+
+    asyncio.run(run())
+
+
+def test_repeatable():
+    """Test which recovered calls a worker runs again."""
+    assert _repeatable(SimpleNamespace(type="GET", state_locks={"a": False}))
+    assert not _repeatable(SimpleNamespace(type="GET", state_locks={"a": True}))
+    assert not _repeatable(SimpleNamespace(type="POST", state_locks={}))
+    assert not _repeatable(None)
+
+
+@pytest.mark.parametrize("name", REDIS_TRANSPORTS)
+def test_listener(name):
+    """Test handing many results to the waiting requests through one listener."""
+    queue = f"test-listener-{time.time()}"
+    n_tasks = 200
+
+    async def run():
+        frontend = TRANSPORTS[name](10)
+        frontend.setup([queue])
+        await frontend.connect(listen=True)
+        worker = TRANSPORTS[name](10)
+        worker.consumer = "worker-0"
+        await worker.connect()
+
+        async def work():
+            while True:
+                reply = await worker.receive([queue], 1)
+                if reply is not None:
+                    q, task = reply
+                    await worker.reply(q, task, 200, f'"{task["name"]}"')
+
+        async def request(i):
+            task = _task(f"{queue}-{i}")
+            await frontend.enqueue(queue, task, coalesce=f"{queue}:{i % 10}")
+            return await frontend.wait(task["name"])
+
+        # The results of queued and of attached requests find their way back
+        worker_task = asyncio.ensure_future(work())
+        replies = await asyncio.gather(*[request(i) for i in range(n_tasks)])
+        for code, _ in replies:
+            assert code == 200
+        assert not frontend._waiting
+
+        # Requests of frontends without a listener still get their result
+        other = TRANSPORTS[name](10)
+        other.setup([queue])
+        await other.connect()
+        task = _task(f"{queue}-blocking")
+        await other.enqueue(queue, task)
+        assert await other.wait(task["name"]) == (200, f'"{task["name"]}"')
+
+        worker_task.cancel()
+        await other.close()
+        await worker.close()
+        await frontend.close()
+
+    asyncio.run(run())